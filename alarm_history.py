@@ -0,0 +1,261 @@
+# alarm_history.py - Append-only history of alarm events, with running aggregates
+#
+# Every fire, snooze, dismissal and distance challenge outcome is appended
+# as one fixed-width binary record (RECORD, 32 bytes) to ALARM_HISTORY_FILE:
+#
+#   at       float64  when it happened (epoch seconds)
+#   value    float32  minutes snoozed, seconds to dismiss, seconds the challenge took
+#   kind     uint8    FIRE, SNOOZE, DISMISS or CHALLENGE
+#   flags    uint8    FLAG_* bits (early, automatic, passed)
+#   alarm_id 16 bytes ASCII, NUL padded
+#
+# Both processes append to the same file (O_APPEND keeps each record whole)
+# and fold in only the records past the ones they have already seen, so
+# the aggregates (counts and running medians per alarm and per weekday)
+# are updated once per event and never recomputed from the whole file.
+# Records are also summarised per block of BLOCK_RECORDS (earliest and
+# latest timestamp), and a time-range query reads only the blocks that
+# overlap the range.
+import datetime
+import heapq
+import os
+import struct
+import threading
+import time
+
+HISTORY_FILE = os.environ.get('ALARM_HISTORY_FILE', 'alarm_history.bin')
+RECORD = struct.Struct("<dfBB2x16s")
+BLOCK_RECORDS = 256
+
+FIRE, SNOOZE, DISMISS, CHALLENGE = 1, 2, 3, 4
+KIND_NAMES = {FIRE: "fire", SNOOZE: "snooze", DISMISS: "dismiss", CHALLENGE: "challenge"}
+FLAG_EARLY = 1      # fire: rung early in its wake window
+FLAG_AUTOMATIC = 2  # snooze/dismiss: nobody answered, or past the snooze limit
+FLAG_PASSED = 4     # challenge: held at the right distance (otherwise abandoned)
+
+WEEKDAY_NAMES = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+
+class RunningMedian:
+    """Median of a stream: lower half in a max-heap, upper half in a min-heap"""
+
+    def __init__(self):
+        self._low = []   # negated values
+        self._high = []
+
+    def __len__(self):
+        return len(self._low) + len(self._high)
+
+    def add(self, value):
+        if self._low and value > -self._low[0]:
+            heapq.heappush(self._high, value)
+        else:
+            heapq.heappush(self._low, -value)
+        # Keep len(low) == len(high) or len(high) + 1
+        if len(self._low) > len(self._high) + 1:
+            heapq.heappush(self._high, -heapq.heappop(self._low))
+        elif len(self._high) > len(self._low):
+            heapq.heappush(self._low, -heapq.heappop(self._high))
+
+    def median(self):
+        if not self._low:
+            return None
+        if len(self._low) > len(self._high):
+            return -self._low[0]
+        return (-self._low[0] + self._high[0]) / 2
+
+
+class Aggregate:
+    """Counters and medians for one group of events (an alarm, a weekday, everything)"""
+
+    def __init__(self):
+        self.fires = 0
+        self.early_fires = 0
+        self.snoozes = 0
+        self.auto_snoozes = 0
+        self.dismissals = 0
+        self.challenges_passed = 0
+        self.challenges_abandoned = 0
+        self.time_to_dismiss = RunningMedian()
+        self.challenge_time = RunningMedian()
+
+    def add(self, kind, flags, value):
+        if kind == FIRE:
+            self.fires += 1
+            self.early_fires += bool(flags & FLAG_EARLY)
+        elif kind == SNOOZE:
+            self.snoozes += 1
+            self.auto_snoozes += bool(flags & FLAG_AUTOMATIC)
+        elif kind == DISMISS:
+            self.dismissals += 1
+            self.time_to_dismiss.add(value)
+        elif kind == CHALLENGE:
+            if flags & FLAG_PASSED:
+                self.challenges_passed += 1
+                self.challenge_time.add(value)
+            else:
+                self.challenges_abandoned += 1
+
+    def snapshot(self):
+        median_dismiss = self.time_to_dismiss.median()
+        median_challenge = self.challenge_time.median()
+        return {
+            "fires": self.fires,
+            "early_fires": self.early_fires,
+            "snoozes": self.snoozes,
+            "auto_snoozes": self.auto_snoozes,
+            "dismissals": self.dismissals,
+            "median_time_to_dismiss_s": None if median_dismiss is None else round(median_dismiss, 1),
+            "challenges_passed": self.challenges_passed,
+            "challenges_abandoned": self.challenges_abandoned,
+            "median_challenge_s": None if median_challenge is None else round(median_challenge, 1)
+        }
+
+
+def _decode(at, value, kind, flags, raw_id):
+    event = {"at": round(at, 3), "event": KIND_NAMES.get(kind, str(kind)),
+             "alarm_id": raw_id.rstrip(b"\0").decode("ascii", "replace") or None}
+    if kind == FIRE:
+        event["early"] = bool(flags & FLAG_EARLY)
+    elif kind == SNOOZE:
+        event["minutes"] = round(value, 2)
+        event["automatic"] = bool(flags & FLAG_AUTOMATIC)
+    elif kind == DISMISS:
+        event["time_to_dismiss_s"] = round(value, 1)
+        event["automatic"] = bool(flags & FLAG_AUTOMATIC)
+    elif kind == CHALLENGE:
+        event["seconds"] = round(value, 1)
+        event["passed"] = bool(flags & FLAG_PASSED)
+    return event
+
+
+class AlarmHistory:
+    """The history file, its block time index and the aggregates folded from it"""
+
+    def __init__(self, path=HISTORY_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fd = None
+        self._count = 0     # records folded in so far
+        self._blocks = []   # [earliest, latest] timestamp per BLOCK_RECORDS records
+        self._total = Aggregate()
+        self._per_alarm = {}
+        self._per_weekday = {}
+
+    def append(self, kind, alarm_id=None, value=0.0, flags=0, at=None):
+        """Record one event (and fold in anything other processes appended)"""
+        at = time.time() if at is None else at
+        raw_id = (alarm_id or "").encode("ascii", "replace")[:16]
+        record = RECORD.pack(at, value, kind, flags, raw_id)
+        with self._lock:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            os.write(self._fd, record)
+            self._refresh()
+
+    def _refresh(self):
+        """Fold in the records appended since the last call. Caller must hold the lock."""
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        complete = size // RECORD.size
+        if complete <= self._count:
+            return
+        with open(self.path, "rb") as history:
+            history.seek(self._count * RECORD.size)
+            data = history.read((complete - self._count) * RECORD.size)
+        for record in RECORD.iter_unpack(data):
+            self._fold(*record)
+
+    def _fold(self, at, value, kind, flags, raw_id):
+        block = self._count // BLOCK_RECORDS
+        if block == len(self._blocks):
+            self._blocks.append([at, at])
+        else:
+            bounds = self._blocks[block]
+            bounds[0] = min(bounds[0], at)
+            bounds[1] = max(bounds[1], at)
+        self._count += 1
+
+        # A dismissal counts on the weekday the alarm fired, not the one it was dismissed on
+        fired_at = at - value if kind == DISMISS else at
+        weekday = WEEKDAY_NAMES[datetime.date.fromtimestamp(fired_at).weekday()]
+        alarm_id = raw_id.rstrip(b"\0").decode("ascii", "replace") or ""
+        for groups, key in ((self._per_alarm, alarm_id), (self._per_weekday, weekday)):
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = Aggregate()
+            group.add(kind, flags, value)
+        self._total.add(kind, flags, value)
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return self._count
+
+    def events(self, since=None, until=None, alarm_id=None, kind=None, limit=100):
+        """Events in [since, until], newest first, optionally for one alarm or one kind"""
+        since = float("-inf") if since is None else since
+        until = float("inf") if until is None else until
+        found = []
+        with self._lock:
+            self._refresh()
+            blocks = [block for block, (earliest, latest) in enumerate(self._blocks)
+                      if latest >= since and earliest <= until]
+            count = self._count
+        if not blocks:
+            return found
+        with open(self.path, "rb") as history:
+            # Newest blocks first, so a small limit reads little of the file
+            for block in reversed(blocks):
+                first = block * BLOCK_RECORDS
+                history.seek(first * RECORD.size)
+                data = history.read((min(first + BLOCK_RECORDS, count) - first) * RECORD.size)
+                matches = []
+                for at, value, record_kind, flags, raw_id in RECORD.iter_unpack(data):
+                    if not since <= at <= until or (kind is not None and record_kind != kind):
+                        continue
+                    event = _decode(at, value, record_kind, flags, raw_id)
+                    if alarm_id is None or event["alarm_id"] == alarm_id:
+                        matches.append(event)
+                found.extend(reversed(matches))
+                if len(found) >= limit:
+                    break
+        found.sort(key=lambda event: event["at"], reverse=True)
+        return found[:limit]
+
+    def aggregates(self, alarm_id=None):
+        """Totals, per-alarm and per-weekday aggregates (only one alarm's if alarm_id is given)"""
+        with self._lock:
+            self._refresh()
+            if alarm_id is not None:
+                group = self._per_alarm.get(alarm_id)
+                return {"alarm": (group or Aggregate()).snapshot()}
+            return {
+                "total": self._total.snapshot(),
+                "per_alarm": {key: group.snapshot() for key, group in self._per_alarm.items()},
+                "per_weekday": {day: self._per_weekday[day].snapshot()
+                                for day in WEEKDAY_NAMES if day in self._per_weekday}
+            }
+
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def get_history():
+    """The process-wide history (opened on first use)"""
+    global _history
+    with _history_lock:
+        if _history is None:
+            _history = AlarmHistory()
+        return _history
+
+
+def record(kind, alarm_id=None, value=0.0, flags=0):
+    """Append an event to the history; failures are logged, never raised"""
+    try:
+        get_history().append(kind, alarm_id, value, flags)
+    except Exception as e:
+        print(f"Error recording alarm history: {e}")
@@ -0,0 +1,145 @@
+# alarm_index.py - Time-sorted index over the alarm list for range queries
+#
+# Keeps two sorted lists of (HH:MM:SS, id) keys (all alarms and active
+# alarms) and an id -> alarm map, so several alarms can share a time (one per
+# room, see alarm_table.py). Mutations are applied incrementally from the storage
+# change hints (bisect insert/remove), so queries never sort: a time range is
+# two bisects, and counting the matches needs no scan at all.
+import bisect
+
+
+def normalize_time(value, upper=False):
+    """Expand HH or HH:MM to HH:MM:SS; missing fields are 00 (or 59 for an upper bound)"""
+    parts = [int(part) for part in str(value).split(":")]
+    if not 1 <= len(parts) <= 3:
+        raise ValueError(f"invalid time: {value}")
+    filler = 59 if upper else 0
+    while len(parts) < 3:
+        parts.append(filler)
+    hour, minute, second = parts
+    if not (0 <= hour < 24 and 0 <= minute < 60 and 0 <= second < 60):
+        raise ValueError(f"invalid time: {value}")
+    return f"{hour:02d}:{minute:02d}:{second:02d}"
+
+
+class AlarmIndex:
+    """Sorted view of an alarm list keyed by (time, id), plus an id -> alarm map"""
+
+    def __init__(self, alarms=()):
+        self.rebuild(alarms)
+
+    def rebuild(self, alarms):
+        """Index a whole list (after a reload or a full replace)"""
+        self._by_id = {alarm["id"]: alarm for alarm in alarms}
+        # The key an alarm was indexed under, since the dict changes in place
+        self._key_by_id = {alarm_id: (alarm["time"], alarm_id) for alarm_id, alarm in self._by_id.items()}
+        self._keys = sorted(self._key_by_id.values())
+        self._active = [key for key in self._keys if self._by_id[key[1]]["active"]]
+
+    def __len__(self):
+        return len(self._keys)
+
+    def get(self, alarm_id):
+        """The indexed alarm with this id, or None"""
+        return self._by_id.get(alarm_id)
+
+    def find_time(self, alarm_time, room=None):
+        """An alarm set for alarm_time (in this room, see alarm_table.py), or None"""
+        room = room or ""
+        position = bisect.bisect_left(self._keys, (alarm_time, ""))
+        while position < len(self._keys) and self._keys[position][0] == alarm_time:
+            alarm = self._by_id[self._keys[position][1]]
+            if (alarm.get("room") or "") == room:
+                return alarm
+            position += 1
+        return None
+
+    @staticmethod
+    def _discard(keys, key):
+        position = bisect.bisect_left(keys, key)
+        if position < len(keys) and keys[position] == key:
+            del keys[position]
+
+    @staticmethod
+    def _insert(keys, key):
+        position = bisect.bisect_left(keys, key)
+        if position == len(keys) or keys[position] != key:
+            keys.insert(position, key)
+
+    def _remove(self, alarm_id):
+        self._by_id.pop(alarm_id, None)
+        key = self._key_by_id.pop(alarm_id, None)
+        if key is not None:
+            self._discard(self._keys, key)
+            self._discard(self._active, key)
+
+    def _add(self, alarm):
+        self._remove(alarm["id"])
+        key = (alarm["time"], alarm["id"])
+        self._by_id[alarm["id"]] = alarm
+        self._key_by_id[alarm["id"]] = key
+        self._insert(self._keys, key)
+        if alarm["active"]:
+            self._insert(self._active, key)
+
+    def apply(self, changes):
+        """Apply storage change hints ("insert"/"update"/"delete" tuples, see storage.py).
+
+        Operations are idempotent so batches whose hints reference the final
+        state of an alarm still converge.
+        """
+        for change in changes:
+            if change[0] == "insert":
+                self._add(change[1])
+            elif change[0] == "update":
+                self._add(change[2])
+            elif change[0] == "delete":
+                self._remove(change[1])
+
+    @staticmethod
+    def encode_cursor(alarm):
+        return f"{alarm['time']}|{alarm['id']}"
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """(time, id) bound from a cursor; a bare time skips every alarm at that time"""
+        alarm_time, _, alarm_id = cursor.partition("|")
+        return (normalize_time(alarm_time), alarm_id or "\uffff")
+
+    def query(self, active=None, start=None, end=None, limit=None, cursor=None):
+        """Return (alarms, next_cursor, total) for alarms with start <= time <= end.
+
+        active filters on the active flag when not None. cursor is the
+        next_cursor of the previous page, None on the last page. total counts
+        every match, not just this page.
+        """
+        low = (start, "") if start is not None else None
+        high = (end, "\uffff") if end is not None else None
+
+        def bounds(keys):
+            lo = bisect.bisect_left(keys, low) if low is not None else 0
+            hi = bisect.bisect_right(keys, high) if high is not None else len(keys)
+            return lo, hi
+
+        keys = self._active if active else self._keys
+        lo, hi = bounds(keys)
+        if active is False:
+            # Inactive = all minus active over the same range (two more bisects)
+            active_lo, active_hi = bounds(self._active)
+            total = max(0, (hi - lo) - (active_hi - active_lo))
+        else:
+            total = max(0, hi - lo)
+
+        position = lo
+        if cursor is not None:
+            position = max(lo, bisect.bisect_right(keys, self.decode_cursor(cursor)))
+        page = []
+        while position < hi and (limit is None or len(page) < limit):
+            alarm = self._by_id[keys[position][1]]
+            if active is not False or not alarm["active"]:
+                page.append(dict(alarm))
+            position += 1
+
+        # With active=False the last page can come back empty
+        next_cursor = self.encode_cursor(page[-1]) if page and position < hi else None
+        return page, next_cursor, total
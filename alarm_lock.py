@@ -0,0 +1,130 @@
+# alarm_lock.py - Cross-process write lock and version counter for the stored alarms
+#
+# Both processes write the alarms: the web process through alarm_store, the
+# interface process through its own list and save_alarms(). Without
+# coordination, the later of two close writes silently dropped the other.
+# Every alarm write is now a compare-and-swap on a version counter kept in
+# a small lock file next to the alarms (alarms.json.lock, alarms.db.lock):
+#
+#   - a writer remembers the version of the alarms it last read
+#   - it takes the exclusive flock, checks that the version is unchanged,
+#     writes, bumps the version and releases the lock
+#   - if another process wrote in between, the write is refused
+#     (VersionConflict); storage.DurableStorage then re-reads the alarms,
+#     re-applies the writer's change hints to them and tries again
+#
+# Readers take no lock: they read the version before and after loading and
+# load again if it moved. State writes take the lock too (both processes
+# share the .tmp file), but do not bump the version. How long writers wait
+# for the lock and how long they hold it go into histograms.
+import contextlib
+import os
+import struct
+import threading
+import time
+
+from latency import Histogram
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single process is assumed
+    fcntl = None
+
+VERSION = struct.Struct("<Q")
+READ_RETRIES = 10
+
+
+class VersionConflict(Exception):
+    """The alarms were written by someone else since the writer read them"""
+
+    def __init__(self, expected, actual):
+        super().__init__(f"alarms are at version {actual}, not {expected}")
+        self.expected = expected
+        self.actual = actual
+
+
+def _pread(fd, size):
+    if hasattr(os, "pread"):
+        return os.pread(fd, size, 0)
+    os.lseek(fd, 0, os.SEEK_SET)
+    return os.read(fd, size)
+
+
+def _pwrite(fd, data):
+    if hasattr(os, "pwrite"):
+        os.pwrite(fd, data, 0)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.write(fd, data)
+
+
+class AlarmLock:
+    """The lock file: an flock for writers, and the alarms version in its first 8 bytes"""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._thread_lock = threading.Lock()
+        self._wait_ms = Histogram()
+        self._hold_ms = Histogram()
+        self.stats = {"acquisitions": 0, "contended": 0, "conflicts": 0, "read_retries": 0}
+
+    def version(self):
+        """Version of the stored alarms (0 before the first versioned write)"""
+        data = _pread(self._fd, VERSION.size)
+        return VERSION.unpack(data)[0] if len(data) == VERSION.size else 0
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        """Hold the write lock against other threads and other processes"""
+        start = time.perf_counter()
+        self._thread_lock.acquire()
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # The other process holds it
+                    self.stats["contended"] += 1
+                    fcntl.flock(self._fd, fcntl.LOCK_EX)
+            acquired = time.perf_counter()
+            self.stats["acquisitions"] += 1
+            self._wait_ms.add((acquired - start) * 1000)
+            try:
+                yield
+            finally:
+                self._hold_ms.add((time.perf_counter() - acquired) * 1000)
+                if fcntl is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            self._thread_lock.release()
+
+    def commit(self, write, expected=None):
+        """Call write() and bump the version, if it is still `expected` (None: whatever it is).
+
+        Returns the new version; raises VersionConflict without writing otherwise.
+        """
+        with self.exclusive():
+            current = self.version()
+            if expected is not None and current != expected:
+                self.stats["conflicts"] += 1
+                raise VersionConflict(expected, current)
+            write()
+            _pwrite(self._fd, VERSION.pack(current + 1))
+            return current + 1
+
+    def read(self, load):
+        """(version, load()) for one consistent version of the alarms"""
+        for _ in range(READ_RETRIES):
+            before = self.version()
+            value = load()
+            if self.version() == before:
+                return before, value
+            self.stats["read_retries"] += 1
+        # Writers keep moving it: keep them out for one last read
+        with self.exclusive():
+            return self.version(), load()
+
+    def snapshot(self):
+        return dict(self.stats, path=self.path, version=self.version(),
+                    wait=self._wait_ms.snapshot(), hold=self._hold_ms.snapshot())
@@ -0,0 +1,108 @@
+# alarm_schedule.py - Compiled day schedule: second-of-day -> alarms due
+#
+# An 86,400-slot array holds, for every second of the day, the ids of the
+# active alarms that fire then (None for the vast majority of empty slots).
+# The clock tick is a single list lookup whatever the number of alarms, and
+# mutations update only the slots they touch, using the same change hints as
+# the storage backends (see storage.py).
+#
+# Only alarms whose repeat rule (see recurrence.py) includes the schedule's
+# day are slotted; the schedule is recompiled once when the day rolls over,
+# so the tick never evaluates a rule.
+import datetime
+
+from recurrence import compile_rule
+
+SECONDS_PER_DAY = 86400
+
+
+def second_of_day(alarm_time):
+    """HH:MM:SS -> 0..86399"""
+    hour, minute, second = alarm_time.split(":")
+    return int(hour) * 3600 + int(minute) * 60 + int(second)
+
+
+def format_second(second):
+    """0..86399 -> HH:MM:SS"""
+    return f"{second // 3600:02d}:{second // 60 % 60:02d}:{second % 60:02d}"
+
+
+class DaySchedule:
+    """Active alarms bucketed by the second of the day they fire"""
+
+    def __init__(self, alarms=(), day=None):
+        self.day = day or datetime.date.today()
+        self.rebuild(alarms)
+
+    def rebuild(self, alarms):
+        """Recompile from a whole list (after a load or a full replace)"""
+        self._slots = [None] * SECONDS_PER_DAY
+        self._second_by_id = {}
+        self._entry_by_id = {}  # id -> (HH:MM:SS, compiled rule) of every active alarm
+        for alarm in alarms:
+            self._add(alarm)
+
+    def roll_to(self, day):
+        """Recompile for another day (only when it differs from the current one)"""
+        if day == self.day:
+            return
+        self.day = day
+        entries = self._entry_by_id
+        self._slots = [None] * SECONDS_PER_DAY
+        self._second_by_id = {}
+        for alarm_id, (alarm_time, rule) in entries.items():
+            if rule.occurs_on(day):
+                self._slot(alarm_id, second_of_day(alarm_time))
+
+    def __len__(self):
+        return len(self._second_by_id)
+
+    def _remove(self, alarm_id):
+        self._entry_by_id.pop(alarm_id, None)
+        second = self._second_by_id.pop(alarm_id, None)
+        if second is None:
+            return
+        slot = self._slots[second]
+        slot.discard(alarm_id)
+        if not slot:
+            self._slots[second] = None
+
+    def _add(self, alarm):
+        self._remove(alarm["id"])
+        if not alarm["active"]:
+            return
+        try:
+            second = second_of_day(alarm["time"])
+            rule = compile_rule(alarm.get("repeat"))
+        except (ValueError, AttributeError, TypeError):
+            print(f"Warning: cannot schedule alarm with time {alarm.get('time')!r}")
+            return
+        if not 0 <= second < SECONDS_PER_DAY:
+            return
+        self._entry_by_id[alarm["id"]] = (alarm["time"], rule)
+        if rule.occurs_on(self.day):
+            self._slot(alarm["id"], second)
+
+    def _slot(self, alarm_id, second):
+        if self._slots[second] is None:
+            self._slots[second] = set()
+        self._slots[second].add(alarm_id)
+        self._second_by_id[alarm_id] = second
+
+    def apply(self, changes):
+        """Apply ("insert"/"update"/"delete") change hints to the affected slots only"""
+        for change in changes:
+            if change[0] == "insert":
+                self._add(change[1])
+            elif change[0] == "update":
+                self._add(change[2])
+            elif change[0] == "delete":
+                self._remove(change[1])
+
+    def due(self, second):
+        """Ids of the active alarms set for this second of the schedule's day (empty if none)"""
+        return self._slots[second] or ()
+
+    def due_at(self, alarm_time):
+        """Same as due() for an HH:MM:SS string"""
+        return self.due(second_of_day(alarm_time))
@@ -1,48 +1,96 @@
-import json
+# alarm_state.py - The alarm state shared by the web and interface processes
+#
+# The live state sits in a shared memory segment (see shared_state.py), so
+# reading it is lock-free and takes microseconds: the GUI tick, the MQTT
+# publisher and /alarm_state polls can read it as often as they like.
+# The storage backend (alarm_state.json or the SQLite state row) keeps a
+# checkpoint of every write, from which a fresh segment is seeded after a
+# reboot; ALARM_STATE_CHECKPOINT=0 turns the checkpoint off. Without mmap
+# the backend is read and written directly, as before.
 import os
+import threading
 import time
 
-STATE_FILE = "alarm_state.json"
+import shared_state
+import storage
+
+STATE_FILE = storage.STATE_FILE
+CHECKPOINT = os.environ.get('ALARM_STATE_CHECKPOINT', '1') != '0'
+# How often watch() looks for writes by other processes (one 8-byte read each)
+WATCH_INTERVAL = float(os.environ.get('ALARM_STATE_WATCH_MS', '20')) / 1000
+# Without the segment, watch() re-reads the backend this often
+FALLBACK_WATCH_INTERVAL = 1.0
+
+_listeners = []
+_publishers = []
+_last_state = None
+_notify_lock = threading.Lock()
+_watcher = None
+_segment = None
+_segment_lock = threading.Lock()
+_segment_failed = False
+
+def _get_segment():
+    """The mapped state segment (seeded from the checkpoint when fresh), or None if it cannot be mapped"""
+    global _segment, _segment_failed
+    if _segment is not None or _segment_failed:
+        return _segment
+    with _segment_lock:
+        if _segment is None and not _segment_failed:
+            try:
+                segment = shared_state.SharedState()
+                if not segment.initialized():
+                    try:
+                        checkpoint = storage.get_storage().load_state()
+                    except Exception as e:
+                        print(f"Error reading the alarm state checkpoint: {e}")
+                        checkpoint = dict(storage.DEFAULT_STATE)
+                    if segment.initialize(checkpoint):
+                        print(f"Alarm state segment {segment.path} seeded from the checkpoint")
+                _segment = segment
+            except Exception as e:
+                print(f"Shared alarm state not available ({e}), using the storage backend")
+                _segment_failed = True
+    return _segment
 
 def get_state():
     """Get the current alarm state"""
+    segment = _get_segment()
+    if segment is not None:
+        try:
+            return segment.read()
+        except Exception as e:
+            print(f"Error reading shared state: {e}")
     try:
-        if os.path.exists(STATE_FILE):
-            # Force sync to ensure we're reading the latest version
-            os.sync()
-            with open(STATE_FILE, 'r') as f:
-                state = json.load(f)
-                return state
-        else:
-            return {"alarm_active": False, "timestamp": 0, "message": ""}
+        return storage.get_storage().load_state()
     except Exception as e:
         print(f"Error reading state: {e}")
         return {"alarm_active": False, "timestamp": 0, "message": ""}
 
-def set_state(alarm_active, message=""):
-    """Set the current alarm state"""
+def set_state(alarm_active, message="", **extra):
+    """Set the current alarm state (extra fields such as snooze details are stored alongside)"""
     try:
         state = {
             "alarm_active": alarm_active,
             "timestamp": time.time(),
             "message": message
         }
-        
-        # Create a temporary file and then rename it to ensure atomic write
-        temp_file = STATE_FILE + ".tmp"
-        with open(temp_file, 'w') as f:
-            json.dump(state, f)
-            f.flush()  # Flush internal Python buffers
-            os.fsync(f.fileno())  # Flush OS buffers to disk
-        
-        # Rename is atomic on POSIX systems
-        os.rename(temp_file, STATE_FILE)
-        
-        # Force sync the directory to ensure rename is committed
-        dir_fd = os.open(os.path.dirname(STATE_FILE) or '.', os.O_DIRECTORY)
-        os.fsync(dir_fd)
-        os.close(dir_fd)
-        
+        state.update(extra)
+
+        # Visible to every process as soon as it is in the segment; the
+        # backend copy (atomic and durable) is the checkpoint
+        segment = _get_segment()
+        if segment is not None:
+            segment.write(state)
+        if CHECKPOINT or segment is None:
+            storage.get_storage().save_state(state)
+
+        _notify(state)
+        for callback in list(_publishers):
+            try:
+                callback(state)
+            except Exception as e:
+                print(f"Error in alarm state publisher: {e}")
         return True
     except Exception as e:
         print(f"Error writing state: {e}")
@@ -50,4 +98,76 @@ def set_state(alarm_active, message=""):
 
 def clear_state():
     """Clear the alarm state"""
-    return set_state(False, "")
\ No newline at end of file
+    return set_state(False, "")
+
+def refresh():
+    """Re-read the state and notify listeners if it changed (polling fallback for watch())"""
+    state = get_state()
+    _notify(state)
+    return state
+
+def current_state():
+    """Last known state without I/O while watch() is active, otherwise read it"""
+    if _watcher is not None and _last_state is not None:
+        return _last_state
+    return get_state()
+
+def stats():
+    """Counters of the shared segment (None when the backend is used directly)"""
+    segment = _get_segment()
+    if segment is None:
+        return {"segment": None, "checkpoint": True}
+    return dict(segment.stats, segment=segment.path, seq=segment.seq(), checkpoint=CHECKPOINT)
+
+def add_listener(callback):
+    """Call callback(state) whenever the alarm state changes"""
+    _listeners.append(callback)
+
+def add_publisher(callback):
+    """Call callback(state) after every state this process writes (not those it only reads)"""
+    _publishers.append(callback)
+
+def _notify(state):
+    """Pass a new state to the listeners unless it is the one they already saw"""
+    global _last_state
+    with _notify_lock:
+        if state == _last_state:
+            return
+        _last_state = state
+    for callback in list(_listeners):
+        try:
+            callback(state)
+        except Exception as e:
+            print(f"Error in alarm state listener: {e}")
+
+def _watch_segment(segment):
+    seen = segment.seq()
+    while True:
+        time.sleep(WATCH_INTERVAL)
+        try:
+            seq = segment.seq()
+            if seq != seen and not seq & 1:
+                seen = seq
+                _notify(segment.read())
+        except Exception as e:
+            print(f"Error watching shared state: {e}")
+
+def _watch_backend():
+    while True:
+        time.sleep(FALLBACK_WATCH_INTERVAL)
+        refresh()
+
+def watch():
+    """Notify listeners of state changes written by other processes"""
+    global _watcher, _last_state
+    if _watcher is not None:
+        return True
+    _last_state = get_state()
+    segment = _get_segment()
+    if segment is not None:
+        watcher = threading.Thread(target=_watch_segment, args=(segment,), name="alarm-state-watch", daemon=True)
+    else:
+        watcher = threading.Thread(target=_watch_backend, name="alarm-state-watch", daemon=True)
+    watcher.start()
+    _watcher = watcher
+    return True
@@ -0,0 +1,601 @@
+# alarm_store.py - In-process, thread-safe alarm repository
+#
+# The web routes and the MQTT helpers in app.py used to fork a new Python
+# interpreter (or open alarms.json directly) for every mutation. This module
+# keeps a cached copy of the alarm list in memory, serialises mutations with a
+# lock and persists through the configured storage backend (see storage.py).
+#
+# Every change bumps an in-memory version and recomputes a stable SHA-1
+# digest of the list, so pollers can be answered without touching the disk.
+# Encoded forms of the list (HTTP body, MQTT payload) are cached per version
+# so repeated reads of an unchanged list are not re-serialised.
+#
+# Alarms are addressed by their stable "id" through a hash index; positions
+# in the list are only resolved for legacy index-based clients (alarm_id_at).
+#
+# Upcoming firings (next_alarms) come from a next-occurrence heap that is
+# kept in step with the change hints and rolled forward as time passes, so
+# repeat rules are evaluated once per occurrence rather than per request.
+#
+# Changes made by other processes are picked up through a watchdog observer
+# when available, otherwise by comparing the backend signature on each read.
+# A write racing one from the other process is merged by the backend (see
+# alarm_lock.py), and the cache then takes the merged list. With app.py
+# --single there is no other process: the interface writes through
+# commit_changes() and follows the store through add_listener().
+import hashlib
+import json
+import os
+import threading
+import time
+
+import storage
+from alarm_index import AlarmIndex, normalize_time
+from alarm_table import AlarmTable
+from next_fire import NextFireScheduler
+from recurrence import normalize_rule
+from smart_wake import normalize_wake_window
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+ALARMS_FILE = storage.ALARMS_FILE
+
+_lock = threading.RLock()
+_alarms = []
+_loaded = False
+_signature = None  # backend fingerprint the cache was built from
+_version = 0
+_digest = None
+_changed_at = 0
+_observer = None
+_dirty = True  # set by the watcher when the backing files change
+_listeners = []
+_index = AlarmIndex()  # time-sorted view of _alarms for range queries
+_upcoming = NextFireScheduler()  # next occurrence of every active alarm
+_upcoming_stale = True  # rebuilt on the next next_alarms() call
+_table = AlarmTable()  # columnar copy for window queries across rooms
+_table_stale = True  # rebuilt on the next due_in_window() call
+_encoded = {}  # name -> encoded bytes for the current version
+_cache_stats = {}  # name -> {"hits": n, "misses": n}
+
+
+def compute_digest(alarms):
+    """Stable content digest (unlike hash(), identical across processes and restarts)"""
+    canonical = json.dumps(alarms, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+def _bump(changes=None):
+    """Record that the cached list changed. Caller must hold the lock.
+
+    changes is the storage change hint list, or None when the whole list
+    may have changed (reload from disk, replace_alarms).
+    """
+    global _version, _digest, _changed_at, _upcoming_stale, _table_stale
+    _version += 1
+    _digest = compute_digest(_alarms)
+    _changed_at = time.time()
+    _encoded.clear()
+    if changes is None:
+        _index.rebuild(_alarms)
+        _upcoming_stale = _table_stale = True
+    else:
+        _index.apply(changes)
+        if len(_index) != len(_alarms):
+            # Hints did not describe the change fully (e.g. duplicate times)
+            _index.rebuild(_alarms)
+            _upcoming_stale = _table_stale = True
+        else:
+            if not _upcoming_stale:
+                _upcoming.apply(changes)
+            if not _table_stale:
+                _table.apply(changes)
+    for callback in list(_listeners):
+        try:
+            callback(_version, changes)
+        except Exception as e:
+            print(f"Error in alarm store listener: {e}")
+
+
+def add_listener(callback):
+    """Call callback(version, changes) after every change (keep it short: runs under the store lock)"""
+    _listeners.append(callback)
+
+
+class _StorageChangeHandler(FileSystemEventHandler):
+    def _mark(self, event):
+        global _dirty
+        watched = {os.path.abspath(path) for path in storage.get_storage().watch_paths()}
+        touched = {os.path.abspath(event.src_path)}
+        if getattr(event, 'dest_path', None):
+            # Atomic writes show up as a rename of the .tmp file onto the target
+            touched.add(os.path.abspath(event.dest_path))
+        if watched & touched:
+            _dirty = True
+            # Reload now so listeners hear about changes made by other processes
+            with _lock:
+                _ensure_fresh()
+
+    on_modified = _mark
+    on_created = _mark
+    on_moved = _mark
+
+
+def _start_watcher():
+    """Watch the backing files so reads need no I/O until they change. Caller must hold the lock."""
+    global _observer
+    if _observer is not None or Observer is None:
+        return
+    try:
+        observer = Observer()
+        directories = {os.path.dirname(os.path.abspath(path)) for path in storage.get_storage().watch_paths()}
+        for directory in directories:
+            observer.schedule(_StorageChangeHandler(), path=directory, recursive=False)
+        observer.daemon = True
+        observer.start()
+        _observer = observer
+    except Exception as e:
+        print(f"Alarm store file watcher not available: {e}")
+
+
+def _load_from_disk():
+    """Reload the cache from the backend. Caller must hold the lock."""
+    global _alarms, _signature, _loaded
+
+    backend = storage.get_storage()
+    signature = backend.signature()
+    try:
+        loaded = backend.load_alarms()
+    except (OSError, ValueError) as e:
+        # Keep the previous cache and retry on the next access
+        print(f"Error loading alarms into store: {e}")
+        return
+
+    valid_alarms = []
+    for alarm in loaded:
+        if "time" not in alarm or "active" not in alarm:
+            print(f"Warning: Invalid alarm format: {alarm}")
+            continue
+        valid_alarms.append(alarm)
+
+    changed = not _loaded or compute_digest(valid_alarms) != _digest
+    _signature = signature
+    _loaded = True
+    if changed:
+        # Unchanged content keeps the existing dicts, which the index points to
+        _alarms = valid_alarms
+        _bump()
+
+
+def _ensure_fresh():
+    """Reload the cache if another process changed the alarms. Caller must hold the lock."""
+    global _dirty
+
+    if not _loaded:
+        _start_watcher()
+    elif _observer is not None and not _dirty:
+        # Nothing touched the backing files since the last check
+        return
+
+    _dirty = False
+    if not _loaded or storage.get_storage().signature() != _signature:
+        _load_from_disk()
+
+
+def _write_to_disk(changes=None):
+    """Persist the cache, passing the change hint to the backend. Caller must hold the lock."""
+    global _alarms, _signature
+
+    backend = storage.get_storage()
+    merged = backend.write_alarms(_alarms, changes)
+    _signature = backend.signature()
+    if merged is not None:
+        # The other process wrote first: our change went on top of its list
+        _alarms = merged
+        _bump()
+    else:
+        _bump(changes)
+
+
+def _apply_hints(changes):
+    """Apply change hints made to another copy of the list to the cache, in place.
+
+    Returns the hints in terms of the cached dicts. Caller must hold the lock.
+    """
+    applied = []
+    current = {}  # id -> our dict, for ids touched earlier in this batch (None: deleted)
+
+    def find(alarm_id):
+        return current[alarm_id] if alarm_id in current else _index.get(alarm_id)
+
+    for change in changes:
+        if change[0] in ("insert", "update"):
+            incoming = change[1] if change[0] == "insert" else change[2]
+            alarm = find(incoming.get("id"))
+            if alarm is None:
+                alarm = dict(incoming)
+                _alarms.append(alarm)
+                applied.append(("insert", alarm))
+            else:
+                # In place: the index and the list hold this very dict
+                alarm.clear()
+                alarm.update(incoming)
+                applied.append(("update", alarm["id"], alarm))
+            current[alarm["id"]] = alarm
+        elif change[0] == "delete":
+            alarm = find(change[1])
+            if alarm is not None:
+                _alarms.remove(alarm)
+                applied.append(("delete", change[1]))
+            current[change[1]] = None
+    return applied
+
+
+def apply_remote(changes, version=None):
+    """Take in alarms another process just wrote, from its change hints.
+
+    version is the stored alarms version after its write. When the store
+    is still at that version the hints are applied to the cache in place
+    (as if the change had been made here); otherwise, or without hints,
+    the list is re-read.
+    """
+    global _signature, _dirty
+    with _lock:
+        backend = storage.get_storage()
+        if (not _loaded or changes is None or version is None
+                or getattr(backend, "lock", None) is None or backend.lock.version() != version):
+            _dirty = True
+            _ensure_fresh()
+            return
+        applied = _apply_hints(changes)
+        backend.adopt_version(version)
+        _signature = backend.signature()
+        _dirty = False
+        if applied:
+            _bump(applied)
+
+
+def commit_changes(changes):
+    """Apply and write change hints made to another copy of the list.
+
+    Used by the interface when it runs in this process (app.py --single):
+    its list changes are written through the store, so both share one
+    version. Returns the hints as applied to the cache.
+    """
+    with _lock:
+        _ensure_fresh()
+        applied = _apply_hints(changes)
+        if applied:
+            _write_to_disk(applied)
+        return applied
+
+
+def get_alarms():
+    """Return a copy of the current alarm list"""
+    with _lock:
+        _ensure_fresh()
+        return [dict(alarm) for alarm in _alarms]
+
+
+def get_version():
+    """Return (version, digest, changed_at) for the current list without disk I/O"""
+    with _lock:
+        _ensure_fresh()
+        return _version, _digest, _changed_at
+
+
+def get_snapshot():
+    """Return (alarms, version, digest, changed_at) taken atomically"""
+    with _lock:
+        _ensure_fresh()
+        return [dict(alarm) for alarm in _alarms], _version, _digest, _changed_at
+
+
+def get_encoded(name, encode):
+    """Return (data, version, digest), where data is encode(alarms, version, digest, changed_at).
+
+    The result is cached under name until the list changes, so callers get
+    the same bytes object back on every hit. encode must not modify alarms.
+    """
+    with _lock:
+        _ensure_fresh()
+        stats = _cache_stats.setdefault(name, {"hits": 0, "misses": 0})
+        data = _encoded.get(name)
+        if data is None:
+            stats["misses"] += 1
+            data = encode(_alarms, _version, _digest, _changed_at)
+            _encoded[name] = data
+        else:
+            stats["hits"] += 1
+        return data, _version, _digest
+
+
+def cache_stats():
+    """Hit/miss counters of the serialization cache, per encoding"""
+    with _lock:
+        return {name: dict(stats) for name, stats in _cache_stats.items()}
+
+
+def query_alarms(active=None, start=None, end=None, limit=None, cursor=None):
+    """Return (alarms, next_cursor, total, version) from the time-sorted index.
+
+    start/end accept HH, HH:MM or HH:MM:SS; end is inclusive (09:00 covers
+    09:00:59). See AlarmIndex.query for the paging contract.
+    """
+    start = normalize_time(start) if start else None
+    end = normalize_time(end, upper=True) if end else None
+    with _lock:
+        _ensure_fresh()
+        alarms, next_cursor, total = _index.query(active, start, end, limit, cursor)
+        return alarms, next_cursor, total, _version
+
+
+def next_alarms(n):
+    """The next n firings as (timestamp, alarm copy) pairs, repeats included"""
+    global _upcoming_stale
+    with _lock:
+        _ensure_fresh()
+        if _upcoming_stale:
+            _upcoming.rebuild(_alarms)
+            _upcoming_stale = False
+        firings = []
+        for fire, alarm_id in _upcoming.upcoming(n):
+            alarm = _index.get(alarm_id)
+            if alarm is not None:
+                firings.append((fire, dict(alarm)))
+        return firings
+
+
+def due_in_window(start, seconds, room=None):
+    """Alarms ringing in [start, start + seconds), grouped per room (see AlarmTable)"""
+    global _table_stale
+    with _lock:
+        _ensure_fresh()
+        if _table_stale:
+            _table.rebuild(_alarms)
+            _table_stale = False
+        return _table.due_in_window(start, seconds, room)
+
+
+def last_modified():
+    """Return the modification time of the backing storage (0 if missing)"""
+    return storage.get_storage().last_modified()
+
+
+def get_alarm(alarm_id):
+    """Return a copy of the alarm with this id, or None"""
+    with _lock:
+        _ensure_fresh()
+        alarm = _index.get(alarm_id)
+        return dict(alarm) if alarm is not None else None
+
+
+def alarm_id_at(index):
+    """Compatibility shim: id of the alarm at a position of the /alarms list, or None"""
+    with _lock:
+        _ensure_fresh()
+        if index < 0 or index >= len(_alarms):
+            return None
+        return _alarms[index]["id"]
+
+
+def add_alarm(alarm_time, repeat=None, room=None, wake_window=None):
+    """Add an active alarm for HH:MM:SS. Returns a copy of it, or None if the room already has one.
+
+    repeat is an optional recurrence rule (see recurrence.py); a malformed
+    rule raises ValueError. room names the room/device it rings in.
+    wake_window is how many minutes early it may ring on light sleep (see smart_wake.py).
+    """
+    rule = normalize_rule(repeat)
+    room = normalize_room(room)
+    window = normalize_wake_window(wake_window)
+    with _lock:
+        _ensure_fresh()
+        if _index.find_time(alarm_time, room) is not None:
+            return None
+
+        alarm = {"id": storage.new_alarm_id(), "time": alarm_time, "active": True}
+        if rule:
+            alarm["repeat"] = rule
+        if room:
+            alarm["room"] = room
+        if window:
+            alarm["wake_window"] = window
+        _alarms.append(alarm)
+        _write_to_disk([("insert", alarm)])
+        return dict(alarm)
+
+
+def delete_alarm(alarm_id):
+    """Delete the alarm with this id. Returns the deleted alarm or None."""
+    with _lock:
+        _ensure_fresh()
+        alarm = _index.get(alarm_id)
+        if alarm is None:
+            return None
+
+        _alarms.remove(alarm)
+        _write_to_disk([("delete", alarm_id)])
+        return dict(alarm)
+
+
+def toggle_alarm(alarm_id):
+    """Flip the active flag of the alarm with this id. Returns the updated alarm or None."""
+    with _lock:
+        _ensure_fresh()
+        alarm = _index.get(alarm_id)
+        if alarm is None:
+            return None
+
+        alarm["active"] = not alarm["active"]
+        _write_to_disk([("update", alarm_id, alarm)])
+        return dict(alarm)
+
+
+def replace_alarms(alarms):
+    """Replace the whole list (e.g. from an MQTT sync). Returns True if it changed."""
+    global _alarms
+
+    with _lock:
+        _ensure_fresh()
+        if json.dumps(_alarms, sort_keys=True) == json.dumps(alarms, sort_keys=True):
+            return False
+
+        _alarms = [dict(alarm) for alarm in alarms]
+        storage.ensure_ids(_alarms)
+        _write_to_disk()
+        return True
+
+
+def _batch_time(operation, prefix=""):
+    """HH:MM:SS from operation["<prefix>time"] or its hour/minute/second fields"""
+    if operation.get(prefix + "time"):
+        hour, minute, second = (int(part) for part in str(operation[prefix + "time"]).split(":"))
+    else:
+        hour = int(operation.get(prefix + "hour", 0))
+        minute = int(operation.get(prefix + "minute", 0))
+        second = int(operation.get(prefix + "second", 0))
+    if not (0 <= hour < 24 and 0 <= minute < 60 and 0 <= second < 60):
+        raise ValueError("time out of range")
+    return f"{hour:02d}:{minute:02d}:{second:02d}"
+
+
+_EDIT_TIME_FIELDS = ("new_time", "new_hour", "new_minute", "new_second")
+ROOM_MAX_LENGTH = 64
+
+
+def normalize_room(room):
+    """Room name as stored ("" for the default room)"""
+    room = "" if room is None else str(room).strip()
+    if len(room) > ROOM_MAX_LENGTH:
+        raise ValueError(f"room name longer than {ROOM_MAX_LENGTH} characters")
+    return room
+
+
+def _clashes(alarms, alarm_time, room, skip=None):
+    """Whether another alarm rings at alarm_time in the same room"""
+    return any(alarm["time"] == alarm_time and (alarm.get("room") or "") == room and alarm is not skip
+               for alarm in alarms)
+
+
+def _batch_target(alarms, operation):
+    """Position of the alarm an operation refers to, by "id", "time" or "index" """
+    if "id" in operation:
+        for position, alarm in enumerate(alarms):
+            if alarm["id"] == operation["id"]:
+                return position
+        raise ValueError(f"no alarm with id {operation['id']}")
+    if "time" in operation:
+        alarm_time = _batch_time(operation)
+        for position, alarm in enumerate(alarms):
+            if alarm["time"] == alarm_time:
+                return position
+        raise ValueError(f"no alarm at {alarm_time}")
+    index = int(operation.get("index", -1))
+    if index < 0 or index >= len(alarms):
+        raise ValueError(f"invalid alarm index: {index}")
+    return index
+
+
+def apply_batch(operations, atomic=True):
+    """Apply a list of add/delete/toggle/edit operations with a single write.
+
+    Operations run in order against a working copy; each yields a result
+    dict. With atomic=True nothing is written unless every operation
+    succeeds. Returns (results, applied).
+    """
+    global _alarms
+
+    with _lock:
+        _ensure_fresh()
+        # Copy-on-write: untouched alarms stay shared with the index
+        working = list(_alarms)
+        copied = set()
+        changes = []
+        results = []
+
+        def writable(position):
+            if working[position]["id"] not in copied:
+                working[position] = dict(working[position])
+                copied.add(working[position]["id"])
+            return working[position]
+
+        for operation in operations:
+            op = operation.get("op") if isinstance(operation, dict) else None
+            try:
+                if op == "add":
+                    alarm_time = _batch_time(operation)
+                    room = normalize_room(operation.get("room"))
+                    if _clashes(working, alarm_time, room):
+                        raise ValueError(f"alarm for {alarm_time} already exists")
+                    alarm = {"id": storage.new_alarm_id(), "time": alarm_time,
+                             "active": bool(operation.get("active", True))}
+                    rule = normalize_rule(operation.get("repeat"))
+                    if rule:
+                        alarm["repeat"] = rule
+                    if room:
+                        alarm["room"] = room
+                    window = normalize_wake_window(operation.get("wake_window"))
+                    if window:
+                        alarm["wake_window"] = window
+                    working.append(alarm)
+                    copied.add(alarm["id"])
+                    changes.append(("insert", alarm))
+                elif op == "delete":
+                    alarm = working.pop(_batch_target(working, operation))
+                    changes.append(("delete", alarm["id"]))
+                elif op == "toggle":
+                    alarm = writable(_batch_target(working, operation))
+                    alarm["active"] = not alarm["active"]
+                    changes.append(("update", alarm["id"], alarm))
+                elif op == "edit":
+                    position = _batch_target(working, operation)
+                    if any(key in operation for key in _EDIT_TIME_FIELDS):
+                        new_time = _batch_time(operation, "new_")
+                    else:
+                        # e.g. only the repeat rule or the active flag changes
+                        new_time = working[position]["time"]
+                    current = working[position]
+                    room = normalize_room(operation["room"]) if "room" in operation else (current.get("room") or "")
+                    if _clashes(working, new_time, room, skip=current):
+                        raise ValueError(f"alarm for {new_time} already exists")
+                    rule = normalize_rule(operation.get("repeat")) if "repeat" in operation else None
+                    window = normalize_wake_window(operation.get("wake_window"))
+                    # Only copied once validation passed, so failed operations leave no trace
+                    alarm = writable(position)
+                    alarm["time"] = new_time
+                    if "active" in operation:
+                        alarm["active"] = bool(operation["active"])
+                    if "repeat" in operation:
+                        if rule:
+                            alarm["repeat"] = rule
+                        else:
+                            alarm.pop("repeat", None)
+                    if room:
+                        alarm["room"] = room
+                    else:
+                        alarm.pop("room", None)
+                    if "wake_window" in operation:
+                        if window:
+                            alarm["wake_window"] = window
+                        else:
+                            alarm.pop("wake_window", None)
+                    changes.append(("update", alarm["id"], alarm))
+                else:
+                    raise ValueError(f"unknown operation: {op}")
+                results.append({"op": op, "status": "success", "alarm": dict(alarm)})
+            except (ValueError, TypeError, KeyError) as e:
+                results.append({"op": op, "status": "error", "message": str(e)})
+
+        failed = any(result["status"] == "error" for result in results)
+        if not changes or (atomic and failed):
+            return results, False
+
+        _alarms = working
+        _write_to_disk(changes)
+        return results, True
@@ -0,0 +1,255 @@
+# alarm_table.py - Columnar alarm table for window queries across many rooms
+#
+# One controller can serve a whole floor, i.e. thousands of alarms spread
+# over rooms. Here each alarm is a row in parallel columns:
+#
+#   second  second of the day it rings at
+#   active  its active flag
+#   room    room/device code (index into the room names)
+#   mask    weekday bitmask of its repeat rule (bit 0 = Monday)
+#   exact   whether the mask says everything about the rule (no dates,
+#           every-N-days or skip lists, which are checked per match)
+#
+# With NumPy installed the columns are arrays and "what rings in the next
+# window" is one vectorised comparison over the table; without it the same
+# query runs as a Python loop over the columns. Rows are updated in place
+# from the storage change hints (deleted rows are swapped with the last one)
+# so the table is never rebuilt for a single mutation.
+import datetime
+
+from alarm_schedule import SECONDS_PER_DAY, format_second, second_of_day
+from recurrence import compile_rule
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DEFAULT_ROOM = ""
+ALL_DAYS = 0x7f
+
+
+def rule_columns(rule):
+    """(weekday mask, exact) for a normalized repeat rule"""
+    if not rule:
+        return ALL_DAYS, True
+    mask = 0
+    for day in rule.get("days", range(7)):
+        mask |= 1 << day
+    exact = not any(key in rule for key in ("dates", "every", "skip"))
+    return mask, exact
+
+
+class AlarmTable:
+    """Alarm rows in columns, queried by time window and grouped per room"""
+
+    def __init__(self, alarms=(), use_numpy=None):
+        self.vectorized = (np is not None) if use_numpy is None else (use_numpy and np is not None)
+        self.rebuild(alarms)
+
+    # -- storage ---------------------------------------------------------
+
+    def _allocate(self, capacity):
+        if self.vectorized:
+            self._second = np.zeros(capacity, dtype=np.int32)
+            self._active = np.zeros(capacity, dtype=np.bool_)
+            self._room = np.zeros(capacity, dtype=np.int32)
+            self._mask = np.zeros(capacity, dtype=np.uint8)
+            self._exact = np.ones(capacity, dtype=np.bool_)
+        else:
+            self._second = [0] * capacity
+            self._active = [False] * capacity
+            self._room = [0] * capacity
+            self._mask = [0] * capacity
+            self._exact = [True] * capacity
+
+    def _grow(self):
+        capacity = max(64, 2 * len(self._ids))
+        if self.vectorized:
+            for name in ("_second", "_active", "_room", "_mask", "_exact"):
+                column = getattr(self, name)
+                grown = np.zeros(capacity, dtype=column.dtype)
+                grown[:len(column)] = column
+                setattr(self, name, grown)
+        else:
+            extra = capacity - len(self._second)
+            self._second.extend([0] * extra)
+            self._active.extend([False] * extra)
+            self._room.extend([0] * extra)
+            self._mask.extend([0] * extra)
+            self._exact.extend([True] * extra)
+
+    def _room_code(self, room):
+        room = DEFAULT_ROOM if room is None else str(room)
+        code = self._room_codes.get(room)
+        if code is None:
+            code = self._room_codes[room] = len(self._rooms)
+            self._rooms.append(room)
+        return code
+
+    def rebuild(self, alarms):
+        """Load a whole list (after a reload or a full replace)"""
+        alarms = list(alarms)
+        self._ids = []
+        self._row_by_id = {}
+        self._rules = {}  # id -> compiled rule, for rows that are not exact
+        self._rooms = []
+        self._room_codes = {}
+        self._allocate(max(64, len(alarms)))
+        if not self.vectorized:
+            for alarm in alarms:
+                self._set(alarm)
+            return
+
+        # Columns are filled in bulk, not row by row
+        rows = []
+        for alarm in alarms:
+            try:
+                second = second_of_day(alarm["time"])
+                mask, exact = rule_columns(alarm.get("repeat"))
+            except (ValueError, AttributeError, TypeError):
+                print(f"Warning: cannot tabulate alarm {alarm.get('id')} ({alarm.get('time')!r})")
+                continue
+            self._row_by_id[alarm["id"]] = len(self._ids)
+            self._ids.append(alarm["id"])
+            if not exact:
+                self._rules[alarm["id"]] = compile_rule(alarm["repeat"])
+            rows.append((second, bool(alarm["active"]), self._room_code(alarm.get("room")), mask, exact))
+        if rows:
+            count = len(rows)
+            second, active, room, mask, exact = zip(*rows)
+            self._second[:count] = second
+            self._active[:count] = active
+            self._room[:count] = room
+            self._mask[:count] = mask
+            self._exact[:count] = exact
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _set(self, alarm):
+        """Insert or overwrite one row"""
+        alarm_id = alarm["id"]
+        try:
+            second = second_of_day(alarm["time"])
+            mask, exact = rule_columns(alarm.get("repeat"))
+        except (ValueError, AttributeError, TypeError):
+            print(f"Warning: cannot tabulate alarm {alarm_id} ({alarm.get('time')!r})")
+            self._delete(alarm_id)
+            return
+        row = self._row_by_id.get(alarm_id)
+        if row is None:
+            row = len(self._ids)
+            if row == len(self._second):
+                self._grow()
+            self._ids.append(alarm_id)
+            self._row_by_id[alarm_id] = row
+        self._second[row] = second
+        self._active[row] = bool(alarm["active"])
+        self._room[row] = self._room_code(alarm.get("room"))
+        self._mask[row] = mask
+        self._exact[row] = exact
+        if exact:
+            self._rules.pop(alarm_id, None)
+        else:
+            self._rules[alarm_id] = compile_rule(alarm["repeat"])
+
+    def _delete(self, alarm_id):
+        """Remove a row by moving the last row into its place"""
+        row = self._row_by_id.pop(alarm_id, None)
+        if row is None:
+            return
+        self._rules.pop(alarm_id, None)
+        last = len(self._ids) - 1
+        if row != last:
+            moved = self._ids[last]
+            self._ids[row] = moved
+            self._row_by_id[moved] = row
+            for column in (self._second, self._active, self._room, self._mask, self._exact):
+                column[row] = column[last]
+        self._ids.pop()
+
+    def apply(self, changes):
+        """Apply ("insert"/"update"/"delete") change hints row by row"""
+        for change in changes:
+            if change[0] == "insert":
+                self._set(change[1])
+            elif change[0] == "update":
+                self._set(change[2])
+            elif change[0] == "delete":
+                self._delete(change[1])
+
+    # -- queries ---------------------------------------------------------
+
+    def _segment_rows(self, day, start, end, room_code):
+        """Rows ringing on `day` with start <= second < end (and in the room, if given)"""
+        count = len(self._ids)
+        weekday = day.weekday()
+        if self.vectorized:
+            second = self._second[:count]
+            selected = self._active[:count] & (second >= start) & (second < end)
+            selected &= ((self._mask[:count] >> weekday) & 1).astype(np.bool_)
+            if room_code is not None:
+                selected &= self._room[:count] == room_code
+            rows = np.flatnonzero(selected)
+            # Few matches carry a rule the mask cannot express: test those by date
+            inexact = rows[~self._exact[rows]]
+            if len(inexact):
+                rejected = [row for row in inexact.tolist()
+                            if not self._rules[self._ids[row]].occurs_on(day)]
+                if rejected:
+                    rows = np.setdiff1d(rows, rejected, assume_unique=True)
+            return rows.tolist()
+
+        bit = 1 << weekday
+        second, active, mask, exact, room = self._second, self._active, self._mask, self._exact, self._room
+        rows = []
+        for row in range(count):
+            if (active[row] and start <= second[row] < end and mask[row] & bit
+                    and (room_code is None or room[row] == room_code)
+                    and (exact[row] or self._rules[self._ids[row]].occurs_on(day))):
+                rows.append(row)
+        return rows
+
+    def due_in_window(self, start, seconds, room=None):
+        """Alarms ringing in [start, start + seconds), grouped per room.
+
+        start is an epoch timestamp (local time of day is used) and seconds
+        is at most a day. Returns {room: [{"id", "time", "date"}, ...]} with
+        each room's alarms in firing order.
+        """
+        seconds = int(min(max(seconds, 0), SECONDS_PER_DAY))
+        moment = datetime.datetime.fromtimestamp(start)
+        day = moment.date()
+        first = moment.hour * 3600 + moment.minute * 60 + moment.second
+        room_code = None
+        if room is not None:
+            room_code = self._room_codes.get(str(room))
+            if room_code is None:
+                return {}
+
+        # A window running past midnight is two segments on two days
+        segments = [(day, first, min(first + seconds, SECONDS_PER_DAY))]
+        if first + seconds > SECONDS_PER_DAY:
+            segments.append((day + datetime.timedelta(days=1), 0, first + seconds - SECONDS_PER_DAY))
+
+        grouped = {}
+        for segment_day, low, high in segments:
+            rows = self._segment_rows(segment_day, low, high, room_code)
+            rows.sort(key=lambda row: (self._second[row], self._ids[row]))
+            date_text = segment_day.isoformat()
+            for row in rows:
+                grouped.setdefault(self._rooms[int(self._room[row])], []).append({
+                    "id": self._ids[row],
+                    "time": format_second(int(self._second[row])),
+                    "date": date_text
+                })
+        return grouped
+
+    def rooms(self):
+        """Room names with at least one alarm"""
+        if self.vectorized:
+            used = np.unique(self._room[:len(self._ids)]).tolist()
+        else:
+            used = sorted(set(self._room[:len(self._ids)]))
+        return [self._rooms[code] for code in used]
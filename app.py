@@ -1,4 +1,4 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, jsonify, request, Response
 import subprocess
 import os
 import signal
@@ -7,8 +7,22 @@ import time
 import threading
 import atexit
 import json
+import queue
 import paho.mqtt.client as mqtt
 from flask_mqtt import Mqtt
+import alarm_history
+import alarm_store
+import alarm_state
+import change_feed
+import event_stream
+import latency
+import local_ipc
+import output_ring
+import recurrence
+import sampling_policy
+import snooze as snooze_engine
+import storage
+import timer_wheel
 
 app = Flask(__name__)
 
@@ -34,10 +48,15 @@ except Exception as e:
     mqtt_client = FallbackMqtt()
 
 script_process = None
-output_buffer = []
+output_buffer = output_ring.OutputRing(1000)  # interface output, tagged with change versions for /changes
+latest_state = None  # last alarm state seen by the state listener
+interface_metrics = {}  # counters the interface process sends ("metrics" events, or alarm/metrics/<name>)
+# Set while applying alarm changes the interface sent, so they are not sent back to it
+remote_change = threading.local()
 process_lock = threading.Lock()
-ALARMS_FILE = "alarms.json"
+ALARMS_FILE = alarm_store.ALARMS_FILE
 interface_process = None  # Store the process ID of the interface window
+single_process = False  # --single: the interface runs in this process (see run_single_process)
 
 # Set up MQTT topics
 TOPIC_ALARMS = "alarm/list"
@@ -46,6 +65,30 @@ TOPIC_ALARM_DELETED = "alarm/deleted"
 TOPIC_ALARM_TOGGLED = "alarm/toggled"
 TOPIC_ALARM_STATE = "alarm/state"
 TOPIC_OUTPUT = "alarm/output"
+TOPIC_BATCH_RESULT = "alarm/batch/result"
+TOPIC_ALARM_PAGE = "alarm/list/page"
+TOPIC_ALARM_CHANGES = "alarm/changes"
+TOPIC_LATENCY = "alarm/latency"
+
+# Query parameters that turn GET /alarms (or alarm/request/list) into an index query
+ALARM_QUERY_PARAMS = ("active", "from", "to", "limit", "cursor")
+ALARM_QUERY_MAX_LIMIT = 500
+
+# Upper bound on firings returned by /alarms/next
+ALARM_NEXT_MAX = 100
+
+# Default and largest window (seconds) for /alarms/due
+ALARM_DUE_WINDOW = 60
+ALARM_DUE_MAX_WINDOW = 86400
+# Most events returned by one /alarms/history request
+ALARM_HISTORY_MAX = 1000
+
+# Upper bound on operations accepted in one /alarms/batch or alarm/request/batch
+BATCH_MAX_OPERATIONS = 5000
+
+# Long-poll settings for /changes (seconds)
+LONG_POLL_TIMEOUT = 25
+LONG_POLL_MAX_TIMEOUT = 55
 
 PI5_MODE = False
 try:
@@ -69,6 +112,8 @@ def handle_connect(client, userdata, flags, rc):
     print(f"Connected to MQTT broker with result code {rc}")
     # Subscribe to client requests
     mqtt_client.subscribe("alarm/request/#")
+    # and to the interface's counters, reported in /metrics
+    mqtt_client.subscribe("alarm/metrics/#")
 
 @mqtt_client.on_message()
 def handle_mqtt_message(client, userdata, message):
@@ -84,39 +129,57 @@ def handle_mqtt_message(client, userdata, message):
         
         # Process different request types
         if topic == "alarm/request/list":
-            # Client is requesting alarm list
-            publish_alarms()
+            # Client is requesting alarm list (one page of it when it sent a query)
+            if isinstance(data, dict) and any(key in data for key in ALARM_QUERY_PARAMS):
+                publish_alarm_page(data)
+            else:
+                publish_alarms()
         elif topic == "alarm/request/add":
             try:
                 hour = int(data.get('hour', 0))
                 minute = int(data.get('minute', 0))
                 second = int(data.get('second', 0))
-                add_alarm_mqtt(hour, minute, second)
+                add_alarm_mqtt(hour, minute, second, data.get('repeat'), data.get('room'),
+                               data.get('wake_window'))
             except Exception as e:
                 print(f"Error processing add alarm request: {e}")
                 mqtt_client.publish("alarm/error", f"Failed to add alarm: {str(e)}")
         elif topic == "alarm/request/delete":
             try:
-                index = int(data.get('index', -1))
-                if index >= 0:
-                    delete_alarm_mqtt(index)
+                alarm_id = request_alarm_id(data)
+                if alarm_id is not None:
+                    delete_alarm_mqtt(alarm_id)
             except Exception as e:
                 print(f"Error processing delete alarm request: {e}")
                 mqtt_client.publish("alarm/error", f"Failed to delete alarm: {str(e)}")
         elif topic == "alarm/request/toggle":
             try:
-                index = int(data.get('index', -1))
-                if index >= 0:
-                    toggle_alarm_mqtt(index)
+                alarm_id = request_alarm_id(data)
+                if alarm_id is not None:
+                    toggle_alarm_mqtt(alarm_id)
             except Exception as e:
                 print(f"Error processing toggle alarm request: {e}")
                 mqtt_client.publish("alarm/error", f"Failed to toggle alarm: {str(e)}")
+        elif topic == "alarm/request/batch":
+            try:
+                batch_alarms_mqtt(data)
+            except Exception as e:
+                print(f"Error processing batch request: {e}")
+                mqtt_client.publish("alarm/error", f"Failed to apply batch: {str(e)}")
         elif topic == "alarm/request/snooze":
             try:
-                snooze_alarm_mqtt()
+                snooze_alarm_mqtt(data)
             except Exception as e:
                 print(f"Error processing snooze request: {e}")
                 mqtt_client.publish("alarm/error", f"Failed to snooze alarm: {str(e)}")
+        elif topic == "alarm/request/latency":
+            safe_mqtt_publish(TOPIC_LATENCY, latency_report())
+        elif topic == "alarm/request/dismiss":
+            try:
+                dismiss_alarm_mqtt()
+            except Exception as e:
+                print(f"Error processing dismiss request: {e}")
+                mqtt_client.publish("alarm/error", f"Failed to dismiss alarm: {str(e)}")
         elif topic == "alarm/request/hardware":
             # Handle hardware control requests via MQTT
             try:
@@ -148,7 +211,7 @@ def handle_mqtt_message(client, userdata, message):
             # Handle sensor data requests via MQTT
             try:
                 from hardware_bridge import get_sensor_data
-                sensor_data = get_sensor_data()
+                sensor_data = sensor_snapshot(get_sensor_data)
                 mqtt_client.publish("alarm/sensor/data", json.dumps(sensor_data))
             except ImportError:
                 mqtt_client.publish("alarm/sensor/data", json.dumps({
@@ -163,20 +226,14 @@ def handle_mqtt_message(client, userdata, message):
                     "error": str(e),
                     "timestamp": time.time()
                 }))
+        elif topic.startswith("alarm/metrics/"):
+            interface_metrics[topic[len("alarm/metrics/"):]] = data
         elif topic == "alarm/list" and isinstance(data, list):
             # Got an alarm list from another client (likely the GUI)
             # Update our local copy without republishing to avoid loops
             try:
-                # Load current alarms for comparison
-                current_alarms = []
-                if os.path.exists(ALARMS_FILE):
-                    with open(ALARMS_FILE, 'r') as f:
-                        current_alarms = json.load(f)
-                
-                # Only update if different
-                if json.dumps(current_alarms, sort_keys=True) != json.dumps(data, sort_keys=True):
-                    with open(ALARMS_FILE, 'w') as f:
-                        json.dump(data, f)
+                # Only written if different from the cached copy
+                if alarm_store.replace_alarms(data):
                     print(f"Updated alarms from MQTT message: {len(data)} alarms")
             except Exception as e:
                 print(f"Error updating alarms from MQTT: {e}")
@@ -186,9 +243,20 @@ def handle_mqtt_message(client, userdata, message):
     except Exception as e:
         print(f"Error processing MQTT message: {e}")
 
+def request_alarm_id(data):
+    """Alarm id from an MQTT request: {"id": ...}, or {"index": n} from older clients"""
+    if data.get('id'):
+        return str(data['id'])
+    index = int(data.get('index', -1))
+    alarm_id = alarm_store.alarm_id_at(index)
+    if alarm_id is None:
+        mqtt_client.publish("alarm/error", json.dumps({
+            "message": f"Invalid alarm index: {index}"
+        }))
+    return alarm_id
+
 def read_output(process):
     """Read output from the process and store it in buffer"""
-    global output_buffer
     while True:
         try:
             if process.poll() is not None:
@@ -198,16 +266,49 @@ def read_output(process):
             if not line:
                 break
                 
-            line_str = line.decode('utf-8').strip()
-            output_buffer.append(line_str)
-            print(f"Process output: {line_str}")  # Log to console for debugging
-            
-            # Publish output to MQTT
-            mqtt_client.publish(TOPIC_OUTPUT, line_str)
+            # The pipe is opened in text mode, so lines are already str
+            handle_output_line(line.strip())
         except Exception as e:
             print(f"Error reading process output: {e}")
             break
 
+def handle_output_line(line_str):
+    """One line of interface output, from its stdout pipe or the local channel"""
+    change_feed.notify("output", lambda version: output_buffer.append(line_str, tag=version))
+    event_stream.publish("output", {"line": line_str})
+    print(f"Process output: {line_str}")  # Log to console for debugging
+    
+    # Publish output to MQTT
+    mqtt_client.publish(TOPIC_OUTPUT, line_str)
+
+def on_interface_event(channel, name, data):
+    """Events the interface process sends over the local channel (see local_ipc.py)"""
+    if name == "hello":
+        print(f"Interface connected over IPC: {data}")
+    elif name == "alarms_changed":
+        # It already wrote them; take them in without a round trip through the broker
+        changes = data.get("changes")
+        remote_change.active = True
+        try:
+            alarm_store.apply_remote(None if changes is None else storage.changes_from_json(changes),
+                                     data.get("version"))
+        finally:
+            remote_change.active = False
+    elif name == "state":
+        # Written to the shared segment already: read it now rather than at the next watch poll
+        alarm_state.refresh()
+    elif name == "output":
+        handle_output_line(data["line"])
+    elif name == "metrics":
+        interface_metrics[data["name"]] = data["data"]
+
+def push_state_to_interface(state):
+    """Let the interface pick up a state written here at once"""
+    ipc.broadcast("state", role="interface")
+
+# Local channel to the interface process; MQTT is for external clients
+ipc = local_ipc.Server(handlers={"ping": lambda params: params}, on_event=on_interface_event)
+
 def launch_interface_fullscreen():
     """Launch the interface_1.py script in a new process"""
     global interface_process
@@ -225,6 +326,8 @@ def launch_interface_fullscreen():
         env = os.environ.copy()
         env['PYTHONUNBUFFERED'] = '1'  # Disable output buffering
         env['ALARM_DEBUG'] = '1'  # Add debug flag for our code
+        # Its output comes over the local channel once connected (nothing reads the pipe)
+        env['ALARM_IPC_OUTPUT'] = 'exclusive'
         env['DISPLAY'] = os.environ.get('DISPLAY', ':0')  # Ensure X display is set
         env['XAUTHORITY'] = os.environ.get('XAUTHORITY', os.path.expanduser('~/.Xauthority'))
         
@@ -245,6 +348,8 @@ def launch_interface_fullscreen():
         stderr_thread = threading.Thread(target=read_stderr, args=(interface_process,))
         stderr_thread.daemon = True
         stderr_thread.start()
+        # Output printed before it connects to the local channel comes through the pipe
+        threading.Thread(target=read_output, args=(interface_process,), daemon=True).start()
         
         # Give it a moment to start and check for immediate errors
         time.sleep(1)
@@ -289,15 +394,41 @@ def launch_interface_fullscreen():
     return False
 
 
+def run_single_process(gui=True):
+    """--single: Flask in a worker thread, the interface (GUI, or headless engine) on this thread.
+
+    interface_1 is imported once, so hardware_bridge finds it loaded and uses
+    its devices instead of opening the pins again; its alarm list follows
+    alarm_store, so there is no file, MQTT or IPC traffic between the two.
+    Returns when the interface exits.
+    """
+    global single_process
+    single_process = True
+    os.environ['ALARM_SINGLE_PROCESS'] = '1'
+    os.environ['WEB_MODE'] = '0' if gui else '1'
+    if gui:
+        os.environ.setdefault('DISPLAY', ':0')
+        os.environ.setdefault('XAUTHORITY', os.path.expanduser('~/.Xauthority'))
+    import interface_1
+    interface_1.metrics_sink = interface_metrics.__setitem__
+    
+    web_server = threading.Thread(target=app.run, kwargs={"debug": False, "host": '0.0.0.0', "use_reloader": False},
+                                  name="web-server", daemon=True)
+    web_server.start()
+    interface_1.main()
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
 @app.route('/start', methods=['POST'])
 def start_script():
-    global script_process, output_buffer, interface_process
+    global script_process, interface_process
     
     with process_lock:
+        if single_process:
+            return jsonify({"status": "error", "message": "The alarm engine runs inside the web server (--single)"})
+        
         # Check if script is already running (either from web or from GUI)
         if script_process is not None:
             return jsonify({"status": "error", "message": "Script is already running"})
@@ -306,11 +437,12 @@ def start_script():
         if interface_process is not None:
             return jsonify({"status": "error", "message": "Interface GUI is already running"})
         
-        output_buffer = []
         try:
             # Set environment variable for web mode
             env = os.environ.copy()
             env['WEB_MODE'] = '1'
+            # Each line comes either through the pipe or over the local channel, never both
+            env['ALARM_IPC_OUTPUT'] = 'exclusive'
             
             # Start the alarm script with stdout and stderr redirected
             script_process = subprocess.Popen(
@@ -336,6 +468,8 @@ def stop_script():
     global script_process
     
     with process_lock:
+        if single_process:
+            return jsonify({"status": "error", "message": "The alarm engine runs inside the web server (--single)"})
         if script_process is None:
             return jsonify({"status": "error", "message": "No script is running"})
         
@@ -354,7 +488,10 @@ def stop_script():
 
 @app.route('/output')
 def get_output():
+    """Return the output lines after sequence `after` (all retained lines without it)"""
     global script_process
+    after = request.args.get('after', 0, type=int)
+    limit = request.args.get('limit', type=int)
     
     with process_lock:
         status = "stopped"
@@ -364,40 +501,163 @@ def get_output():
                 script_process = None
             else:
                 status = "running"
-        
-        output = output_buffer.copy()
-        output_buffer.clear()  # Using clear() instead of assignment
-        
-        return jsonify({
-            "status": status,
-            "output": output
-        })
+    
+    # Each client keeps its own cursor, so reading no longer consumes lines
+    output, seq, dropped = output_buffer.read_after(after, limit)
+    return jsonify({
+        "status": status,
+        "output": output,
+        "seq": seq,
+        "dropped": dropped
+    })
+
+def not_modified(digest, version):
+    """Return a 304 response if the client already holds this alarm list, else None"""
+    if request.if_none_match.contains(digest):
+        response = Response(status=304)
+        response.set_etag(digest)
+        response.headers['X-Alarm-Version'] = str(version)
+        return response
+    return None
+
+def encode_alarms_body(alarms, version, digest, changed_at):
+    """HTTP body for GET /alarms (cached by alarm_store until the list changes)"""
+    return json.dumps({
+        "status": "success", 
+        "alarms": alarms,
+        "timestamp": changed_at,
+        "version": version,
+        "content_hash": digest
+    }).encode('utf-8')
+
+def encode_alarms_payload(alarms, version, digest, changed_at):
+    """MQTT alarm/list payload (cached by alarm_store until the list changes)"""
+    return json.dumps(alarms).encode('utf-8')
+
+def parse_alarm_query(params):
+    """Return query_alarms() keyword arguments from request args or an MQTT payload"""
+    active = params.get("active")
+    if isinstance(active, str):
+        active = {"true": True, "1": True, "false": False, "0": False}.get(active.lower())
+    limit = params.get("limit")
+    limit = min(int(limit), ALARM_QUERY_MAX_LIMIT) if limit not in (None, "") else None
+    if limit is not None and limit < 1:
+        raise ValueError("limit must be positive")
+    return {
+        "active": active if isinstance(active, bool) else None,
+        "start": params.get("from") or None,
+        "end": params.get("to") or None,
+        "limit": limit,
+        "cursor": params.get("cursor") or None
+    }
+
+def alarm_page(params):
+    """Run an index query and return the response body"""
+    alarms, next_cursor, total, version = alarm_store.query_alarms(**parse_alarm_query(params))
+    return {
+        "status": "success",
+        "alarms": alarms,
+        "next_cursor": next_cursor,
+        "total": total,
+        "version": version
+    }
 
 @app.route('/alarms', methods=['GET'])
 def get_alarms():
     try:
-        # Force reading from disk, bypass any OS caching
-        os.sync()
-        if os.path.exists(ALARMS_FILE):
-            last_modified = os.path.getmtime(ALARMS_FILE)
-            with open(ALARMS_FILE, 'r') as f:
-                alarms = json.load(f)
-                # Read the current file content for hash comparison
-                f.seek(0)
-                content = f.read()
-                content_hash = hash(content)
-                return jsonify({
-                    "status": "success", 
-                    "alarms": alarms,
-                    "timestamp": last_modified,
-                    "content_hash": content_hash
-                })
-        else:
-            return jsonify({"status": "success", "alarms": [], "timestamp": 0, "content_hash": 0})
+        if any(key in request.args for key in ALARM_QUERY_PARAMS):
+            # Filtered/paged view, sorted by time, straight from the index
+            return jsonify(alarm_page(request.args))
+        
+        # Answered from memory: conditional polls never touch the SD card
+        version, digest, changed_at = alarm_store.get_version()
+        cached = not_modified(digest, version)
+        if cached is not None:
+            return cached
+        
+        # The cached bytes are handed to the response as-is, without re-encoding
+        body, version, digest = alarm_store.get_encoded("http", encode_alarms_body)
+        response = Response(body, mimetype='application/json')
+        response.set_etag(digest)
+        response.headers['X-Alarm-Version'] = str(version)
+        return response
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)})
 
 
+@app.route('/alarms/next', methods=['GET'])
+def next_alarms():
+    """Upcoming firings, soonest first (?n=, default 1), with repeat rules applied"""
+    try:
+        n = int(request.args.get('n', 1))
+        if not 1 <= n <= ALARM_NEXT_MAX:
+            raise ValueError(f"n must be between 1 and {ALARM_NEXT_MAX}")
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    try:
+        firings = [{
+            "id": alarm["id"],
+            "time": alarm["time"],
+            "repeat": recurrence.describe(alarm.get("repeat")),
+            "fires_at": fire,
+            "fires_at_local": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(fire))
+        } for fire, alarm in alarm_store.next_alarms(n)]
+        return jsonify({"status": "success", "next": firings})
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)})
+
+@app.route('/alarms/due', methods=['GET'])
+def due_alarms():
+    """Alarms ringing within ?window= seconds from now (or ?start=), grouped per room (?room= for one)"""
+    try:
+        window = int(request.args.get('window', ALARM_DUE_WINDOW))
+        if not 1 <= window <= ALARM_DUE_MAX_WINDOW:
+            raise ValueError(f"window must be between 1 and {ALARM_DUE_MAX_WINDOW} seconds")
+        start = float(request.args.get('start', time.time()))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    try:
+        rooms = alarm_store.due_in_window(start, window, request.args.get('room'))
+        return jsonify({"status": "success", "start": start, "window": window, "rooms": rooms})
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)})
+
+@app.route('/alarms/history', methods=['GET'])
+def alarm_history_events():
+    """Fire/snooze/dismiss/challenge events, newest first, with their aggregates.
+
+    ?since= and ?until= bound the events (epoch seconds), ?alarm= keeps one
+    alarm, ?event= one kind (fire, snooze, dismiss, challenge) and ?limit=
+    caps the count (default 100). The aggregates (counts, median time to
+    dismiss per alarm and per weekday) cover the whole history.
+    """
+    try:
+        since = request.args.get('since')
+        until = request.args.get('until')
+        since = float(since) if since is not None else None
+        until = float(until) if until is not None else None
+        limit = int(request.args.get('limit', 100))
+        if not 1 <= limit <= ALARM_HISTORY_MAX:
+            raise ValueError(f"limit must be between 1 and {ALARM_HISTORY_MAX}")
+        kind = None
+        if request.args.get('event'):
+            kinds = {name: kind for kind, name in alarm_history.KIND_NAMES.items()}
+            if request.args['event'] not in kinds:
+                raise ValueError(f"event must be one of: {', '.join(kinds)}")
+            kind = kinds[request.args['event']]
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    try:
+        history = alarm_history.get_history()
+        alarm_id = request.args.get('alarm')
+        return jsonify({
+            "status": "success",
+            "events": history.events(since, until, alarm_id, kind, limit),
+            "aggregates": history.aggregates(alarm_id)
+        })
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)})
+
 @app.route('/mqtt_test')
 def mqtt_test():
     """Test page for MQTT WebSocket connection"""
@@ -415,49 +675,21 @@ def add_alarm():
         alarm_time = f"{hour:02d}:{minute:02d}:{second:02d}"
         print(f"Attempting to add alarm for {alarm_time}")
         
-        # Execute a Python script to add the alarm
-        result = subprocess.run(
-            [sys.executable, '-c', f'''
-import json, os
-alarms_file = "{ALARMS_FILE}"
-alarm_time = "{hour:02d}:{minute:02d}:{second:02d}"
-alarms = []
-
-if os.path.exists(alarms_file):
-    with open(alarms_file, 'r') as f:
-        alarms = json.load(f)
-
-# Check if alarm already exists
-exists = False
-for alarm in alarms:
-    if alarm["time"] == alarm_time:
-        exists = True
-        break
-
-if not exists:
-    alarms.append({{"time": alarm_time, "active": True}})
-    with open(alarms_file, 'w') as f:
-        json.dump(alarms, f)
-        f.flush()
-        os.fsync(f.fileno())
-    print("Alarm added")
-else:
-    print("Alarm already exists")
-
-# Ensure file is properly flushed to disk
-os.sync()
-'''],
-            capture_output=True,
-            text=True
-        )
-        
-        print(f"Command output: {result.stdout.strip()}")
-        print(f"Command error: {result.stderr.strip()}" if result.stderr else "No errors")
+        # Optional recurrence rule, e.g. {"days": ["mon", "tue", "wed", "thu", "fri"]},
+        # and wake window: minutes before alarm_time it may ring on light sleep
+        alarm = alarm_store.add_alarm(alarm_time, data.get('repeat'), data.get('room'),
+                                      data.get('wake_window'))
+        if alarm is not None:
+            output = "Alarm added"
+        else:
+            output = "Alarm already exists"
+        print(output)
         
         return jsonify({
             "status": "success",
             "message": f"Alarm set for {hour:02d}:{minute:02d}:{second:02d}",
-            "output": result.stdout.strip()
+            "output": output,
+            "alarm": alarm
         })
     except Exception as e:
         print(f"Error adding alarm: {e}")
@@ -466,109 +698,97 @@ os.sync()
         return jsonify({"status": "error", "message": str(e)})
 
 @app.route('/alarm/<int:index>', methods=['DELETE'])
-def delete_alarm(index):
+def delete_alarm_by_index(index):
+    """Compatibility shim for clients that address alarms by list position"""
+    return delete_alarm(alarm_store.alarm_id_at(index))
+
+@app.route('/alarm/<alarm_id>', methods=['DELETE'])
+def delete_alarm(alarm_id):
     try:
-        # Execute a Python script to delete the alarm
-        result = subprocess.run(
-            [sys.executable, '-c', f'''
-import json, os
-alarms_file = "{ALARMS_FILE}"
-index = {index}
-alarms = []
-
-if os.path.exists(alarms_file):
-    with open(alarms_file, 'r') as f:
-        alarms = json.load(f)
-
-if 0 <= index < len(alarms):
-    deleted = alarms.pop(index)
-    with open(alarms_file, 'w') as f:
-        json.dump(alarms, f)
-    print(f"Deleted alarm at {{deleted['time']}}")
-else:
-    print("Invalid alarm index")
-'''],
-            capture_output=True,
-            text=True
-        )
+        deleted = alarm_store.delete_alarm(alarm_id) if alarm_id else None
+        if deleted is not None:
+            output = f"Deleted alarm at {deleted['time']}"
+        else:
+            output = "Invalid alarm id"
         
         return jsonify({
             "status": "success",
             "message": "Alarm deleted",
-            "output": result.stdout.strip()
+            "output": output
         })
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)})
 
 @app.route('/alarm/<int:index>/toggle', methods=['POST'])
-def toggle_alarm(index):
-    try:
-        # Execute a Python script to toggle the alarm
-        result = subprocess.run(
-            [sys.executable, '-c', f'''
-import json, os, time
-from alarm_state import clear_state, set_state, get_state
-alarms_file = "{ALARMS_FILE}"
-index = {index}
-alarms = []
+def toggle_alarm_by_index(index):
+    """Compatibility shim for clients that address alarms by list position"""
+    return toggle_alarm(alarm_store.alarm_id_at(index))
 
-try:
-    if os.path.exists(alarms_file):
-        with open(alarms_file, 'r') as f:
-            alarms = json.load(f)
-
-    if 0 <= index < len(alarms):
-        # Toggle the alarm
-        alarms[index]["active"] = not alarms[index]["active"]
-        status = "activated" if alarms[index]["active"] else "deactivated"
-        message = f"Alarm at {{alarms[index]['time']}} {{status}}"
+@app.route('/alarm/<alarm_id>/toggle', methods=['POST'])
+def toggle_alarm(alarm_id):
+    try:
+        alarm = alarm_store.toggle_alarm(alarm_id) if alarm_id else None
+        if alarm is None:
+            return jsonify({
+                "status": "success",
+                "message": "Invalid alarm id"
+            })
+        
+        status = "activated" if alarm["active"] else "deactivated"
+        message = f"Alarm at {alarm['time']} {status}"
         
         # If deactivating an alarm that matches the current time, also clear alarm state
-        if not alarms[index]["active"]:
+        if not alarm["active"]:
+            from alarm_state import clear_state, get_state
             current_state = get_state()
             current_time = time.strftime('%H:%M:%S')
             
-            if current_state["alarm_active"] and alarms[index]["time"] == current_time:
+            if current_state["alarm_active"] and alarm["time"] == current_time:
                 clear_state()
                 print("Cleared alarm state because matching alarm was deactivated")
         
-        # Save changes
-        with open(alarms_file, 'w') as f:
-            json.dump(alarms, f)
-            f.flush()
-            os.fsync(f.fileno())
         print(message)
-        
-        # Also ensure file is properly flushed to disk
-        os.sync()
-    else:
-        message = "Invalid alarm index"
-        print(message)
-except Exception as e:
-    print(f"Error: {{e}}")
-    message = f"Error: {{e}}"
-'''],
-            capture_output=True,
-            text=True
-        )
-        
-        stdout = result.stdout.strip()
-        stderr = result.stderr.strip()
-        
-        # Check if there was an error in the Python script
-        if "Error:" in stdout or stderr:
-            return jsonify({
-                "status": "error",
-                "message": stdout if "Error:" in stdout else stderr
-            })
-        
         return jsonify({
             "status": "success",
-            "message": stdout
+            "message": message,
+            "alarm": alarm
         })
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)})
 
+@app.route('/alarms/batch', methods=['POST'])
+def batch_alarms():
+    """Apply a list of add/delete/toggle/edit operations in one write and one delta"""
+    try:
+        data = request.json
+        operations, atomic = batch_request(data)
+        # Listeners publish a single delta for the whole batch
+        results, applied = alarm_store.apply_batch(operations, atomic)
+        
+        version, digest, changed_at = alarm_store.get_version()
+        return jsonify({
+            "status": "success" if applied or not operations else "error",
+            "applied": applied,
+            "results": results,
+            "version": version,
+            "content_hash": digest
+        })
+    except Exception as e:
+        print(f"Error applying alarm batch: {e}")
+        return jsonify({"status": "error", "message": str(e)})
+
+def batch_request(data):
+    """Return (operations, atomic) from a batch body: a list or {"operations": [...], "atomic": bool}"""
+    atomic = True
+    if isinstance(data, dict):
+        atomic = bool(data.get("atomic", True))
+        data = data.get("operations")
+    if not isinstance(data, list):
+        raise ValueError("expected a list of operations")
+    if len(data) > BATCH_MAX_OPERATIONS:
+        raise ValueError(f"too many operations (max {BATCH_MAX_OPERATIONS})")
+    return data, atomic
+
 @app.route('/alarm_state')
 def get_alarm_state():
     """Check if any alarm is currently active"""
@@ -584,37 +804,70 @@ def get_alarm_state():
 
 @app.route('/snooze', methods=['POST'])
 def snooze():
-    """Snooze the currently active alarm"""
+    """Snooze the currently active alarm; JSON body {"minutes": n} overrides the default duration"""
     try:
-        from alarm_state import clear_state
-        clear_state()
-        return jsonify({"status": "success", "message": "Alarm snoozed"})
-    except ImportError:
-        return jsonify({"status": "error", "message": "State module not available"})
+        data = request.get_json(silent=True) or {}
+        state = snooze_engine.snooze(data.get("minutes"))
+        if state is None:
+            return jsonify({"status": "success", "message": "No alarm is ringing"})
+        return jsonify({"status": "success", "message": state["message"], "state": state})
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)})
+
+@app.route('/dismiss', methods=['POST'])
+def dismiss():
+    """Stop the alarm, including any pending snooze"""
+    try:
+        state = snooze_engine.dismiss()
+        return jsonify({"status": "success", "message": "Alarm dismissed", "state": state})
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)})
 
 @app.route('/check_alarms_updated')
 def check_alarms_updated():
-    """Check if the alarms file has been modified"""
+    """Check if the alarms have been modified"""
     try:
-        if os.path.exists(ALARMS_FILE):
-            # Get the actual content modification time
-            last_modified = os.path.getmtime(ALARMS_FILE)
-            # Read the current file content for hash comparison
-            with open(ALARMS_FILE, 'rb') as f:
-                content = f.read()
-                content_hash = hash(content)
-            
-            return jsonify({
-                "timestamp": last_modified,
-                "content_hash": content_hash
-            })
-        else:
-            return jsonify({"timestamp": 0, "content_hash": 0})
+        version, digest, changed_at = alarm_store.get_version()
+        cached = not_modified(digest, version)
+        if cached is not None:
+            return cached
+        
+        response = jsonify({
+            "timestamp": changed_at,
+            "version": version,
+            "content_hash": digest
+        })
+        response.set_etag(digest)
+        return response
     except Exception as e:
         return jsonify({"timestamp": 0, "content_hash": 0, "error": str(e)})
 
+@app.route('/metrics')
+def metrics():
+    """Internal counters for performance monitoring"""
+    backend = storage.get_storage()
+    version, digest, changed_at = alarm_store.get_version()
+    return jsonify({
+        "alarms": {"version": version, "changed_at": changed_at},
+        "serialization_cache": alarm_store.cache_stats(),
+        "storage": dict(backend.stats, backend=backend.name),
+        "event_stream": {"clients": event_stream.client_count()},
+        "output": {"last_seq": output_buffer.last_seq()},
+        "latency": latency.snapshot()["stages"],
+        "timer_wheel": dict(timer_wheel.get_wheel().stats, pending=len(timer_wheel.get_wheel())),
+        "sampling": sampling.snapshot(),
+        "alarm_state": alarm_state.stats(),
+        "ipc": ipc.snapshot(),
+        "interface": interface_metrics
+    })
+
+@app.route('/metrics/latency')
+def metrics_latency():
+    """Firing latency histograms per stage and the most recent traces"""
+    return jsonify(latency_report())
+
 @app.route('/status')
 def get_status():
     """Return the status of the local application"""
@@ -653,6 +906,174 @@ def cleanup():
 # Register cleanup function to be called on exit
 atexit.register(cleanup)
 
+# MQTT and IPC sends for alarm changes, made by one thread in change order:
+# on_alarms_changed runs under the alarm_store lock, so it must not block on a peer
+outbound = queue.Queue()
+
+def send_outbound():
+    while True:
+        send = outbound.get()
+        try:
+            send()
+        except Exception as e:
+            print(f"Error sending alarm change: {e}")
+
+threading.Thread(target=send_outbound, name="alarm-outbound", daemon=True).start()
+
+def on_alarms_changed(version, changes=None):
+    change_feed.notify("alarms")
+    to_interface = not getattr(remote_change, "active", False)
+    if changes is None:
+        # Whole list replaced or reloaded: clients need a full snapshot
+        if to_interface:
+            outbound.put(lambda: ipc.broadcast("alarms_changed", {"changes": None}, role="interface"))
+        outbound.put(publish_alarms)
+        if event_stream.client_count():
+            alarms, version, digest, changed_at = alarm_store.get_snapshot()
+            event_stream.publish("alarms", {"version": version, "alarms": alarms, "content_hash": digest})
+        return
+    
+    # Ids make deltas unambiguous, so mutations never republish the whole list
+    delta = {"version": version, "changes": storage.changes_to_json(changes)}
+    outbound.put(lambda: safe_mqtt_publish(TOPIC_ALARM_CHANGES, delta))
+    event_stream.publish("alarm_delta", delta)
+    if to_interface:
+        message = {"changes": delta["changes"], "version": storage.get_storage().alarms_version}
+        outbound.put(lambda: ipc.broadcast("alarms_changed", message, role="interface"))
+
+def on_state_changed(state):
+    global latest_state
+    latest_state = state
+    change_feed.notify("state")
+    # Relay at once rather than at the next publish_alarm_state_loop tick
+    safe_mqtt_publish(TOPIC_ALARM_STATE, state)
+    published_at = time.time()
+    event_stream.publish("state", state)
+    if state.get("alarm_active") and state.get("trace"):
+        # Time the web stages of a firing traced by the interface (see latency.py)
+        latency.complete(state["trace"], mqtt_published=published_at, client_notified=time.time())
+
+def latency_report():
+    """Firing latency seen by both processes"""
+    return {
+        "web": latency.snapshot(),
+        "interface": interface_metrics.get("latency")
+    }
+
+def next_alarm_time():
+    """Timestamp of the next alarm to ring, or None"""
+    upcoming = alarm_store.next_alarms(1)
+    return upcoming[0][0] if upcoming else None
+
+# Sensor snapshots for web clients: every 30 s far from any alarm, every 2 s
+# while one rings, shared by /sensor_data and /events (see sampling_policy.py)
+sampling = sampling_policy.SamplingPolicy(next_alarm_time, alarm_state.current_state)
+
+def sensor_snapshot(get_sensor_data):
+    """The shared sensor snapshot, with the period clients should poll it at"""
+    data, period = sampling.cached("web", get_sensor_data)
+    return dict(data, poll_interval=period)
+
+sensor_sampler_lock = threading.Lock()
+sensor_sampler_running = False
+
+def sensor_sampler_loop():
+    """Push sensor snapshots to /events subscribers until the last one leaves"""
+    global sensor_sampler_running
+    try:
+        from hardware_bridge import get_sensor_data
+    except Exception as e:
+        print(f"Sensor events not available: {e}")
+        get_sensor_data = None
+    while True:
+        with sensor_sampler_lock:
+            # Checked and cleared together so a new subscriber either sees the
+            # sampler still running or restarts it
+            if get_sensor_data is None or not event_stream.client_count():
+                sensor_sampler_running = False
+                return
+        period = sampling_policy.RECHECK_SECONDS
+        try:
+            snapshot = sensor_snapshot(get_sensor_data)
+            period = snapshot["poll_interval"]
+            event_stream.publish("sensor", snapshot)
+        except Exception as e:
+            print(f"Error sampling sensors for events: {e}")
+        time.sleep(period)
+
+def start_sensor_sampler():
+    """Start the sensor sampler thread if it is not already running"""
+    global sensor_sampler_running
+    with sensor_sampler_lock:
+        if sensor_sampler_running:
+            # A new subscriber should not wait up to an idle period for its first snapshot
+            last = sampling.last("web")
+            if last is not None:
+                event_stream.publish("sensor", last)
+            return
+        sensor_sampler_running = True
+    threading.Thread(target=sensor_sampler_loop, daemon=True).start()
+
+# Wake long-poll and SSE clients on every alarm or alarm state change
+alarm_store.add_listener(on_alarms_changed)
+alarm_state.add_listener(on_state_changed)
+alarm_state.add_publisher(push_state_to_interface)
+alarm_state.watch()
+ipc.start()
+event_stream.add_subscribe_hook(start_sensor_sampler)
+
+@app.route('/events')
+def events():
+    """Server-Sent Events stream of alarm deltas, alarm state, output and sensor data"""
+    def stream():
+        client = event_stream.subscribe()
+        try:
+            # Subscribe before taking the snapshot so no change is missed;
+            # clients skip deltas whose version is not newer than the snapshot
+            resync = True
+            while True:
+                if resync:
+                    alarms, version, digest, changed_at = alarm_store.get_snapshot()
+                    yield event_stream.encode("alarms", {"version": version, "alarms": alarms, "content_hash": digest})
+                    yield event_stream.encode("state", latest_state if latest_state is not None else alarm_state.get_state())
+                    resync = False
+                message = client.get(event_stream.KEEPALIVE_INTERVAL)
+                if client.take_dropped():
+                    # Deltas were lost to the drop-oldest policy: start over from a snapshot
+                    resync = True
+                    continue
+                yield message if message is not None else ": keepalive\n\n"
+        finally:
+            event_stream.unsubscribe(client)
+    
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/changes')
+def changes():
+    """Long-poll: wait until the alarms, alarm state or output advance past `since`"""
+    since = request.args.get('since', type=int)
+    timeout = min(request.args.get('timeout', LONG_POLL_TIMEOUT, type=float), LONG_POLL_MAX_TIMEOUT)
+    
+    if since is None:
+        # First request: send everything and the version to continue from
+        version = change_feed.current_version()
+        changed = list(change_feed.CHANNELS)
+        since = 0
+    else:
+        version, changed = change_feed.wait_for_changes(since, timeout)
+    
+    body = {"version": version, "changed": changed}
+    if "alarms" in changed:
+        alarms, alarms_version, digest, changed_at = alarm_store.get_snapshot()
+        body["alarms"] = alarms
+        body["content_hash"] = digest
+    if "state" in changed:
+        body["state"] = latest_state if latest_state is not None else alarm_state.get_state()
+    if "output" in changed:
+        body["output"] = output_buffer.read_tagged_after(since, until=version)
+    return jsonify(body)
+
 # MQTT message broker for WebSockets
 @app.route('/mqtt')
 def mqtt_status():
@@ -670,56 +1091,41 @@ def mqtt_status():
 def publish_alarms():
     """Publish the current list of alarms to MQTT"""
     try:
-        if os.path.exists(ALARMS_FILE):
-            with open(ALARMS_FILE, 'r') as f:
-                alarms = json.load(f)
-                mqtt_client.publish(TOPIC_ALARMS, json.dumps(alarms))
-                print(f"Published {len(alarms)} alarms to MQTT")
-                return True
-        else:
-            mqtt_client.publish(TOPIC_ALARMS, "[]")
-            return True
+        payload, version, digest = alarm_store.get_encoded("mqtt", encode_alarms_payload)
+        mqtt_client.publish(TOPIC_ALARMS, payload)
+        print(f"Published alarm list version {version} to MQTT")
+        return True
     except Exception as e:
         print(f"Error publishing alarms to MQTT: {e}")
         return False
 
-def add_alarm_mqtt(hour, minute, second):
+def publish_alarm_page(data):
+    """Publish one page of an alarm query (the MQTT equivalent of /alarms?...)"""
+    try:
+        body = alarm_page(data)
+        body["request_id"] = data.get("request_id")
+    except ValueError as e:
+        body = {"status": "error", "message": str(e), "request_id": data.get("request_id")}
+    mqtt_client.publish(TOPIC_ALARM_PAGE, json.dumps(body))
+    return body["status"] == "success"
+
+def add_alarm_mqtt(hour, minute, second, repeat=None, room=None, wake_window=None):
     """Add alarm via MQTT request"""
     try:
         # Format the time properly with leading zeros
         alarm_time = f"{hour:02d}:{minute:02d}:{second:02d}"
         print(f"MQTT: Adding alarm for {alarm_time}")
         
-        # Load existing alarms
-        alarms = []
-        if os.path.exists(ALARMS_FILE):
-            with open(ALARMS_FILE, 'r') as f:
-                alarms = json.load(f)
-        
-        # Check if alarm already exists
-        exists = False
-        for alarm in alarms:
-            if alarm["time"] == alarm_time:
-                exists = True
-                break
-        
-        # Add new alarm if it doesn't exist
-        if not exists:
-            alarms.append({"time": alarm_time, "active": True})
-            with open(ALARMS_FILE, 'w') as f:
-                json.dump(alarms, f)
-                f.flush()
-                os.fsync(f.fileno())
-            
+        # Add new alarm if it doesn't exist (the list delta goes out on alarm/changes)
+        alarm = alarm_store.add_alarm(alarm_time, repeat, room, wake_window)
+        if alarm is not None:
             # Publish events
             mqtt_client.publish(TOPIC_ALARM_ADDED, json.dumps({
+                "id": alarm["id"],
                 "time": alarm_time,
                 "message": f"Alarm added for {alarm_time}"
             }))
             
-            # Also publish updated list with retain flag to keep it persistent
-            mqtt_client.publish(TOPIC_ALARMS, json.dumps(alarms), qos=1, retain=True)
-            
             return True
         else:
             mqtt_client.publish(TOPIC_ALARM_ADDED, json.dumps({
@@ -733,46 +1139,27 @@ def add_alarm_mqtt(hour, minute, second):
         }))
         return False
     
-def toggle_alarm_mqtt(index):
+def toggle_alarm_mqtt(alarm_id):
     """Toggle alarm via MQTT request"""
     try:
-        # Load alarms
-        if not os.path.exists(ALARMS_FILE):
-            mqtt_client.publish("alarm/error", json.dumps({
-                "message": "Alarm file does not exist"
-            }))
-            return False
-        
-        with open(ALARMS_FILE, 'r') as f:
-            alarms = json.load(f)
-        
-        if index < 0 or index >= len(alarms):
+        # Toggle the alarm
+        alarm = alarm_store.toggle_alarm(alarm_id)
+        if alarm is None:
             mqtt_client.publish("alarm/error", json.dumps({
-                "message": f"Invalid alarm index: {index}"
+                "message": f"Invalid alarm id: {alarm_id}"
             }))
             return False
         
-        # Toggle the alarm
-        alarms[index]["active"] = not alarms[index]["active"]
-        status = "activated" if alarms[index]["active"] else "deactivated"
-        message = f"Alarm at {alarms[index]['time']} {status}"
-        
-        # Save changes
-        with open(ALARMS_FILE, 'w') as f:
-            json.dump(alarms, f)
-            f.flush()
-            os.fsync(f.fileno())
+        status = "activated" if alarm["active"] else "deactivated"
+        message = f"Alarm at {alarm['time']} {status}"
         
         # Publish event
         mqtt_client.publish(TOPIC_ALARM_TOGGLED, json.dumps({
-            "index": index,
-            "active": alarms[index]["active"],
-            "time": alarms[index]["time"],
+            "id": alarm_id,
+            "active": alarm["active"],
+            "time": alarm["time"],
             "message": message
         }))
-        
-        # Also publish updated list
-        publish_alarms()
         return True
     except Exception as e:
         print(f"Error toggling alarm via MQTT: {e}")
@@ -781,46 +1168,25 @@ def toggle_alarm_mqtt(index):
         }))
         return False
 
-def delete_alarm_mqtt(index):
+def delete_alarm_mqtt(alarm_id):
     """Delete alarm via MQTT request"""
     try:
-        # Load alarms
-        if not os.path.exists(ALARMS_FILE):
-            mqtt_client.publish("alarm/error", json.dumps({
-                "message": "Alarm file does not exist"
-            }))
-            return False
-        
-        with open(ALARMS_FILE, 'r') as f:
-            alarms = json.load(f)
-        
-        if index < 0 or index >= len(alarms):
+        # Delete the alarm
+        deleted = alarm_store.delete_alarm(alarm_id)
+        if deleted is None:
             mqtt_client.publish("alarm/error", json.dumps({
-                "message": f"Invalid alarm index: {index}"
+                "message": f"Invalid alarm id: {alarm_id}"
             }))
             return False
         
-        # Store the time before deleting
-        deleted_time = alarms[index]["time"]
-        
-        # Delete the alarm
-        del alarms[index]
-        
-        # Save changes
-        with open(ALARMS_FILE, 'w') as f:
-            json.dump(alarms, f)
-            f.flush()
-            os.fsync(f.fileno())
+        deleted_time = deleted["time"]
         
         # Publish event
         mqtt_client.publish(TOPIC_ALARM_DELETED, json.dumps({
-            "index": index,
+            "id": alarm_id,
             "time": deleted_time,
             "message": f"Deleted alarm at {deleted_time}"
         }))
-        
-        # Also publish updated list
-        publish_alarms()
         return True
     except Exception as e:
         print(f"Error deleting alarm via MQTT: {e}")
@@ -829,16 +1195,32 @@ def delete_alarm_mqtt(index):
         }))
         return False
 
-def snooze_alarm_mqtt():
-    """Snooze the currently active alarm via MQTT"""
+def batch_alarms_mqtt(data):
+    """Apply a batch via MQTT request and publish the results (the delta goes out on alarm/changes)"""
+    request_id = data.get("request_id") if isinstance(data, dict) else None
     try:
-        from alarm_state import clear_state
-        clear_state()
-        mqtt_client.publish("alarm/state", json.dumps({
-            "alarm_active": False,
-            "timestamp": time.time(),
-            "message": "Alarm snoozed"
+        operations, atomic = batch_request(data)
+        results, applied = alarm_store.apply_batch(operations, atomic)
+    except ValueError as e:
+        mqtt_client.publish("alarm/error", json.dumps({
+            "message": f"Invalid batch: {str(e)}"
         }))
+        return False
+    
+    mqtt_client.publish(TOPIC_BATCH_RESULT, json.dumps({
+        "request_id": request_id,
+        "applied": applied,
+        "results": results
+    }))
+    return applied
+
+def snooze_alarm_mqtt(data=None):
+    """Snooze the currently active alarm via MQTT ({"minutes": n} optional)"""
+    try:
+        minutes = data.get("minutes") if isinstance(data, dict) else None
+        state = snooze_engine.snooze(minutes)
+        if state is not None:
+            mqtt_client.publish("alarm/state", json.dumps(state))
         return True
     except Exception as e:
         print(f"Error snoozing alarm via MQTT: {e}")
@@ -847,6 +1229,18 @@ def snooze_alarm_mqtt():
         }))
         return False
 
+def dismiss_alarm_mqtt():
+    """Dismiss the alarm and any pending snooze via MQTT"""
+    try:
+        mqtt_client.publish("alarm/state", json.dumps(snooze_engine.dismiss()))
+        return True
+    except Exception as e:
+        print(f"Error dismissing alarm via MQTT: {e}")
+        mqtt_client.publish("alarm/error", json.dumps({
+            "message": f"Failed to dismiss alarm: {str(e)}"
+        }))
+        return False
+
 # Add a more robust publish function
 def safe_mqtt_publish(topic, payload, qos=1, retain=False):
     """Safely publish a message to MQTT with error handling"""
@@ -863,14 +1257,14 @@ def safe_mqtt_publish(topic, payload, qos=1, retain=False):
 def publish_alarm_state_loop():
     """Periodically publish alarm state to MQTT"""
     try:
-        from alarm_state import get_state
-        state = get_state()
+        # Also wakes /changes clients when watchdog could not catch the change
+        state = alarm_state.refresh()
         mqtt_client.publish("alarm/state", json.dumps(state))
     except Exception as e:
         print(f"Error publishing alarm state: {e}")
     
     # Schedule next update
-    threading.Timer(1.0, publish_alarm_state_loop).start()
+    timer_wheel.schedule(1.0, publish_alarm_state_loop)
 
     
 
@@ -921,8 +1315,7 @@ def sensor_data():
     try:
         # Import our hardware bridge module
         from hardware_bridge import get_sensor_data
-        data = get_sensor_data()
-        return jsonify(data)
+        return jsonify(sensor_snapshot(get_sensor_data))
     except Exception as e:
         print(f"Sensor data error: {e}")
         import traceback
@@ -1240,8 +1633,7 @@ def pi5_direct_test():
                 GPIO.output(pin, GPIO.HIGH)
                 # For buzzer, turn off after 1 second
                 if component == "buzzer":
-                    import threading
-                    threading.Timer(1.0, lambda: GPIO.output(pin, GPIO.LOW)).start()
+                    timer_wheel.schedule(1.0, GPIO.output, pin, GPIO.LOW)
                 return jsonify({
                     "status": "success",
                     "message": f"{component} turned on"
@@ -1326,11 +1718,6 @@ def debug_sensor():
         info["error"] = str(e)
     
     return jsonify(info)
-if __name__ == '__main__':
-    # Start publishing alarm state
-    threading.Timer(2.0, publish_alarm_state_loop).start()
-    
-    # Rest of your main code...
 
 if __name__ == '__main__':
     # Check if running in virtual environment
@@ -1351,6 +1738,8 @@ if __name__ == '__main__':
     parser.add_argument('--gui', action='store_true', help='Launch GUI interface only')
     parser.add_argument('--web', action='store_true', help='Launch web interface only')
     parser.add_argument('--both', action='store_true', help='Launch both interfaces')
+    parser.add_argument('--single', action='store_true',
+                        help='Run the web server and the alarm engine in one process (GUI unless --web)')
     parser.add_argument('--mqtt-broker', default='localhost', help='MQTT broker host')
     args = parser.parse_args()
     
@@ -1358,6 +1747,13 @@ if __name__ == '__main__':
     if args.mqtt_broker:
         app.config['MQTT_BROKER_URL'] = args.mqtt_broker
     
+    if args.single:
+        print(f"Starting in single-process {'Web' if args.web and not args.gui else 'GUI and Web'} mode")
+        print(f"Using MQTT broker: {app.config['MQTT_BROKER_URL']}")
+        timer_wheel.schedule(2.0, publish_alarm_state_loop)
+        run_single_process(gui=args.gui or not args.web)
+        sys.exit(0)
+    
     # Determine which mode to launch
     launch_gui = args.gui or args.both or not (args.gui or args.web or args.both)
     launch_web = args.web or args.both or not (args.gui or args.web or args.both)
@@ -1366,7 +1762,7 @@ if __name__ == '__main__':
     print(f"Using MQTT broker: {app.config['MQTT_BROKER_URL']}")
     
     # Start publishing alarm state
-    threading.Timer(2.0, publish_alarm_state_loop).start()
+    timer_wheel.schedule(2.0, publish_alarm_state_loop)
     
     # Launch the interfaces in the correct order
     if launch_gui:
@@ -1434,7 +1830,7 @@ def test_hardware():
                 if action == 'on':
                     buzzer.on()
                     # Turn off after 1 second
-                    threading.Timer(1.0, lambda: buzzer.off()).start()
+                    timer_wheel.schedule(1.0, buzzer.off)
                     return jsonify({"status": "success", "message": "Buzzer beeped"})
                 else:
                     buzzer.off()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Compare alarm mutation latency: legacy `python -c` subprocess vs in-process alarm_store
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import alarm_store
+
+ITERATIONS = int(os.environ.get('BENCH_ITERATIONS', '50'))
+
+# Same read-modify-write the old /alarm/<index>/toggle route ran in a child interpreter
+LEGACY_TOGGLE = '''
+import json, os
+alarms_file = "alarms.json"
+index = 0
+with open(alarms_file, 'r') as f:
+    alarms = json.load(f)
+alarms[index]["active"] = not alarms[index]["active"]
+with open(alarms_file, 'w') as f:
+    json.dump(alarms, f)
+    f.flush()
+    os.fsync(f.fileno())
+os.sync()
+'''
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def report(name, samples):
+    print(f"{name:<12} mean={sum(samples) / len(samples) * 1000:8.2f} ms  "
+          f"p50={percentile(samples, 50) * 1000:8.2f} ms  "
+          f"p95={percentile(samples, 95) * 1000:8.2f} ms")
+
+
+def bench_subprocess():
+    samples = []
+    for _ in range(ITERATIONS):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', LEGACY_TOGGLE], capture_output=True, text=True)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_store():
+    samples = []
+    alarm_id = alarm_store.alarm_id_at(0)
+    for _ in range(ITERATIONS):
+        start = time.perf_counter()
+        alarm_store.toggle_alarm(alarm_id)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        with open(alarm_store.ALARMS_FILE, 'w') as f:
+            f.write('[{"time": "07:00:00", "active": true}, {"time": "08:00:00", "active": true}]')
+
+        print(f"Toggling one alarm {ITERATIONS} times in {workdir}")
+        report("subprocess", bench_subprocess())
+        report("alarm_store", bench_store())
+
+
+if __name__ == "__main__":
+    main()
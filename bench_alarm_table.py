@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Compare a "what rings in the next window" query over alarm dicts with the columnar AlarmTable
+
+Runs at 1k/10k/100k alarms spread over BENCH_ROOMS rooms (set BENCH_SIZES to
+override, e.g. BENCH_SIZES=1000,5000). The NumPy table is measured when
+NumPy is installed; the pure-Python column scan always is.
+"""
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import alarm_table
+from alarm_schedule import SECONDS_PER_DAY, format_second, second_of_day
+from alarm_table import AlarmTable
+from recurrence import compile_rule
+
+SIZES = [int(size) for size in os.environ.get('BENCH_SIZES', '1000,10000,100000').split(',')]
+ROOMS = int(os.environ.get('BENCH_ROOMS', '40'))
+WINDOW = int(os.environ.get('BENCH_WINDOW', '60'))
+QUERIES = int(os.environ.get('BENCH_QUERIES', '50'))
+
+
+def make_alarms(count):
+    today = datetime.date.today()
+    alarms = []
+    for i in range(count):
+        alarm = {"id": f"a{i:012x}", "time": format_second(random.randrange(SECONDS_PER_DAY)),
+                 "active": random.random() < 0.8, "room": f"room-{random.randrange(ROOMS):03d}"}
+        kind = random.random()
+        if kind < 0.3:
+            alarm["repeat"] = {"days": sorted(random.sample(range(7), random.randint(1, 6)))}
+        elif kind < 0.32:
+            alarm["repeat"] = {"every": 2, "start": today.isoformat(),
+                               "skip": [(today + datetime.timedelta(days=d)).isoformat() for d in (3, 9)]}
+        alarms.append(alarm)
+    return alarms
+
+
+def dict_scan(alarms, rules, start, seconds):
+    """The per-dict loop: every alarm looked at for every query"""
+    moment = datetime.datetime.fromtimestamp(start)
+    day = moment.date()
+    first = moment.hour * 3600 + moment.minute * 60 + moment.second
+    grouped = {}
+    for alarm in alarms:
+        if not alarm["active"]:
+            continue
+        second = second_of_day(alarm["time"])
+        if first <= second < first + seconds and rules[alarm["id"]].occurs_on(day):
+            grouped.setdefault(alarm.get("room") or "", []).append((second, alarm["id"]))
+    return {room: [alarm_id for _, alarm_id in sorted(entries)] for room, entries in grouped.items()}
+
+
+def table_query(table, start, seconds):
+    return {room: [entry["id"] for entry in entries]
+            for room, entries in table.due_in_window(start, seconds).items()}
+
+
+def timed(function, *args):
+    begin = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - begin, result
+
+
+def per_query(function, target, starts, seconds):
+    begin = time.perf_counter()
+    results = [function(target, start, seconds) for start in starts]
+    return (time.perf_counter() - begin) / len(starts), results
+
+
+def main():
+    random.seed(7)
+    midnight = datetime.datetime.combine(datetime.date.today(), datetime.time()).timestamp()
+    # Windows ending before midnight, so the dict scan baseline stays a single-day query
+    starts = [midnight + random.randrange(SECONDS_PER_DAY - WINDOW) for _ in range(QUERIES)]
+    engines = [("python columns", False)]
+    if alarm_table.np is not None:
+        engines.append(("numpy columns", True))
+    else:
+        print("NumPy not installed: measuring the pure-Python table only")
+
+    for size in SIZES:
+        alarms = make_alarms(size)
+        rules = {alarm["id"]: compile_rule(alarm.get("repeat")) for alarm in alarms}
+        scan_cost, expected = per_query(lambda target, start, seconds: dict_scan(target, rules, start, seconds),
+                                        alarms, starts, WINDOW)
+        print(f"\n{size} alarms, {ROOMS} rooms, {WINDOW}s window, {QUERIES} queries")
+        print(f"  dict scan       {scan_cost * 1000:9.3f} ms/query")
+        for name, vectorized in engines:
+            build, table = timed(AlarmTable, alarms, vectorized)
+            cost, results = per_query(table_query, table, starts, WINDOW)
+            assert results == expected, f"{name} disagrees with the dict scan"
+            update_begin = time.perf_counter()
+            for alarm in alarms[:1000]:
+                table.apply([("update", alarm["id"], alarm)])
+            update = (time.perf_counter() - update_begin) / min(1000, size)
+            print(f"  {name:<15} {cost * 1000:9.3f} ms/query  ({scan_cost / cost:5.1f}x)  "
+                  f"build {build * 1000:8.1f} ms  update {update * 1e6:6.2f} us")
+
+
+if __name__ == "__main__":
+    main()
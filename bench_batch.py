@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Compare provisioning alarms one request at a time vs a single alarm_store.apply_batch()
+
+Each one-at-a-time mutation also serialises the full list, as a client that
+re-reads the list after every change would (MQTT clients get per-change
+deltas on alarm/changes instead). Set ALARM_STORAGE=sqlite to measure the
+SQLite backend.
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+OPERATIONS = int(os.environ.get('BENCH_OPERATIONS', '1000'))
+
+
+def alarm_times(count):
+    return [f"{(i // 3600) % 24:02d}:{(i // 60) % 60:02d}:{i % 60:02d}" for i in range(count)]
+
+
+def reset(alarm_store, backend):
+    alarm_store.replace_alarms([])
+    backend.flush()
+    backend.reset_stats()
+
+
+def report(name, elapsed, published, backend):
+    print(f"{name:<12} total={elapsed * 1000:9.1f} ms  per-op={elapsed / OPERATIONS * 1000:7.3f} ms  "
+          f"writes={backend.stats['writes']:<5} fsyncs={backend.stats['fsyncs']:<5} "
+          f"published={published / 1024:8.1f} KiB")
+
+
+def bench_individual(alarm_store, backend, times):
+    reset(alarm_store, backend)
+    published = 0
+    start = time.perf_counter()
+    for alarm_time in times:
+        alarm_store.add_alarm(alarm_time)
+        published += len(json.dumps(alarm_store.get_alarms()))
+    report("individual", time.perf_counter() - start, published, backend)
+
+
+def bench_batch(alarm_store, backend, times):
+    reset(alarm_store, backend)
+    start = time.perf_counter()
+    results, applied = alarm_store.apply_batch([{"op": "add", "time": t} for t in times])
+    published = len(json.dumps(alarm_store.get_alarms()))
+    report("batch", time.perf_counter() - start, published, backend)
+    assert applied and all(result["status"] == "success" for result in results)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        import alarm_store
+        import storage
+
+        backend = storage.get_storage()
+        times = alarm_times(OPERATIONS)
+        print(f"Adding {OPERATIONS} alarms with the {backend.name} backend in {workdir}")
+        bench_individual(alarm_store, backend, times)
+        bench_batch(alarm_store, backend, times)
+
+
+if __name__ == "__main__":
+    main()
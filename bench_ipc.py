@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Round-trip latency between two processes: the local IPC channel (local_ipc.py)
+against a publish/echo through the MQTT broker, which is what app.py and
+interface_1.py used to talk over
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import local_ipc
+
+ROUND_TRIPS = int(os.environ.get('BENCH_ROUND_TRIPS', '2000'))
+MQTT_HOST = os.environ.get('BENCH_MQTT_HOST', 'localhost')
+MQTT_PORT = int(os.environ.get('BENCH_MQTT_PORT', '1883'))
+PING_TOPIC = "alarm/bench/ping"
+PONG_TOPIC = "alarm/bench/pong"
+
+
+def report(name, samples):
+    samples.sort()
+    mean = sum(samples) / len(samples)
+    p50 = samples[len(samples) // 2]
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(f"{name:<5} mean={mean * 1e6:8.1f} us  p50={p50 * 1e6:8.1f} us  p99={p99 * 1e6:8.1f} us  "
+          f"({len(samples)} round trips)")
+
+
+def serve_ipc(path):
+    """Child: echo every ping until killed"""
+    server = local_ipc.Server(path, handlers={"ping": lambda params: params})
+    if not server.start():
+        sys.exit(1)
+    while True:
+        time.sleep(1)
+
+
+def serve_mqtt():
+    """Child: answer every ping with a pong until killed"""
+    import paho.mqtt.client as mqtt
+    client = mqtt.Client()
+    client.on_message = lambda client, userdata, msg: client.publish(PONG_TOPIC, msg.payload, qos=0)
+    client.connect(MQTT_HOST, MQTT_PORT)
+    client.subscribe(PING_TOPIC, qos=0)
+    client.loop_forever()
+
+
+def spawn(*args):
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__)] + list(args))
+
+
+def run_ipc():
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "bench.sock")
+        child = spawn("--serve-ipc", path)
+        try:
+            client = local_ipc.Client(path, hello={"role": "bench"})
+            client.start()
+            deadline = time.time() + 5
+            while not client.connected and time.time() < deadline:
+                time.sleep(0.01)
+            if not client.connected:
+                print("ipc   skipped (server did not come up)")
+                return
+            payload = {"id": 0, "time": "07:00", "active": True}
+            samples = []
+            for i in range(ROUND_TRIPS):
+                payload["id"] = i
+                start = time.perf_counter()
+                client.call("ping", payload)
+                samples.append(time.perf_counter() - start)
+            report("ipc", samples)
+        finally:
+            child.kill()
+            child.wait()
+
+
+def run_mqtt():
+    try:
+        import paho.mqtt.client as mqtt
+    except ImportError:
+        print("mqtt  skipped (paho-mqtt not installed)")
+        return
+    client = mqtt.Client()
+    pong = threading.Event()
+    client.on_message = lambda client, userdata, msg: pong.set()
+    try:
+        client.connect(MQTT_HOST, MQTT_PORT)
+    except OSError as e:
+        print(f"mqtt  skipped (no broker at {MQTT_HOST}:{MQTT_PORT}: {e})")
+        return
+    client.subscribe(PONG_TOPIC, qos=0)
+    client.loop_start()
+    child = spawn("--serve-mqtt")
+    try:
+        # Wait for the echo child to subscribe
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            pong.clear()
+            client.publish(PING_TOPIC, "{}", qos=0)
+            if pong.wait(0.2):
+                break
+        else:
+            print("mqtt  skipped (echo child did not answer)")
+            return
+        payload = {"id": 0, "time": "07:00", "active": True}
+        samples = []
+        for i in range(ROUND_TRIPS):
+            payload["id"] = i
+            pong.clear()
+            start = time.perf_counter()
+            client.publish(PING_TOPIC, json.dumps(payload), qos=0)
+            if not pong.wait(local_ipc.CALL_TIMEOUT):
+                print(f"mqtt  lost a pong after {i} round trips")
+                return
+            samples.append(time.perf_counter() - start)
+        report("mqtt", samples)
+    finally:
+        child.kill()
+        child.wait()
+        client.loop_stop()
+        client.disconnect()
+
+
+def main():
+    if sys.argv[1:2] == ["--serve-ipc"]:
+        serve_ipc(sys.argv[2])
+    elif sys.argv[1:2] == ["--serve-mqtt"]:
+        serve_mqtt()
+    else:
+        print(f"{ROUND_TRIPS} request/reply round trips between two processes")
+        run_ipc()
+        run_mqtt()
+
+
+if __name__ == "__main__":
+    main()
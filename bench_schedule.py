@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Compare the per-tick cost of check_alarm's linear scan with the compiled DaySchedule lookup
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from alarm_schedule import DaySchedule, SECONDS_PER_DAY, format_second, second_of_day
+
+ALARM_COUNT = int(os.environ.get('BENCH_ALARMS', '10000'))
+TICKS = int(os.environ.get('BENCH_TICKS', '2000'))
+
+
+def make_alarms(count):
+    seconds = random.sample(range(SECONDS_PER_DAY), count)
+    return [{"id": f"a{i:012x}", "time": format_second(second), "active": i % 4 != 0}
+            for i, second in enumerate(seconds)]
+
+
+def scan(alarms, current_time):
+    # The loop check_alarm used to run every second
+    for alarm in alarms:
+        if alarm["active"] and alarm["time"] == current_time:
+            return True
+    return False
+
+
+def lookup(schedule, current_time):
+    return bool(schedule.due(second_of_day(current_time)))
+
+
+def per_tick(check, target, ticks):
+    start = time.perf_counter()
+    hits = 0
+    for tick in ticks:
+        hits += check(target, tick)
+    return (time.perf_counter() - start) / len(ticks), hits
+
+
+def main():
+    random.seed(1)
+    alarms = make_alarms(ALARM_COUNT)
+    ticks = [format_second(random.randrange(SECONDS_PER_DAY)) for _ in range(TICKS)]
+
+    start = time.perf_counter()
+    schedule = DaySchedule(alarms)
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for alarm in alarms[:1000]:
+        alarm["active"] = not alarm["active"]
+        schedule.apply([("update", alarm["id"], alarm)])
+    update = (time.perf_counter() - start) / 1000
+
+    scan_cost, scan_hits = per_tick(scan, alarms, ticks)
+    lookup_cost, lookup_hits = per_tick(lookup, schedule, ticks)
+    assert scan_hits == lookup_hits
+
+    print(f"{ALARM_COUNT} alarms, {TICKS} ticks ({scan_hits} firing)")
+    print(f"linear scan  {scan_cost * 1e6:10.2f} us/tick")
+    print(f"schedule     {lookup_cost * 1e6:10.2f} us/tick  ({scan_cost / lookup_cost:.0f}x faster)")
+    print(f"full build   {build * 1000:10.2f} ms   incremental update {update * 1e6:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
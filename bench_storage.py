@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Compare the JSON and SQLite storage backends: mutation latency and fsync count,
+then each durability mode (strict, group, relaxed) with concurrent writers
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import storage
+
+ALARM_COUNT = int(os.environ.get('BENCH_ALARMS', '1000'))
+MUTATIONS = int(os.environ.get('BENCH_MUTATIONS', '200'))
+# Writers in the durability comparison (UI, MQTT handler, snooze timer, ...)
+WRITERS = int(os.environ.get('BENCH_WRITERS', '4'))
+
+
+def make_alarms(count):
+    return [{"id": storage.new_alarm_id(),
+             "time": f"{(i // 3600) % 24:02d}:{(i // 60) % 60:02d}:{i % 60:02d}", "active": True}
+            for i in range(count)]
+
+
+def run(backend):
+    alarms = make_alarms(ALARM_COUNT)
+    backend.write_alarms(alarms)
+    for key in backend.stats:
+        backend.stats[key] = 0
+
+    samples = []
+    for i in range(MUTATIONS):
+        alarm = alarms[i % len(alarms)]
+        start = time.perf_counter()
+        if i % 2 == 0:
+            # Toggle
+            alarm["active"] = not alarm["active"]
+            backend.write_alarms(alarms, [("update", alarm["id"], alarm)])
+        else:
+            # Delete then re-insert so the list size stays constant
+            alarms.remove(alarm)
+            backend.write_alarms(alarms, [("delete", alarm["id"])])
+            alarms.append(alarm)
+            backend.write_alarms(alarms, [("insert", alarm)])
+        samples.append(time.perf_counter() - start)
+
+    if hasattr(backend, 'checkpoint'):
+        backend.checkpoint()
+
+    samples.sort()
+    print(f"{backend.name:<7} mean={sum(samples) / len(samples) * 1000:7.3f} ms  "
+          f"p95={samples[int(len(samples) * 0.95)] * 1000:7.3f} ms  "
+          f"writes={backend.stats['writes']:<5} fsyncs={backend.stats['fsyncs']}")
+
+
+def run_durability(backend, mode):
+    """WRITERS threads each toggling an alarm and writing the state, MUTATIONS times in all"""
+    alarms = make_alarms(ALARM_COUNT)
+    backend.write_alarms(alarms)
+    for key in backend.stats:
+        backend.stats[key] = 0
+    durable = storage.DurableStorage(backend, mode)
+    lock = threading.Lock()
+
+    def writer(offset):
+        for i in range(offset, MUTATIONS, WRITERS):
+            with lock:
+                alarm = alarms[i % len(alarms)]
+                alarm["active"] = not alarm["active"]
+                snapshot = list(alarms)
+            durable.write_alarms(snapshot, [("update", alarm["id"], alarm)])
+            durable.save_state({"alarm_active": i % 2 == 0, "timestamp": time.time(), "message": ""})
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=writer, args=(offset,)) for offset in range(WRITERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    durable.flush()
+
+    stats = durable.stats
+    latency = stats["write_latency"]
+    print(f"{backend.name:<7} {mode:<8} mean={latency['mean_ms']:7.1f} ms  p99<={latency['p99_ms']:7.1f} ms  "
+          f"commits={stats['commits']:<5} fsyncs={backend.stats['fsyncs']:<5} "
+          f"lock wait p99<={stats['lock']['wait']['p99_ms']} ms  total={elapsed:.2f} s")
+
+
+def main():
+    print(f"{MUTATIONS} mutations against {ALARM_COUNT} alarms")
+    with tempfile.TemporaryDirectory() as workdir:
+        run(storage.JsonStorage(os.path.join(workdir, "alarms.json"),
+                                os.path.join(workdir, "alarm_state.json")))
+        run(storage.SqliteStorage(os.path.join(workdir, "alarms.db"),
+                                  os.path.join(workdir, "missing.json"),
+                                  os.path.join(workdir, "missing_state.json")))
+
+    print(f"\n{MUTATIONS} alarm + state writes from {WRITERS} threads "
+          f"(group window {storage.GROUP_COMMIT_SECONDS * 1000:.0f} ms)")
+    for mode in storage.DURABILITY_MODES:
+        with tempfile.TemporaryDirectory() as workdir:
+            run_durability(storage.JsonStorage(os.path.join(workdir, "alarms.json"),
+                                               os.path.join(workdir, "alarm_state.json")), mode)
+            run_durability(storage.SqliteStorage(os.path.join(workdir, "alarms.db"),
+                                                 os.path.join(workdir, "missing.json"),
+                                                 os.path.join(workdir, "missing_state.json")), mode)
+
+
+if __name__ == "__main__":
+    main()
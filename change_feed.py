@@ -0,0 +1,55 @@
+# change_feed.py - Versioned change notification for long-polling clients
+#
+# Producers call notify(channel) whenever the alarm list, the alarm state or
+# the interface output advances. Every notification bumps a single global
+# version; long-poll handlers block in wait_for_changes() until the version
+# moves past what the client has already seen, then report which channels
+# changed so only those need to be sent back.
+import threading
+
+CHANNELS = ("alarms", "state", "output")
+
+_cond = threading.Condition()
+_version = 0
+_channel_versions = {channel: 0 for channel in CHANNELS}
+
+
+def notify(channel, record=None):
+    """Record a change on channel and wake every waiting client.
+
+    record(version), if given, runs before anyone wakes up, so data tagged
+    with the new version is in place by the time waiters look for it.
+    """
+    global _version
+    with _cond:
+        _version += 1
+        _channel_versions[channel] = _version
+        if record is not None:
+            record(_version)
+        _cond.notify_all()
+        return _version
+
+
+def current_version():
+    with _cond:
+        return _version
+
+
+def changed_since(since):
+    """Return the channels that changed after version `since`"""
+    with _cond:
+        return [channel for channel, version in _channel_versions.items() if version > since]
+
+
+def wait_for_changes(since, timeout):
+    """Block until something changes after `since` or timeout expires.
+
+    Returns (version, changed_channels). A `since` ahead of the current
+    version (e.g. the server restarted) is treated as "send everything".
+    """
+    with _cond:
+        if since > _version:
+            return _version, list(CHANNELS)
+        _cond.wait_for(lambda: _version > since, timeout=timeout)
+        changed = [channel for channel, version in _channel_versions.items() if version > since]
+        return _version, changed
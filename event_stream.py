@@ -0,0 +1,100 @@
+# event_stream.py - Fan-out of server events to Server-Sent Events clients
+#
+# Producers call publish(event, data); every connected client has its own
+# bounded queue. A client that stops reading only loses its own oldest
+# events (drop-oldest) and never blocks the producer or the other clients.
+# Each event is encoded once and the same bytes are queued for every client.
+# A client that dropped events is told so, so it can resynchronise from a
+# full snapshot instead of applying deltas on top of a gap.
+import collections
+import json
+import threading
+
+QUEUE_SIZE = 256
+KEEPALIVE_INTERVAL = 15  # seconds between comment lines on an idle stream
+
+_lock = threading.Lock()
+_clients = set()
+_subscribe_hooks = []
+
+
+def encode(event, data):
+    """Format one SSE message"""
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class Client:
+    """Per-connection bounded queue of encoded events"""
+
+    def __init__(self, maxsize=QUEUE_SIZE):
+        self._queue = collections.deque(maxlen=maxsize)
+        self._cond = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, message):
+        with self._cond:
+            if len(self._queue) == self._queue.maxlen:
+                # deque(maxlen) discards the oldest entry on append
+                self.dropped += 1
+            self._queue.append(message)
+            self._cond.notify()
+
+    def get(self, timeout):
+        """Return the next message, or None after timeout or close"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._queue or self.closed, timeout=timeout)
+            if self._queue:
+                return self._queue.popleft()
+            return None
+
+    def take_dropped(self):
+        """Return and reset the number of events lost since the last call"""
+        with self._cond:
+            dropped, self.dropped = self.dropped, 0
+            return dropped
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+
+def subscribe():
+    """Register a new client and run the subscribe hooks"""
+    client = Client()
+    with _lock:
+        _clients.add(client)
+    for hook in list(_subscribe_hooks):
+        try:
+            hook()
+        except Exception as e:
+            print(f"Error in event stream subscribe hook: {e}")
+    return client
+
+
+def unsubscribe(client):
+    client.close()
+    with _lock:
+        _clients.discard(client)
+
+
+def client_count():
+    with _lock:
+        return len(_clients)
+
+
+def add_subscribe_hook(callback):
+    """Call callback() whenever a client connects (e.g. to start a sampler)"""
+    _subscribe_hooks.append(callback)
+
+
+def publish(event, data):
+    """Queue an event for every connected client. Cheap when nobody listens."""
+    with _lock:
+        clients = list(_clients)
+    if not clients:
+        return
+    message = encode(event, data)
+    for client in clients:
+        client.put(message)
@@ -7,6 +7,8 @@ import random
 import subprocess
 import importlib.util
 
+import timer_wheel
+
 # Add this at the beginning of the file to properly set the hardware availability flag
 
 # Use simulation mode if environment variable is set
@@ -17,15 +19,27 @@ SIMULATION_MODE = os.environ.get('SIMULATE_HARDWARE', '0') == '1'
 HARDWARE_AVAILABLE = False
 HARDWARE_COMPONENTS = {}
 
-# Try the Pi 5 hardware first if it's available
-try:
-    from pi5_hardware import HARDWARE_AVAILABLE as PI5_HARDWARE_AVAILABLE, COMPONENTS
-    if PI5_HARDWARE_AVAILABLE:
-        print("Using Pi 5 hardware interface")
+# With app.py --single the interface already runs in this process and owns
+# the pins: use its devices rather than setting them up a second time
+INTERFACE_IN_PROCESS = 'interface_1' in sys.modules
+if INTERFACE_IN_PROCESS:
+    import interface_1
+    if getattr(interface_1, 'HARDWARE_AVAILABLE', False):
+        print("Using the hardware of the interface running in this process")
         HARDWARE_AVAILABLE = True
-        HARDWARE_COMPONENTS = COMPONENTS
-except ImportError:
-    pass
+        HARDWARE_COMPONENTS = {name: getattr(interface_1, name)
+                               for name in ('led', 'servo', 'buzzer', 'ultrasonic') if hasattr(interface_1, name)}
+
+# Try the Pi 5 hardware first if it's available
+if not INTERFACE_IN_PROCESS:
+    try:
+        from pi5_hardware import HARDWARE_AVAILABLE as PI5_HARDWARE_AVAILABLE, COMPONENTS
+        if PI5_HARDWARE_AVAILABLE:
+            print("Using Pi 5 hardware interface")
+            HARDWARE_AVAILABLE = True
+            HARDWARE_COMPONENTS = COMPONENTS
+    except ImportError:
+        pass
 
 # If Pi 5 hardware is not available, try the interface_1 module
 if not HARDWARE_AVAILABLE:
@@ -68,7 +82,7 @@ PI5_MODE = is_pi5()
 print(f"Detected platform: {'Raspberry Pi 5' if PI5_MODE else 'Non-Pi 5 System'}")
 
 # Try direct GPIO access first (works on Pi 5)
-if PI5_MODE:
+if PI5_MODE and not INTERFACE_IN_PROCESS:
     try:
         import RPi.GPIO as GPIO
         print("Successfully imported RPi.GPIO")
@@ -247,9 +261,7 @@ def control_hardware(component, action):
                 
             if action == 'on':
                 interface_1.buzzer.on()
-                import threading
-                import time
-                threading.Timer(1.0, lambda: interface_1.buzzer.off()).start()
+                timer_wheel.schedule(1.0, interface_1.buzzer.off)
                 return {"status": "success", "message": "Buzzer beeped"}
             elif action == 'off':
                 interface_1.buzzer.off()
@@ -3,6 +3,8 @@ import time
 import os
 import sys
 import json
+import bisect
+import datetime
 import threading
 import traceback
 from pathlib import Path
@@ -88,6 +90,10 @@ distance_Prevue = 50  # Default expected distance in cm
 correct_distance_time = 0
 distance_history = []
 stable_time = 0
+# The IMU is read from the GUI/alarm thread and the smart wake sampler
+imu_lock = threading.Lock()
+# (start time, alarm id) of the distance challenge in progress, for the history
+challenge = None
 
 # Function to calculate variation between two vector values
 def calculate_variation(new_values, last_values):
@@ -104,8 +110,9 @@ def check_movement():
         return random.choice([True, False])
     
     try:
-        accel = mpu.get_acceleration()  # Get accelerometer data
-        gyro = mpu.get_rotation()      # Get gyroscope data
+        with imu_lock:
+            accel = mpu.get_acceleration()  # Get accelerometer data
+            gyro = mpu.get_rotation()      # Get gyroscope data
         
         # Calculate variation from last readings
         accel_variation = calculate_variation(accel, last_accel)
@@ -138,6 +145,11 @@ def check_movement():
         print(f"Error in check_movement: {e}")
         return True  # Default to "no movement" on error
 
+def read_imu_sample():
+    """One (acceleration, rotation) reading for the smart wake sampler"""
+    with imu_lock:
+        return mpu.get_acceleration(), mpu.get_rotation()
+
 # Function to check distance and handle alarm snooze
 def check_distance():
     global alarm_active, correct_distance_time
@@ -149,10 +161,13 @@ def check_distance():
         # In web mode or when hardware isn't available
         return
     
+    period = 1
     try:
-        current_distance = ultrasonic.distance * 100  # Convert to cm
+        # Full rate while the alarm rings (see sampling_policy.py)
+        current_distance, period = sampling.sample("distance", lambda: ultrasonic.distance * 100, "active")
+        still, _ = sampling.sample("movement", check_movement, "active")
         
-        if not check_movement():
+        if not still:
             if 'movement_warning_label' in globals() and not WEB_MODE:
                 movement_warning_label.config(text="Mouvement détecté!")
         else:
@@ -170,20 +185,36 @@ def check_distance():
             else:
                 if 'distance_label' in globals() and not WEB_MODE:
                     distance_label.config(text=f"Vous êtes à la bonne distance: {current_distance:.2f} cm")
-                correct_distance_time += 1
+                correct_distance_time += period
                 
                 if correct_distance_time >= 3:
-                    snooze_alarm()  # Automatically snooze when at correct distance for 3 seconds
+                    end_challenge(True)
+                    dismiss_alarm()  # Held at the right distance for 3 seconds: the sleeper is up
                     if 'distance_label' in globals() and not WEB_MODE:
                         distance_label.config(text="")
                     return
         
         # Schedule next check if still active
         if not WEB_MODE and alarm_active and 'root' in globals():
-            root.after(1000, check_distance)
+            root.after(int(period * 1000), check_distance)
     except Exception as e:
         print(f"Error in check_distance: {e}")
 
+def start_challenge(alarm_id):
+    """Note when the distance challenge began"""
+    global challenge
+    challenge = (time.time(), alarm_id)
+
+def end_challenge(passed):
+    """Record how the distance challenge ended (passed, or abandoned by a snooze/dismiss)"""
+    global challenge
+    if challenge is None:
+        return
+    started, alarm_id = challenge
+    challenge = None
+    alarm_history.record(alarm_history.CHALLENGE, alarm_id, time.time() - started,
+                         alarm_history.FLAG_PASSED if passed else 0)
+
 # Function to move the servo motor
 def move_servo():
     global alarm_active
@@ -209,32 +240,63 @@ def move_servo():
         print(f"Error moving servo: {e}")
 
 # Function to update temperature and humidity
+def read_weather():
+    """(humidity, temperature) from the DHT11, or None if it gave no valid reading"""
+    dht = DHT.DHT(DHTPin)
+    # Try multiple times to get a valid reading
+    for i in range(5):  # Try up to 5 times
+        if dht.readDHT11() == 0:
+            return dht.getHumidity(), dht.getTemperature()
+        time.sleep(0.1)  # Short delay between attempts
+    return None
+
 def update_weather():
-    """Update temperature and humidity display every minute."""
+    """Update temperature and humidity display (every 10 minutes far from any alarm, every minute near one)."""
     if not HARDWARE_AVAILABLE or WEB_MODE:
         return
     
+    period = SENSORS["weather"]["fixed"]
     try:
-        dht = DHT.DHT(DHTPin)
-        # Try multiple times to get a valid reading
-        for i in range(5):  # Try up to 5 times
-            chk = dht.readDHT11()
-            if chk == 0:
-                humidity = dht.getHumidity()
-                temperature = dht.getTemperature()
-                
-                if 'left_label1' in globals() and 'left_label2' in globals():
-                    left_label1.config(text=f"Humidity: {humidity:.1f}%")
-                    left_label2.config(text=f"Temperature: {temperature:.1f}°C")
-                    print(f"Updated weather: {temperature:.1f}°C, {humidity:.1f}%")
-                break
-            time.sleep(0.1)  # Short delay between attempts
+        reading, period = sampling.sample("weather", read_weather)
+        if reading is not None and 'left_label1' in globals() and 'left_label2' in globals():
+            humidity, temperature = reading
+            left_label1.config(text=f"Humidity: {humidity:.1f}%")
+            left_label2.config(text=f"Temperature: {temperature:.1f}°C")
+            print(f"Updated weather: {temperature:.1f}°C, {humidity:.1f}%")
     except Exception as e:
         print(f"Error updating weather: {e}")
         
     # Schedule the next update
     if not WEB_MODE and 'root' in globals():
-        root.after(60000, update_weather)  # Update every minute
+        root.after(int(period * 1000), update_weather)
+
+def update_distance_display():
+    """Show distance and movement at the sampling policy's rate (not at all far from any alarm)."""
+    if not HARDWARE_AVAILABLE or WEB_MODE:
+        return
+    
+    period = sampling.period("distance")
+    try:
+        if alarm_active:
+            # check_distance reads both sensors for the challenge meanwhile
+            period = period or RECHECK_SECONDS
+        elif period is None:
+            sampling.skip("distance")
+            sampling.skip("movement")
+            period = RECHECK_SECONDS
+            if 'distance_label' in globals():
+                distance_label.config(text="Distance: ---")
+        else:
+            distance, period = sampling.sample("distance", lambda: ultrasonic.distance * 100)
+            sampling.sample("movement", check_movement)  # updates the movement label
+            if 'distance_label' in globals():
+                distance_label.config(text=f"Distance: {distance:.1f} cm")
+    except Exception as e:
+        print(f"Error updating distance display: {e}")
+        period = period or RECHECK_SECONDS
+    
+    if 'root' in globals():
+        root.after(int(period * 1000), update_distance_display)
 
 
 print("Interface 1.py starting...")
@@ -245,6 +307,15 @@ DEBUG_MODE = os.environ.get('ALARM_DEBUG', '0') == '1'
 # Flag to check if we're running in web mode
 WEB_MODE = os.environ.get('WEB_MODE', '0') == '1'
 
+# Set by app.py --single, which imports this module and runs main() on its
+# main thread: the alarm list then lives in the web server's alarm_store
+SINGLE_PROCESS = os.environ.get('ALARM_SINGLE_PROCESS', '0') == '1'
+if SINGLE_PROCESS:
+    import alarm_store
+
+# Set by app.py --single to callable(name, data): metrics go straight to /metrics
+metrics_sink = None
+
 # MQTT client for receiving commands from web interface
 mqtt_client = None
 
@@ -269,9 +340,10 @@ def setup_mqtt_client():
             client.subscribe("alarm/deleted", qos=1)
             client.subscribe("alarm/toggled", qos=1)
             
-            # Publish the current list of alarms so the web gets the latest state
+            # Publish the current list of alarms so the web gets the latest state.
+            # Not retained: later changes go out as deltas, so a retained copy would go stale
             try:
-                client.publish("alarm/list", json.dumps(alarms), qos=1, retain=True)
+                client.publish("alarm/list", json.dumps(alarms), qos=1)
                 print(f"Published {len(alarms)} alarms to MQTT on connect")
             except Exception as e:
                 print(f"Error publishing alarm list on connect: {e}")
@@ -295,17 +367,24 @@ def setup_mqtt_client():
                     print(f"Received non-JSON MQTT message on {topic}: {payload_text}")
                     payload = {"message": payload_text}
                 
+                if ipc.connected and (topic == "alarm/list" or topic.startswith("alarm/request/")):
+                    # The web process answers these and sends us the outcome over the local channel
+                    return
+                
                 # Process messages differently based on topic
                 if topic == "alarm/list" and isinstance(payload, list):
                     print(f"Received alarm list from MQTT with {len(payload)} alarms")
                     # Only update if the received list is different
-                    current_list_json = json.dumps(sorted(alarms, key=lambda x: x["time"]), sort_keys=True)
-                    received_list_json = json.dumps(sorted(payload, key=lambda x: x["time"]), sort_keys=True)
+                    # Our list is kept sorted, so only the received one needs sorting
+                    received = sorted(payload, key=alarm_sort_key)
+                    storage.ensure_ids(received)
+                    current_list_json = json.dumps(alarms, sort_keys=True)
+                    received_list_json = json.dumps(received, sort_keys=True)
                     
                     if current_list_json != received_list_json:
                         print("Alarm list is different, updating")
                         # Create a new list instead of modifying the existing one
-                        alarms = list(payload)
+                        alarms = received
                         
                         # Save to disk first
                         save_alarms()
@@ -322,7 +401,8 @@ def setup_mqtt_client():
                         minute = int(payload.get('minute', 0))
                         second = int(payload.get('second', 0))
                         print(f"Adding alarm from MQTT: {hour:02d}:{minute:02d}:{second:02d}")
-                        success = set_alarm(hour, minute, second)
+                        success = set_alarm(hour, minute, second, payload.get('repeat'),
+                                            payload.get('wake_window'))
                         if success:
                             print(f"Alarm added for {hour:02d}:{minute:02d}:{second:02d}")
                             # Schedule UI update on main thread
@@ -335,7 +415,7 @@ def setup_mqtt_client():
                 
                 elif topic == "alarm/request/delete":
                     try:
-                        index = int(payload.get('index', -1))
+                        index = request_alarm_index(payload)
                         print(f"Deleting alarm at index {index} from MQTT")
                         if index >= 0 and index < len(alarms):
                             success = delete_alarm(index)
@@ -350,7 +430,7 @@ def setup_mqtt_client():
                 
                 elif topic == "alarm/request/toggle":
                     try:
-                        index = int(payload.get('index', -1))
+                        index = request_alarm_index(payload)
                         print(f"Toggling alarm at index {index} from MQTT")
                         if index >= 0 and index < len(alarms):
                             status = toggle_alarm(index)
@@ -366,11 +446,19 @@ def setup_mqtt_client():
                 elif topic == "alarm/request/snooze":
                     try:
                         print("Snoozing alarm from MQTT")
-                        snooze_alarm()
+                        minutes = payload.get("minutes") if isinstance(payload, dict) else None
+                        snooze_alarm(minutes)
                         print("Alarm snoozed from web interface")
                     except Exception as e:
                         print(f"Error handling snooze request: {e}")
                 
+                elif topic == "alarm/request/dismiss":
+                    try:
+                        print("Dismissing alarm from MQTT")
+                        dismiss_alarm()
+                    except Exception as e:
+                        print(f"Error handling dismiss request: {e}")
+                
                 elif topic == "alarm/request/list":
                     try:
                         # Publish current alarm list
@@ -457,12 +545,31 @@ except ImportError as e:
     Observer = None
     FileSystemEventHandler = object
 
+# Storage backend shared with app.py (JSON files or SQLite, see storage.py)
+import storage
+import alarm_history
+from alarm_schedule import DaySchedule, second_of_day
+from recurrence import normalize_rule
+import latency
+import local_ipc
+from next_fire import NextFireScheduler
+from tick_clock import TickClock, format_epoch_second
+from smart_wake import SmartWake, normalize_wake_window
+from sampling_policy import RECHECK_SECONDS, SENSORS, SamplingPolicy
+
 # Import the alarm state module
 try:
     # First import the module itself without functions
     import alarm_state
     print("Alarm state module imported successfully")
     
+    # Snooze/dismiss/auto-stop on top of the shared state
+    import snooze as snooze_engine
+    
+    # Watch the state for changes made by other processes, so the per-second
+    # check can use the last known state instead of reading it every tick
+    alarm_state.watch()
+    
     # We'll access functions through the module to avoid circular imports
     def get_state():
         try:
@@ -472,9 +579,17 @@ try:
                 print(f"Error getting alarm state: {e}")
             return {"alarm_active": False, "timestamp": 0, "message": ""}
     
-    def set_state(alarm_active, message=""):
+    def current_state():
         try:
-            return alarm_state.set_state(alarm_active, message)
+            return alarm_state.current_state()
+        except Exception as e:
+            if DEBUG_MODE:
+                print(f"Error getting alarm state: {e}")
+            return {"alarm_active": False, "timestamp": 0, "message": ""}
+    
+    def set_state(alarm_active, message="", **extra):
+        try:
+            return alarm_state.set_state(alarm_active, message, **extra)
         except Exception as e:
             if DEBUG_MODE:
                 print(f"Error setting alarm state: {e}")
@@ -490,12 +605,15 @@ try:
             
 except ImportError as e:
     print(f"Error importing alarm_state module: {e}")
+    snooze_engine = None
     # Fallback implementation if the module isn't available
     def get_state():
         print("Using fallback get_state implementation")
         return {"alarm_active": False, "timestamp": 0, "message": ""}
     
-    def set_state(alarm_active, message=""):
+    current_state = get_state
+    
+    def set_state(alarm_active, message="", **extra):
         print(f"Setting alarm state (fallback): {alarm_active}, {message}")
         return True
     
@@ -503,11 +621,21 @@ except ImportError as e:
         print("Clearing alarm state (fallback)")
         return True
 
-def publish_alarm_added(time, success):
+def request_alarm_index(payload):
+    """Position in our list of the alarm an MQTT request targets ({"id": ...} or legacy {"index": n})"""
+    if payload.get('id'):
+        for index, alarm in enumerate(alarms):
+            if alarm.get("id") == payload['id']:
+                return index
+        return -1
+    return int(payload.get('index', -1))
+
+def publish_alarm_added(time, success, alarm_id=None):
     """Publish alarm added event to MQTT"""
     if mqtt_client:
         try:
             mqtt_client.publish("alarm/added", json.dumps({
+                "id": alarm_id,
                 "time": time,
                 "success": success,
                 "message": f"Alarm {'added' if success else 'already exists'} for {time}"
@@ -520,6 +648,7 @@ def publish_alarm_toggled(index, active):
     if mqtt_client:
         try:
             mqtt_client.publish("alarm/toggled", json.dumps({
+                "id": alarms[index].get("id") if index < len(alarms) else None,
                 "index": index,
                 "active": active,
                 "time": alarms[index]["time"] if index < len(alarms) else "",
@@ -528,11 +657,12 @@ def publish_alarm_toggled(index, active):
         except Exception as e:
             print(f"Error publishing alarm toggled event: {e}")
 
-def publish_alarm_deleted(index, time):
+def publish_alarm_deleted(index, time, alarm_id=None):
     """Publish alarm deleted event to MQTT"""
     if mqtt_client:
         try:
             mqtt_client.publish("alarm/deleted", json.dumps({
+                "id": alarm_id,
                 "index": index,
                 "time": time,
                 "message": f"Alarm at {time} deleted"
@@ -549,60 +679,69 @@ def publish_alarm_list():
             print(f"Error publishing alarm list: {e}")
 
 # File to store alarms data
-ALARMS_FILE = "alarms.json"
+ALARMS_FILE = storage.ALARMS_FILE
 
-# Liste pour stocker les alarmes
+# Liste pour stocker les alarmes (toujours triée par heure)
 alarms = []
 
+# Seconde du jour -> alarmes actives, tenu à jour à chaque sauvegarde
+schedule = DaySchedule()
+# Prochain déclenchement de chaque alarme, pour le mode sans interface
+fire_queue = NextFireScheduler()
+# Fenêtres de réveil : l'alarme peut sonner plus tôt si le sommeil est léger
+smart_wake = SmartWake(read_imu_sample if HARDWARE_AVAILABLE else None)
+
+def next_alarm_time():
+    """Timestamp of the next alarm to ring, or None"""
+    upcoming = fire_queue.upcoming(1)
+    return upcoming[0][0] if upcoming else None
+
+# Cadence des capteurs selon la proximité de la prochaine alarme
+sampling = SamplingPolicy(next_alarm_time, current_state)
+
+def alarm_sort_key(alarm):
+    return alarm["time"]
+
 # Load alarms from file
+def read_stored_alarms():
+    """The stored alarms, from the web server's store when it runs in this process"""
+    if SINGLE_PROCESS:
+        return alarm_store.get_alarms()
+    return storage.get_storage().load_alarms()
+
 def load_alarms():
     global alarms
     try:
-        if os.path.exists(ALARMS_FILE):
-            # Force sync to ensure we're reading the latest version
-            if hasattr(os, 'sync'):
-                os.sync()
-                
-            # Get file stats before reading
-            file_size = os.path.getsize(ALARMS_FILE)
-            if file_size == 0:
-                print("Warning: Alarms file is empty (zero bytes)")
-                alarms = []
-                return False
-                
-            with open(ALARMS_FILE, 'r') as f:
-                file_content = f.read()
-                if not file_content.strip():
-                    print("Warning: Alarms file is empty (no content)")
-                    alarms = []
-                    return False
-                    
-                loaded_alarms = json.loads(file_content)
-                print(f"Loaded raw alarms from file: {loaded_alarms}")
-                
-                # Validate the structure before replacing
-                valid_alarms = []
-                for alarm in loaded_alarms:
-                    if "time" not in alarm or "active" not in alarm:
-                        print(f"Warning: Invalid alarm format: {alarm}")
-                        continue
-                    valid_alarms.append(alarm)
-                
-                # Only update if we found any valid alarms
-                if valid_alarms:
-                    # Update the global alarms list
-                    alarms = valid_alarms
-                    print(f"Loaded {len(alarms)} alarms from file")
-                    return True
-                else:
-                    print("No valid alarms found in file")
-                    return False
+        loaded_alarms = read_stored_alarms()
+        if not loaded_alarms:
+            print("Warning: No alarms stored")
+            alarms = []
+            return False
+        print(f"Loaded raw alarms from storage: {loaded_alarms}")
+        
+        # Validate the structure before replacing
+        valid_alarms = []
+        for alarm in loaded_alarms:
+            if "time" not in alarm or "active" not in alarm:
+                print(f"Warning: Invalid alarm format: {alarm}")
+                continue
+            valid_alarms.append(alarm)
+        
+        # Only update if we found any valid alarms
+        if valid_alarms:
+            # Update the global alarms list, sorted once here rather than on every render
+            valid_alarms.sort(key=alarm_sort_key)
+            alarms = valid_alarms
+            schedule.rebuild(alarms)
+            fire_queue.rebuild(alarms)
+            smart_wake.rebuild(alarms)
+            print(f"Loaded {len(alarms)} alarms from storage")
+            return True
         else:
-            print(f"Alarms file {ALARMS_FILE} does not exist")
+            print("No valid alarms found in storage")
             return False
     except json.JSONDecodeError as e:
         print(f"JSON parsing error in alarms file: {e}")
-        print(f"File content: {open(ALARMS_FILE, 'r').read() if os.path.exists(ALARMS_FILE) else 'File does not exist'}")
         return False
     except Exception as e:
         print(f"Error loading alarms: {e}")
@@ -612,47 +751,40 @@ def load_alarms():
 def force_refresh_alarms():
     """Force reload alarms from file and update the display"""
     global alarms
-    print("Forcing refresh of alarms from file...")
-    
-    # Force file sync to ensure we're reading latest version
-    if hasattr(os, 'sync'):
-        os.sync()
-    
-    # Check if the file exists
-    if not os.path.exists(ALARMS_FILE):
-        print(f"Warning: Alarms file {ALARMS_FILE} does not exist")
-        return False
+    print("Forcing refresh of alarms from storage...")
     
     # Now properly load alarms
     try:
-        with open(ALARMS_FILE, 'r') as f:
-            loaded_alarms = json.load(f)
-            print(f"Loaded alarms content: {loaded_alarms}")
-            
-            # Validate the structure before replacing
-            valid_alarms = []
-            for alarm in loaded_alarms:
-                if "time" not in alarm or "active" not in alarm:
-                    print(f"Warning: Invalid alarm format: {alarm}")
-                    continue
-                valid_alarms.append(alarm)
-            
-            # Update the global alarms list
-            alarms = valid_alarms
-            print(f"Successfully loaded {len(alarms)} alarms from file")
-            
-            # Only update the display if we're in GUI mode
-            if not WEB_MODE and 'root' in globals() and root is not None:
-                # Schedule a safe UI update
-                root.after(100, safe_ui_update)
-            
-            return True
+        loaded_alarms = read_stored_alarms()
+        print(f"Loaded alarms content: {loaded_alarms}")
+        
+        # Validate the structure before replacing
+        valid_alarms = []
+        for alarm in loaded_alarms:
+            if "time" not in alarm or "active" not in alarm:
+                print(f"Warning: Invalid alarm format: {alarm}")
+                continue
+            valid_alarms.append(alarm)
+        
+        # Update the global alarms list, sorted once here rather than on every render
+        valid_alarms.sort(key=alarm_sort_key)
+        alarms = valid_alarms
+        schedule.rebuild(alarms)
+        fire_queue.rebuild(alarms)
+        smart_wake.rebuild(alarms)
+        print(f"Successfully loaded {len(alarms)} alarms from storage")
+        
+        # Only update the display if we're in GUI mode
+        if not WEB_MODE and 'root' in globals() and root is not None:
+            # Schedule a safe UI update
+            root.after(100, safe_ui_update)
+        
+        return True
     except json.JSONDecodeError as e:
         print(f"JSON parsing error in alarms file: {e}")
         # Try to fix the file with a default empty list
         try:
-            with open(ALARMS_FILE, 'w') as f:
-                json.dump([], f)
+            storage.get_storage().write_alarms([])
             print("Reset alarms file to empty list due to JSON error")
         except Exception as write_err:
             print(f"Error fixing alarms file: {write_err}")
@@ -663,33 +795,130 @@ def force_refresh_alarms():
 
 
 # Save alarms to file
-def save_alarms():
-    """Save alarms to file with proper flushing to ensure file modification is detected"""
+def save_alarms(changes=None):
+    """Save alarms through the storage backend so the change is detected by other processes
+
+    changes optionally describes the mutation (see storage.SqliteStorage.write_alarms)
+    so backends that support it can write a single row instead of the whole list.
+    If the web process wrote in the meantime, the change is merged into its
+    list and that list becomes ours.
+    """
+    global alarms
+    # Keep the compiled schedule, the fire queue and the wake windows in step with the list
+    # (only the touched slots); this also wakes the headless loop early
+    if changes is None:
+        schedule.rebuild(alarms)
+        fire_queue.rebuild(alarms)
+        smart_wake.rebuild(alarms)
+    else:
+        schedule.apply(changes)
+        fire_queue.apply(changes)
+        smart_wake.apply(changes)
+    
+    if SINGLE_PROCESS:
+        save_to_store(changes)
+        return
+    
     try:
-        # Create a temporary file and then rename it to ensure atomic write
-        temp_file = ALARMS_FILE + ".tmp"
-        with open(temp_file, 'w') as f:
-            json.dump(alarms, f)
-            f.flush()  # Flush internal Python buffers
-            os.fsync(f.fileno())  # Flush OS buffers to disk
-        
-        # Rename is atomic on POSIX systems
-        os.rename(temp_file, ALARMS_FILE)
-        
-        # Force sync the directory to ensure rename is committed
-        dir_fd = os.open(os.path.dirname(ALARMS_FILE) or '.', os.O_DIRECTORY)
-        os.fsync(dir_fd)
-        os.close(dir_fd)
-        
-        # Publish to MQTT after saving to file
-        if mqtt_client and mqtt_client.is_connected():
-            mqtt_client.publish("alarm/list", json.dumps(alarms), qos=1)
-            print(f"Published {len(alarms)} alarms to MQTT after save")
+        merged = storage.get_storage().write_alarms(alarms, changes)
+        if merged is not None:
+            print(f"Alarms changed elsewhere meanwhile, merged into {len(merged)} alarms")
+            alarms = sorted(merged, key=alarm_sort_key)
+            schedule.rebuild(alarms)
+            fire_queue.rebuild(alarms)
+            smart_wake.rebuild(alarms)
+            if not WEB_MODE and 'root' in globals() and root is not None:
+                root.after(100, safe_ui_update)
+        
+        # Tell the web process directly (it relays to MQTT clients); over MQTT
+        # ourselves only while the local channel is down. Just the delta when we know it
+        sent = ipc.notify("alarms_changed", {
+            "changes": None if changes is None else storage.changes_to_json(changes),
+            "version": storage.get_storage().alarms_version
+        })
+        if not sent and mqtt_client and mqtt_client.is_connected():
+            if changes is not None:
+                mqtt_client.publish("alarm/changes", json.dumps({
+                    "changes": storage.changes_to_json(changes)
+                }), qos=1)
+            else:
+                mqtt_client.publish("alarm/list", json.dumps(alarms), qos=1)
+                print(f"Published {len(alarms)} alarms to MQTT after save")
         
         print(f"Saved {len(alarms)} alarms to file")
     except Exception as e:
         print(f"Error saving alarms: {e}")
 
+# Set while our own change goes through alarm_store, so on_store_changed skips it
+own_store_write = threading.local()
+
+def save_to_store(changes):
+    """Single-process save: through the web server's alarm_store, which notifies its clients"""
+    own_store_write.active = True
+    try:
+        if changes is None:
+            alarm_store.replace_alarms(alarms)
+        else:
+            alarm_store.commit_changes(changes)
+        print(f"Saved {len(alarms)} alarms to the store")
+    except Exception as e:
+        print(f"Error saving alarms: {e}")
+    finally:
+        own_store_write.active = False
+
+def on_store_changed(version, changes=None):
+    """alarm_store listener (single-process mode): changes made by the web server"""
+    if changes is not None and getattr(own_store_write, "active", False):
+        return
+    if changes is None:
+        # Reload, full replace or a merge with another writer: take the store's list
+        force_refresh_alarms()
+    else:
+        # The hints hold the store's dicts: ours must be copies
+        apply_remote_alarms({"changes": storage.changes_to_json(changes)})
+
+def apply_remote_alarms(data):
+    """Alarm changes the web process made (and wrote), sent over the local channel"""
+    global alarms
+    backend = storage.get_storage()
+    if data.get("changes") is None:
+        if backend.alarms_version is None or backend.alarms_version != backend.lock.version():
+            force_refresh_alarms()
+        return
+    changes = storage.changes_from_json(data["changes"])
+    alarms = sorted(storage.apply_changes(alarms, changes), key=alarm_sort_key)
+    schedule.apply(changes)
+    fire_queue.apply(changes)
+    smart_wake.apply(changes)
+    if data.get("version") is not None and not SINGLE_PROCESS and backend.lock.version() == data["version"]:
+        # Our list now matches the stored one: no reload when the file watcher fires
+        backend.adopt_version(data["version"])
+    if not WEB_MODE and 'root' in globals() and root is not None:
+        root.after(100, safe_ui_update)
+
+def on_ipc_event(channel, name, data):
+    """Events from app.py over the local channel (see local_ipc.py)"""
+    if name == "alarms_changed":
+        apply_remote_alarms(data)
+    elif name == "state":
+        # Already in the shared segment: pick it up now rather than at the next watch poll
+        alarm_state.refresh()
+
+# Local channel to the web process (started in __main__); MQTT is for external clients
+ipc = local_ipc.Client(hello={"role": "interface", "web_mode": WEB_MODE},
+                       handlers={"ping": lambda params: params}, on_event=on_ipc_event)
+
+def start_ipc():
+    """Connect to app.py, and send it our state writes and output lines"""
+    if not ipc.start():
+        return
+    try:
+        alarm_state.add_publisher(lambda state: ipc.notify("state"))
+    except NameError:
+        pass
+    sys.stdout = local_ipc.OutputForwarder(sys.stdout, ipc,
+                                           exclusive=os.environ.get('ALARM_IPC_OUTPUT') == 'exclusive')
+
 # Immediate load attempt with retry
 for _ in range(3):  # Try up to 3 times
     if load_alarms():
@@ -699,29 +928,80 @@ for _ in range(3):  # Try up to 3 times
 
 alarm_active = False
 
+# Seconds are evaluated from the tick clock, so a late tick cannot skip one
+tick_clock = TickClock()
+
+# Ticks between two clock metrics publications
+CLOCK_METRICS_INTERVAL = 60
+
+def publish_metrics(name, data):
+    """Send counters to app.py /metrics: over the local channel, else retained on alarm/metrics/<name>"""
+    if metrics_sink is not None:
+        metrics_sink(name, data)
+        return
+    if ipc.notify("metrics", {"name": name, "data": data}):
+        return
+    if mqtt_client and mqtt_client.is_connected():
+        mqtt_client.publish(f"alarm/metrics/{name}", json.dumps(data), qos=0, retain=True)
+
+def publish_clock_metrics():
+    """Publish the tick, fire-queue, sampling, storage and IPC counters"""
+    try:
+        publish_metrics("clock", {
+            "tick": tick_clock.stats,
+            "fire_queue": fire_queue.stats,
+            "timestamp": time.time()
+        })
+        publish_metrics("sampling", sampling.snapshot())
+        backend = storage.get_storage()
+        publish_metrics("storage", dict(backend.stats, backend=backend.name))
+        publish_metrics("ipc", ipc.snapshot())
+    except Exception as e:
+        print(f"Error publishing clock metrics: {e}")
+
+def publish_smart_wake_metrics(stats):
+    """Publish the smart wake sampler counters after each epoch"""
+    try:
+        publish_metrics("smart_wake", stats)
+    except Exception as e:
+        print(f"Error publishing smart wake metrics: {e}")
+
+def publish_latency_metrics():
+    """Publish the firing latency histograms"""
+    try:
+        publish_metrics("latency", latency.snapshot())
+    except Exception as e:
+        print(f"Error publishing latency metrics: {e}")
+
 def update_time():
     """Met à jour l'heure en temps réel."""
+    # Every second since the last tick: one normally, more after a slow tick
+    for second in tick_clock.tick():
+        check_alarm(format_epoch_second(second), datetime.date.fromtimestamp(second))
+    
     current_time = time.strftime('%H:%M:%S')
     if not WEB_MODE:
         label.config(text=current_time)
     else:
         print(f"Current time: {current_time}")
     
-    check_alarm(current_time)
+    if tick_clock.stats["ticks"] % CLOCK_METRICS_INTERVAL == 0:
+        publish_clock_metrics()
     
     if not WEB_MODE:
-        root.after(1000, update_time)  # Rafraîchit toutes les secondes
+        # Aim just past the next second boundary rather than 1000 ms after this tick
+        root.after(tick_clock.delay_ms(), update_time)
 
-def check_alarm(current_time):
-    """Vérifie si une alarme doit sonner."""
+def check_alarm(current_time, current_date=None):
+    """Vérifie si une alarme doit sonner (current_date: jour de current_time, aujourd'hui par défaut)."""
     global alarm_active, distance_Prevue
     
     # Check if we're running in GUI mode and if snooze_button exists
     has_snooze_button = 'snooze_button' in globals() if not WEB_MODE else False
     
     try:
-        # First check the global alarm state from file (if toggled from web)
-        state = get_state()
+        # First check the global alarm state (if toggled from web); no file read while it is watched
+        state = current_state()
         
         # If alarm is active in the shared state but not locally, sync the local state
         if state["alarm_active"] and not alarm_active:
@@ -738,10 +1018,13 @@ def check_alarm(current_time):
                     buzzer.on()
                     distance_Prevue = random.uniform(0.2, 1.2) * 100  # Random expected distance
                     print(f"Distance prévue: {distance_Prevue:.2f} cm")
+                    start_challenge(state.get("alarm_id"))
                     check_distance()  # Start distance checking
                     move_servo()      # Start servo movement
             else:
                 print(f"🔔 ALARM TRIGGERED from web: {state['message']}")
+            if snooze_engine is not None:
+                snooze_engine.arm_auto_stop()
             return
         
         # If alarm was snoozed from web but still active locally, sync the local state
@@ -757,32 +1040,21 @@ def check_alarm(current_time):
                 if HARDWARE_AVAILABLE:
                     led.off()
                     buzzer.off()
+            end_challenge(False)
+            if snooze_engine is not None:
+                snooze_engine.cancel_auto_stop()
         
-        # Regular alarm checking logic
-        for alarm in alarms:
-            if alarm["active"] and alarm["time"] == current_time and not alarm_active:
-                if not WEB_MODE:
-                    if 'alarm_message' in globals():
-                        alarm_message.config(text="🔥 YOUPIII 🔥", fg="red")
-                    
-                    if has_snooze_button:
-                        snooze_button.pack(pady=10)  # Show the snooze button
-                    
-                    # Start hardware actions for the alarm
-                    if HARDWARE_AVAILABLE:
-                        led.on()
-                        buzzer.on()
-                        distance_Prevue = random.uniform(0.2, 1.2) * 100  # Random expected distance
-                        print(f"Distance prévue: {distance_Prevue:.2f} cm")
-                        check_distance()  # Start distance checking
-                        move_servo()      # Start servo movement
-                else:
-                    print(f"🔔 ALARM TRIGGERED: {alarm['time']}")
-                
-                # Set the shared state for the web interface to detect
-                set_state(True, f"Alarm triggered at {current_time}")
-                
-                alarm_active = True
+        # Regular alarm checking logic: one lookup in the compiled day schedule,
+        # recompiled only when the day changes (repeat rules are applied there)
+        current_date = current_date or datetime.date.today()
+        schedule.roll_to(current_date)
+        due = schedule.due(second_of_day(current_time))
+        if due and not alarm_active:
+            scheduled = datetime.datetime.combine(
+                current_date, datetime.time.fromisoformat(current_time)).timestamp()
+            # An alarm already rung early in its wake window stays quiet at its deadline
+            if any(not smart_wake.woke_early(alarm_id, scheduled) for alarm_id in due):
+                ring_alarm(current_time, scheduled, f"Alarm triggered at {current_time}", sorted(due))
                 return
         
         if not alarm_active:
@@ -799,8 +1071,78 @@ def check_alarm(current_time):
         if alarm_active:
             reset_alarm_state()
 
-def snooze_alarm():
-    """Désactive le message d'alarme."""
+def ring_alarm(current_time, scheduled, message, alarm_ids=(), early=False):
+    """Fait sonner l'alarme (scheduled: instant prévu, origine de la mesure de latence).
+
+    alarm_ids : alarmes qui sonnent, pour l'historique ; early : réveil anticipé.
+    """
+    global alarm_active, distance_Prevue
+    has_snooze_button = 'snooze_button' in globals() if not WEB_MODE else False
+    # Trace the firing from the second it was due (see latency.py)
+    trace = latency.Trace(scheduled, current_time)
+    trace.mark("detected")
+    
+    if not WEB_MODE:
+        if 'alarm_message' in globals():
+            alarm_message.config(text="🔥 YOUPIII 🔥", fg="red")
+        
+        if has_snooze_button:
+            snooze_button.pack(pady=10)  # Show the snooze button
+        
+        # Start hardware actions for the alarm
+        if HARDWARE_AVAILABLE:
+            led.on()
+            buzzer.on()
+            trace.mark("actuated")
+            distance_Prevue = random.uniform(0.2, 1.2) * 100  # Random expected distance
+            print(f"Distance prévue: {distance_Prevue:.2f} cm")
+            start_challenge(alarm_ids[0] if alarm_ids else None)
+            check_distance()  # Start distance checking
+            move_servo()      # Start servo movement
+    else:
+        print(f"🔔 ALARM TRIGGERED: {current_time}")
+    if "actuated" not in trace.marks:
+        # No actuator here: the alarm reached the user through the message
+        trace.mark("actuated")
+    
+    # Mark it locally first: listeners of the shared state run inside set_state
+    alarm_active = True
+    
+    # Set the shared state for the web interface to detect; the trace
+    # goes with it so the web process can time its own stages, and the
+    # alarm id and ring time so a later dismissal can be timed
+    write_started = time.time()
+    set_state(True, message, trace=trace.to_dict(),
+              alarm_id=alarm_ids[0] if alarm_ids else None, fired_at=scheduled)
+    latency.record("state_write", (trace.mark("persisted") - write_started) * 1000)
+    latency.finish(trace)
+    publish_latency_metrics()
+    for alarm_id in alarm_ids:
+        alarm_history.record(alarm_history.FIRE, alarm_id, 0.0, alarm_history.FLAG_EARLY if early else 0)
+    if snooze_engine is not None:
+        snooze_engine.arm_auto_stop()
+    return True
+
+def start_smart_wake():
+    """Start the wake window sampler (only with the IMU present)"""
+    if smart_wake.start(wake_early, publish_smart_wake_metrics):
+        print("Smart wake sampler started")
+
+def wake_early(alarm_id, deadline, epochs):
+    """Called by the smart wake sampler when sleep turns light inside a wake window"""
+    if alarm_active:
+        return False
+    message = f"Smart wake before {time.strftime('%H:%M', time.localtime(deadline))} (movement {epochs})"
+    print(f"🌅 {message}")
+    if WEB_MODE:
+        with check_lock:
+            return ring_alarm(time.strftime('%H:%M:%S'), time.time(), message, [alarm_id], True)
+    # Tk is only driven from its own thread
+    root.after(0, ring_alarm, time.strftime('%H:%M:%S'), time.time(), message, [alarm_id], True)
+    return True
+
+def silence_alarm():
+    """Coupe le son et efface le message d'alarme."""
     global alarm_active
     if not WEB_MODE:
         if 'alarm_message' in globals():
@@ -818,33 +1160,62 @@ def snooze_alarm():
             movement_warning_label.config(text="")
         if 'distance_label' in globals():
             distance_label.config(text="")
-    else:
-        print("Alarm snoozed")
     
-    # Clear the shared alarm state
-    clear_state()
-    
-    # MQTT publish
-    if mqtt_client and hasattr(mqtt_client, 'publish'):
+    end_challenge(False)
+    alarm_active = False
+
+def publish_alarm_state(state):
+    if ipc.connected:
+        # The web process got it over the local channel and relays it to MQTT
+        return
+    if state and mqtt_client and hasattr(mqtt_client, 'publish'):
         try:
-            mqtt_client.publish("alarm/state", json.dumps({
-                "alarm_active": False,
-                "timestamp": time.time(),
-                "message": "Alarm snoozed"
-            }))
+            mqtt_client.publish("alarm/state", json.dumps(state))
         except Exception as e:
             print(f"Error publishing alarm state: {e}")
+
+def snooze_alarm(minutes=None):
+    """Désactive l'alarme, qui sonnera de nouveau après la durée de répétition."""
+    silence_alarm()
+    if snooze_engine is None:
+        clear_state()
+        print("Alarm snoozed")
+        return
     
-    alarm_active = False
+    # Rings again later unless dismissed; past the repeat limit this dismisses
+    state = snooze_engine.snooze(minutes)
+    if state is not None:
+        print(state["message"])
+    publish_alarm_state(state)
+
+def dismiss_alarm():
+    """Arrête l'alarme, y compris une répétition en attente."""
+    silence_alarm()
+    if snooze_engine is None:
+        clear_state()
+        print("Alarm dismissed")
+        return
+    publish_alarm_state(snooze_engine.dismiss())
+    print("Alarm dismissed")
+
+def set_alarm(hour, minute, second, repeat=None, wake_window=None):
+    """Ajoute une alarme avec l'heure sélectionnée.
 
-def set_alarm(hour, minute, second):
-    """Ajoute une alarme avec l'heure sélectionnée."""
+    repeat : règle de répétition (voir recurrence.py) ; wake_window : minutes
+    avant l'heure pendant lesquelles elle peut sonner plus tôt (voir smart_wake.py).
+    """
     if WEB_MODE and hour is not None and minute is not None and second is not None:
         alarm_time = f"{hour:02d}:{minute:02d}:{second:02d}"
     else:
         alarm_time = get_wheel_time()
     
-    new_alarm = {"time": alarm_time, "active": True}
+    new_alarm = {"id": storage.new_alarm_id(), "time": alarm_time, "active": True}
+    rule = normalize_rule(repeat)
+    if rule:
+        new_alarm["repeat"] = rule
+    window = normalize_wake_window(wake_window)
+    if window:
+        new_alarm["wake_window"] = window
     actif = False
 
     # Regarder si l'alarme est déjà dans la liste 
@@ -855,12 +1226,12 @@ def set_alarm(hour, minute, second):
             break
         
     if not actif:
-        alarms.append(new_alarm)
+        # Insert in time order so the list never needs re-sorting
+        bisect.insort(alarms, new_alarm, key=alarm_sort_key)
         print(f"New alarm set for {alarm_time}")
-        save_alarms()
+        save_alarms([("insert", new_alarm)])
         # MQTT publish
-        publish_alarm_added(alarm_time, True)
-        publish_alarm_list()
+        publish_alarm_added(alarm_time, True, new_alarm["id"])
         if not WEB_MODE:
             # Use the safe UI update function
             root.after(100, safe_ui_update)
@@ -876,7 +1247,6 @@ def update_alarm_list():
     if WEB_MODE:
         return
         
-    alarms.sort(key=lambda x: x["time"])
     for widget in alarm_list_frame.winfo_children():
         widget.destroy()  # Efface les anciennes alarmes avant de les recréer
 
@@ -901,8 +1271,6 @@ def update_alarm_list():
         delete_btn = tk.Button(frame, text="🗑", command=lambda i=i: delete_alarm(i), width=3)
         delete_btn.pack(side="left", padx=5)
     
-    # Trier les alarmes par heure
-    alarms.sort(key=lambda x: x["time"])
     alarm_canvas.update_idletasks()  # Met à jour la ScrollView
     alarm_canvas.config(scrollregion=alarm_canvas.bbox("all"))  # Ajuste la zone de défilement
 
@@ -921,7 +1289,6 @@ def toggle_alarm(index):
         
         # MQTT publish
         publish_alarm_toggled(index, alarms[index]["active"])
-        publish_alarm_list()
         
         # If we're deactivating an alarm that is currently triggered, also clear the alarm state
         if not alarms[index]["active"] and alarm_active:
@@ -938,7 +1305,7 @@ def toggle_alarm(index):
                     clear_state()
                     alarm_active = False
         
-        save_alarms()
+        save_alarms([("update", alarms[index]["id"], alarms[index])])
         
         # Only try to update the UI if we're in GUI mode and the UI has been initialized
         if not WEB_MODE:
@@ -961,10 +1328,13 @@ def edit_alarm(index, hour=None, minute=None, second=None):
     else:
         new_time = get_wheel_time()
     
-    old_time = alarms[index]["time"]
-    alarms[index]["time"] = new_time
+    alarm = alarms.pop(index)
+    old_time = alarm["time"]
+    alarm["time"] = new_time
+    # Move it to its new place in time order
+    bisect.insort(alarms, alarm, key=alarm_sort_key)
     print(f"Alarm changed from {old_time} to {new_time}")
-    save_alarms()
+    save_alarms([("update", alarm["id"], alarm)])
     
     if not WEB_MODE:
         styled_update_alarm_list()
@@ -976,15 +1346,14 @@ def delete_alarm(index):
         print(f"Error: Invalid alarm index {index}")
         return False
         
-    deleted_time = alarms[index]["time"]
-    del alarms[index]
+    deleted = alarms.pop(index)
+    deleted_time = deleted["time"]
     print(f"Alarm at {deleted_time} deleted")
     
     # MQTT publish
-    publish_alarm_deleted(index, deleted_time)
-    publish_alarm_list()
+    publish_alarm_deleted(index, deleted_time, deleted["id"])
     
-    save_alarms()
+    save_alarms([("delete", deleted["id"])])
     
     if not WEB_MODE:
         styled_update_alarm_list()
@@ -992,8 +1361,16 @@ def delete_alarm(index):
 
 class AlarmFileHandler(FileSystemEventHandler):
     def on_modified(self, event):
-        if event.src_path.endswith(ALARMS_FILE):
-            print(f"Detected changes to {ALARMS_FILE}")
+        if any(event.src_path.endswith(path) for path in storage.get_storage().watch_paths()):
+            backend = storage.get_storage()
+            if backend.alarms_version is not None and backend.alarms_version == backend.lock.version():
+                # Our own write, or a delta we already got over the local channel
+                return
+            if SINGLE_PROCESS:
+                # Edited outside this process: the store reloads and on_store_changed follows
+                alarm_store.get_version()
+                return
+            print(f"Detected changes to {event.src_path}")
             # Use a slight delay to ensure the file is completely written
             time.sleep(0.1)
             # Use the more robust force_refresh_alarms function
@@ -1004,7 +1381,6 @@ def styled_update_alarm_list():
     if WEB_MODE:
         return
         
-    alarms.sort(key=lambda x: x["time"])
     for widget in alarm_list_frame.winfo_children():
         widget.destroy()  # Efface les anciennes alarmes avant de les recréer
 
@@ -1521,7 +1897,6 @@ def run_gui_mode():
         if WEB_MODE:
             return
             
-        alarms.sort(key=lambda x: x["time"])
         for widget in alarm_list_frame.winfo_children():
             widget.destroy()  # Efface les anciennes alarmes avant de les recréer
 
@@ -1656,6 +2031,7 @@ def run_gui_mode():
     # Now start the main event loop with proper error handling
     print("Starting main event loop...")
     try:
+        start_smart_wake()
         update_time()  # Start the time updates which will also check alarms
         monitor_file_changes()  # Start monitoring for file changes
         root.mainloop()
@@ -1688,13 +2064,37 @@ def monitor_file_changes():
     if not WEB_MODE:
         root.after(5000, monitor_file_changes)
 
+# Headless mode checks from the fire queue and the state watcher threads
+check_lock = threading.RLock()
+
+def fire_due_alarms(fire_time, alarm_ids):
+    """Ring the alarms the fire queue found due at fire_time"""
+    with check_lock:
+        check_alarm(format_epoch_second(fire_time), datetime.date.fromtimestamp(fire_time))
+    publish_clock_metrics()
+
+def sync_alarm_state(state):
+    """Pick up an alarm triggered or snoozed from the web without waiting for the next alarm"""
+    with check_lock:
+        check_alarm(time.strftime('%H:%M:%S'))
+
 def run_web_mode():
     print("Starting alarm system in web mode")
     
-    # Main loop for web mode
-    while True:
-        update_time()
-        time.sleep(1)
+    # Log alarms triggered or snoozed from the web as they happen; the state
+    # is synced again by check_alarm whenever an alarm comes due
+    try:
+        alarm_state.add_listener(sync_alarm_state)
+    except NameError:
+        pass
+    
+    # Sleep until the next alarm instead of waking every second; adding or
+    # editing an alarm wakes the loop early through save_alarms()
+    start_smart_wake()
+    upcoming = fire_queue.next_fire()
+    if upcoming:
+        print(f"Next alarm at {time.strftime('%H:%M:%S', time.localtime(upcoming[0]))}")
+    fire_queue.run(fire_due_alarms)
 
 def get_sensor_data():
     """Get current sensor data for web interface"""
@@ -1751,11 +2151,17 @@ def get_sensor_data():
     
     return data
 
-if __name__ == "__main__":
+def main():
+    """Run the GUI, or the headless engine in web mode, until it exits"""
     print(f"Starting in {'web' if WEB_MODE else 'GUI'} mode")
     
-    # Set up MQTT client to receive commands from web interface
-    setup_mqtt_client()
+    if SINGLE_PROCESS:
+        # app.py serves MQTT and the web clients from this process: follow its store
+        alarm_store.add_listener(on_store_changed)
+    else:
+        # Local channel to app.py, and MQTT for external clients
+        start_ipc()
+        setup_mqtt_client()
     
     if WEB_MODE:
         run_web_mode()
@@ -1931,9 +2337,6 @@ if __name__ == "__main__":
                             if WEB_MODE:
                                 return
                                 
-                            # Sort alarms by time
-                            alarms.sort(key=lambda x: x["time"])
-                            
                             # Clear existing list
                             for widget in alarm_list_frame.winfo_children():
                                 widget.destroy()
@@ -2000,6 +2403,7 @@ if __name__ == "__main__":
                     
                     # Init alarm list and start updates
                     force_refresh_alarms()
+                    start_smart_wake()
                     update_time()
                     
                     # Start sensor updates if hardware is available
@@ -2017,3 +2421,6 @@ if __name__ == "__main__":
                 print(f"Fallback GUI mode also failed: {e2}")
                 print("Starting web mode instead")
                 run_web_mode()
+
+if __name__ == "__main__":
+    main()
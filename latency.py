@@ -0,0 +1,138 @@
+# latency.py - How late alarms really ring, stage by stage
+#
+# A firing is traced from the second it was scheduled for through each
+# stage of the path to the user:
+#
+#   detected         check_alarm noticed it was due (interface process)
+#   actuated         LED/buzzer commanded on (interface process)
+#   persisted        the active state was written (interface process)
+#   mqtt_published   the state went out on alarm/state (web process)
+#   client_notified  the state was pushed to /events subscribers (web process)
+#
+# Each process keeps fixed-bucket histograms of "milliseconds after the
+# scheduled second" per stage, plus the duration of the state write itself
+# (where an fsync stall on a worn SD card shows up first). The trace rides
+# along in the alarm state, so the web process completes the stages the
+# interface process started.
+import collections
+import threading
+import time
+
+STAGES = ("detected", "actuated", "persisted", "mqtt_published", "client_notified")
+# Upper bounds of the histogram buckets, in milliseconds (plus one overflow bucket)
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+RECENT_TRACES = 20
+
+
+class Histogram:
+    """Counts of values per fixed bucket, with count/sum/max kept exactly"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        position = 0
+        while position < len(BUCKETS_MS) and value > BUCKETS_MS[position]:
+            position += 1
+        self.counts[position] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding this fraction of the values, capped at the max"""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for position, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count and position < len(BUCKETS_MS):
+                return min(BUCKETS_MS[position], round(self.max, 1))
+        return round(self.max, 1)
+
+    def snapshot(self):
+        buckets = {f"<={bound}": count for bound, count in zip(BUCKETS_MS, self.counts)}
+        buckets[f">{BUCKETS_MS[-1]}"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count, 1) if self.count else None,
+            "max_ms": round(self.max, 1),
+            "p50_ms": self.percentile(0.5),
+            "p90_ms": self.percentile(0.9),
+            "p99_ms": self.percentile(0.99),
+            "buckets": buckets
+        }
+
+
+_lock = threading.Lock()
+_histograms = collections.OrderedDict()
+_recent = collections.deque(maxlen=RECENT_TRACES)
+_completed = collections.deque(maxlen=RECENT_TRACES)  # scheduled times already recorded here
+
+
+def record(name, value_ms):
+    """Add one measurement (milliseconds) to the named histogram"""
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.add(value_ms)
+
+
+class Trace:
+    """Stage timestamps of one firing, relative to its scheduled second"""
+
+    def __init__(self, scheduled, alarm_time=None):
+        self.scheduled = scheduled
+        self.alarm_time = alarm_time
+        self.marks = {}
+
+    def mark(self, stage, at=None):
+        """Timestamp a stage now (or at `at`) and record its lateness"""
+        at = time.time() if at is None else at
+        self.marks[stage] = at
+        record(stage, (at - self.scheduled) * 1000)
+        return at
+
+    def to_dict(self):
+        trace = {"scheduled": self.scheduled, "time": self.alarm_time}
+        trace.update({stage: round(at, 4) for stage, at in self.marks.items()})
+        return trace
+
+
+def finish(trace):
+    """Keep a finished trace in the recent list"""
+    entry = trace.to_dict() if isinstance(trace, Trace) else dict(trace)
+    with _lock:
+        _recent.append(entry)
+
+
+def complete(trace, **marks):
+    """Record stages of a trace started by another process (once per firing)"""
+    scheduled = trace.get("scheduled")
+    if scheduled is None:
+        return
+    with _lock:
+        if scheduled in _completed:
+            return
+        _completed.append(scheduled)
+    entry = dict(trace)
+    for stage, at in marks.items():
+        entry[stage] = round(at, 4)
+        record(stage, (at - scheduled) * 1000)
+    finish(entry)
+
+
+def snapshot():
+    """Histograms per stage (in STAGES order, then any others) and the recent traces"""
+    with _lock:
+        names = [name for name in STAGES if name in _histograms]
+        names += [name for name in _histograms if name not in STAGES]
+        return {
+            "stages": {name: _histograms[name].snapshot() for name in names},
+            "recent": list(_recent)
+        }
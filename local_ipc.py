@@ -0,0 +1,372 @@
+# local_ipc.py - Unix domain socket channel between app.py and interface_1.py
+#
+# The two processes used to reach each other only through the MQTT broker
+# (a round trip through a network service for every command), through
+# watchdog events on the alarm files and through the child's stdout. They
+# now share a local socket, ALARM_IPC_SOCKET, with app.py listening and
+# interface_1.py connecting (and reconnecting when app.py restarts).
+#
+# Every message is a 4-byte big-endian length followed by that many bytes
+# of UTF-8 JSON:
+#
+#   {"type": "event", "name": ..., "data": ...}                 one way
+#   {"type": "call", "id": n, "method": ..., "params": ...}     expects a reply
+#   {"type": "reply", "id": n, "result": ...} or {..., "error": "..."}
+#
+# Either side may send events and calls. Events carry alarm deltas, state
+# changes, interface output and metrics; MQTT is left to external clients
+# (and is the fallback while the channel is down).
+import itertools
+import json
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+
+from latency import Histogram
+
+SOCKET_PATH = os.environ.get('ALARM_IPC_SOCKET', os.path.join(tempfile.gettempdir(), "alarm_ipc.sock"))
+FRAME = struct.Struct(">I")
+MAX_FRAME = 4 * 1024 * 1024
+CALL_TIMEOUT = 5.0
+RECONNECT_SECONDS = 1.0
+
+
+def available():
+    """Whether this platform has Unix domain sockets"""
+    return hasattr(socket, "AF_UNIX")
+
+
+class ChannelClosed(Exception):
+    """The other process went away"""
+
+
+class RemoteError(Exception):
+    """A call failed in the other process"""
+
+
+def _recv_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ChannelClosed("connection closed")
+        data.extend(chunk)
+    return bytes(data)
+
+
+class Channel:
+    """One connected socket: framed sends, a reader thread, calls matched to replies"""
+
+    def __init__(self, sock, handlers=None, on_event=None, on_close=None, name="ipc"):
+        self.sock = sock
+        self.peer = {}  # what the other side said about itself in its "hello"
+        self._handlers = handlers or {}  # method -> callable(params) for calls
+        self._on_event = on_event        # callable(channel, name, data)
+        self._on_close = on_close
+        self._send_lock = threading.Lock()
+        self._pending = {}  # call id -> [event, reply]
+        self._pending_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._closed = threading.Event()
+        self.stats = {"sent": 0, "received": 0, "bytes_sent": 0, "bytes_received": 0,
+                      "calls": 0, "call_errors": 0}
+        self.round_trip_ms = Histogram()
+        self._reader = threading.Thread(target=self._read_loop, name=f"{name}-reader", daemon=True)
+        self._reader.start()
+
+    @property
+    def closed(self):
+        return self._closed.is_set()
+
+    def _send(self, message):
+        body = json.dumps(message, separators=(",", ":")).encode("utf-8")
+        if len(body) > MAX_FRAME:
+            raise ValueError(f"IPC message of {len(body)} bytes (at most {MAX_FRAME})")
+        with self._send_lock:
+            if self.closed:
+                raise ChannelClosed("channel closed")
+            try:
+                self.sock.sendall(FRAME.pack(len(body)) + body)
+            except OSError as e:
+                self.close()
+                raise ChannelClosed(str(e))
+            self.stats["sent"] += 1
+            self.stats["bytes_sent"] += FRAME.size + len(body)
+
+    def notify(self, name, data=None):
+        """Send an event (no reply)"""
+        self._send({"type": "event", "name": name, "data": data})
+
+    def call(self, method, params=None, timeout=CALL_TIMEOUT):
+        """Call a method in the other process and return its result"""
+        call_id = next(self._ids)
+        waiter = [threading.Event(), None]
+        with self._pending_lock:
+            self._pending[call_id] = waiter
+        start = time.perf_counter()
+        try:
+            self._send({"type": "call", "id": call_id, "method": method, "params": params})
+            if not waiter[0].wait(timeout):
+                raise TimeoutError(f"no reply to {method} within {timeout} s")
+        finally:
+            with self._pending_lock:
+                self._pending.pop(call_id, None)
+        reply = waiter[1]
+        if reply is None:
+            raise ChannelClosed("channel closed before the reply")
+        self.stats["calls"] += 1
+        self.round_trip_ms.add((time.perf_counter() - start) * 1000)
+        if "error" in reply:
+            self.stats["call_errors"] += 1
+            raise RemoteError(reply["error"])
+        return reply.get("result")
+
+    def _read_loop(self):
+        try:
+            while not self.closed:
+                length = FRAME.unpack(_recv_exactly(self.sock, FRAME.size))[0]
+                if length > MAX_FRAME:
+                    raise ChannelClosed(f"frame of {length} bytes")
+                message = json.loads(_recv_exactly(self.sock, length))
+                self.stats["received"] += 1
+                self.stats["bytes_received"] += FRAME.size + length
+                self._dispatch(message)
+        except (ChannelClosed, OSError, ValueError) as e:
+            if not self.closed:
+                print(f"IPC channel closed: {e}")
+        finally:
+            self.close()
+
+    def _dispatch(self, message):
+        kind = message.get("type")
+        if kind == "reply":
+            with self._pending_lock:
+                waiter = self._pending.get(message.get("id"))
+            if waiter is not None:
+                waiter[1] = message
+                waiter[0].set()
+        elif kind == "call":
+            # Answered on a worker thread, so a slow handler does not hold up the reader
+            threading.Thread(target=self._answer, args=(message,), daemon=True).start()
+        elif kind == "event":
+            if message.get("name") == "hello":
+                self.peer = message.get("data") or {}
+            if self._on_event is not None:
+                try:
+                    self._on_event(self, message.get("name"), message.get("data"))
+                except Exception as e:
+                    print(f"Error handling IPC event {message.get('name')}: {e}")
+
+    def _answer(self, message):
+        handler = self._handlers.get(message.get("method"))
+        if handler is None:
+            reply = {"type": "reply", "id": message.get("id"), "error": f"unknown method {message.get('method')}"}
+        else:
+            try:
+                reply = {"type": "reply", "id": message.get("id"), "result": handler(message.get("params"))}
+            except Exception as e:
+                reply = {"type": "reply", "id": message.get("id"), "error": str(e)}
+        try:
+            self._send(reply)
+        except ChannelClosed:
+            pass
+
+    def close(self):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        with self._pending_lock:
+            for waiter in self._pending.values():
+                waiter[0].set()
+        if self._on_close is not None:
+            self._on_close(self)
+
+    def snapshot(self):
+        return dict(self.stats, peer=self.peer, round_trip=self.round_trip_ms.snapshot())
+
+
+class Server:
+    """Listening side (app.py): accepts any number of channels"""
+
+    def __init__(self, path=SOCKET_PATH, handlers=None, on_event=None):
+        self.path = path
+        self._handlers = handlers or {}
+        self._on_event = on_event
+        self._channels = []
+        self._lock = threading.Lock()
+        self._sock = None
+
+    def start(self):
+        """Listen in a daemon thread. Returns False when the socket cannot be bound."""
+        try:
+            if os.path.exists(self.path):
+                # Left over from a previous run (a live server would still be listening)
+                probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                try:
+                    probe.connect(self.path)
+                    probe.close()
+                    print(f"IPC socket {self.path} is already served by another process")
+                    return False
+                except OSError:
+                    probe.close()
+                    os.unlink(self.path)
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.bind(self.path)
+            os.chmod(self.path, 0o600)
+            self._sock.listen(8)
+        except (OSError, AttributeError) as e:
+            print(f"IPC server not available ({e}), using MQTT only")
+            return False
+        threading.Thread(target=self._accept_loop, name="ipc-accept", daemon=True).start()
+        print(f"IPC server listening on {self.path}")
+        return True
+
+    def _accept_loop(self):
+        while True:
+            try:
+                sock, _ = self._sock.accept()
+            except OSError as e:
+                print(f"IPC server stopped accepting: {e}")
+                return
+            channel = Channel(sock, self._handlers, self._on_event, self._forget, name="ipc-server")
+            with self._lock:
+                self._channels.append(channel)
+
+    def _forget(self, channel):
+        with self._lock:
+            if channel in self._channels:
+                self._channels.remove(channel)
+
+    def channels(self, role=None):
+        """Open channels, optionally only those whose hello named this role"""
+        with self._lock:
+            return [channel for channel in self._channels
+                    if not channel.closed and (role is None or channel.peer.get("role") == role)]
+
+    def broadcast(self, name, data=None, role=None):
+        """Send an event to every channel (of a role). Returns how many got it."""
+        sent = 0
+        for channel in self.channels(role):
+            try:
+                channel.notify(name, data)
+                sent += 1
+            except (ChannelClosed, ValueError) as e:
+                print(f"IPC broadcast of {name} failed: {e}")
+        return sent
+
+    def snapshot(self):
+        return {"path": self.path, "channels": [channel.snapshot() for channel in self.channels()]}
+
+
+class Client:
+    """Connecting side (interface_1.py): keeps a channel to the server, reconnecting as needed"""
+
+    def __init__(self, path=SOCKET_PATH, handlers=None, on_event=None, hello=None, on_connect=None):
+        self.path = path
+        self._handlers = handlers or {}
+        self._on_event = on_event
+        self._hello = hello or {}
+        self._on_connect = on_connect
+        self._channel = None
+        self._wake = threading.Event()
+        self.stats = {"connects": 0}
+
+    def start(self):
+        if not available():
+            print("Unix domain sockets not available, using MQTT only")
+            return False
+        threading.Thread(target=self._connect_loop, name="ipc-connect", daemon=True).start()
+        return True
+
+    @property
+    def connected(self):
+        channel = self._channel
+        return channel is not None and not channel.closed
+
+    def _connect_loop(self):
+        while True:
+            if not self.connected:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                try:
+                    sock.connect(self.path)
+                except OSError:
+                    sock.close()
+                else:
+                    channel = Channel(sock, self._handlers, self._on_event,
+                                      lambda closed: self._wake.set(), name="ipc-client")
+                    try:
+                        channel.notify("hello", dict(self._hello, pid=os.getpid()))
+                    except ChannelClosed:
+                        continue
+                    self._channel = channel
+                    self.stats["connects"] += 1
+                    print(f"IPC channel connected to {self.path}")
+                    if self._on_connect is not None:
+                        try:
+                            self._on_connect(channel)
+                        except Exception as e:
+                            print(f"Error in IPC connect hook: {e}")
+            self._wake.wait(RECONNECT_SECONDS)
+            self._wake.clear()
+
+    def notify(self, name, data=None):
+        """Send an event if connected. Returns whether it was sent."""
+        channel = self._channel
+        if channel is None or channel.closed:
+            return False
+        try:
+            channel.notify(name, data)
+            return True
+        except ChannelClosed:
+            return False
+
+    def call(self, method, params=None, timeout=CALL_TIMEOUT):
+        channel = self._channel
+        if channel is None or channel.closed:
+            raise ChannelClosed("not connected")
+        return channel.call(method, params, timeout)
+
+    def snapshot(self):
+        channel = self._channel
+        return dict(self.stats, path=self.path, connected=self.connected,
+                    channel=channel.snapshot() if channel is not None else None)
+
+
+class OutputForwarder:
+    """Stands in for sys.stdout: whole lines also go out as "output" events.
+
+    exclusive: while the channel is up, lines go only over it (set when the
+    parent reads our stdout pipe for the same lines, see app.py).
+    """
+
+    def __init__(self, stream, client, exclusive=False):
+        self._stream = stream
+        self._client = client
+        self._exclusive = exclusive
+        self._partial = ""
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        with self._lock:
+            self._partial += text
+            lines = self._partial.split("\n")
+            self._partial = lines.pop()
+        for line in lines:
+            sent = self._client.notify("output", {"line": line.rstrip("\r")})
+            if not (sent and self._exclusive):
+                self._stream.write(line + "\n")
+        return len(text)
+
+    def flush(self):
+        self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
@@ -0,0 +1,228 @@
+# next_fire.py - Event-driven scheduler: sleep until the next alarm is due
+#
+# A min-heap of (fire timestamp, alarm id) holds the next wall-clock time each
+# active alarm rings. The driving thread waits on a condition until the top of
+# the heap is due, so between alarms it uses no CPU at all; mutations (the same
+# change hints as storage.py) push new entries and wake it early. Entries made
+# stale by an edit, toggle or delete are not searched for and removed; they are
+# recognised and skipped when they reach the top (lazy invalidation).
+#
+# The heap doubles as the next-occurrence cache for repeat rules (see
+# recurrence.py): an alarm's next fire time is computed when its rule
+# changes and again when it fires, never per tick.
+import datetime
+import heapq
+import threading
+import time
+
+from recurrence import compile_rule
+
+# Longest single wait, so a wall-clock jump (NTP, manual set) is noticed in time
+MAX_WAIT = 60
+# A fire time this far in the past (clock jumped forward, host suspended) is skipped
+MISFIRE_GRACE = 60
+
+
+def next_fire_time(alarm_time, after, rule=None):
+    """First local timestamp strictly after `after` at HH:MM:SS on a day the rule allows.
+
+    rule is a recurrence.CompiledRule (None for every day). Returns None
+    when the rule has no day left (e.g. a one-off alarm in the past).
+    """
+    hour, minute, second = (int(part) for part in alarm_time.split(":"))
+    at = datetime.time(hour, minute, second)
+    day = datetime.date.fromtimestamp(after)
+    while True:
+        if rule is not None:
+            day = rule.next_date(day)
+            if day is None:
+                return None
+        # Built in local time so DST changes move the timestamp, not the alarm
+        fire = datetime.datetime.combine(day, at).timestamp()
+        if fire > after:
+            return fire
+        day += datetime.timedelta(days=1)
+
+
+class NextFireScheduler:
+    """Active alarms ordered by their next fire time, with a blocking run loop"""
+
+    def __init__(self, alarms=(), clock=time.time):
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._running = False
+        self.stats = {"wakeups": 0, "fired": 0, "misfired": 0, "stale_skipped": 0,
+                      "last_lateness_ms": 0.0, "max_lateness_ms": 0.0}
+        self.rebuild(alarms)
+
+    def rebuild(self, alarms):
+        """Reschedule a whole list (after a load or a full replace)"""
+        now = self._clock()
+        with self._cond:
+            self._alarm_by_id = {}  # id -> (HH:MM:SS, compiled rule)
+            self._fire_by_id = {}
+            self._heap = []
+            for alarm in alarms:
+                self._add(alarm, now)
+            heapq.heapify(self._heap)
+            self._cond.notify_all()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._fire_by_id)
+
+    def _add(self, alarm, now, push=list.append):
+        """Caller must hold the lock"""
+        alarm_id = alarm["id"]
+        self._alarm_by_id.pop(alarm_id, None)
+        self._fire_by_id.pop(alarm_id, None)
+        if not alarm["active"]:
+            return
+        try:
+            rule = compile_rule(alarm.get("repeat"))
+            fire = next_fire_time(alarm["time"], now, rule)
+        except (ValueError, AttributeError, TypeError):
+            print(f"Warning: cannot schedule alarm {alarm_id} ({alarm.get('time')!r}, {alarm.get('repeat')!r})")
+            return
+        if fire is None:
+            return
+        self._alarm_by_id[alarm_id] = (alarm["time"], rule)
+        self._fire_by_id[alarm_id] = fire
+        push(self._heap, (fire, alarm_id))
+
+    def _compact(self):
+        """Drop stale entries once they outnumber the live ones. Caller must hold the lock."""
+        if len(self._heap) > 2 * len(self._fire_by_id) + 64:
+            self._heap = [(fire, alarm_id) for alarm_id, fire in self._fire_by_id.items()]
+            heapq.heapify(self._heap)
+
+    def apply(self, changes):
+        """Apply ("insert"/"update"/"delete") change hints and wake the run loop"""
+        now = self._clock()
+        with self._cond:
+            for change in changes:
+                if change[0] == "insert":
+                    self._add(change[1], now, heapq.heappush)
+                elif change[0] == "update":
+                    self._add(change[2], now, heapq.heappush)
+                elif change[0] == "delete":
+                    self._alarm_by_id.pop(change[1], None)
+                    self._fire_by_id.pop(change[1], None)
+            self._compact()
+            self._cond.notify_all()
+
+    def _pop_stale(self):
+        """Discard superseded entries from the top of the heap. Caller must hold the lock."""
+        while self._heap and self._fire_by_id.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+            self.stats["stale_skipped"] += 1
+
+    def next_fire(self):
+        """(timestamp, [alarm ids]) of the next alarms to ring, or None if none are active"""
+        with self._cond:
+            self._pop_stale()
+            if not self._heap:
+                return None
+            fire = self._heap[0][0]
+            return fire, sorted(alarm_id for alarm_id, at in self._fire_by_id.items() if at == fire)
+
+    def upcoming(self, n, now=None):
+        """The next n firings as (timestamp, alarm id), repeats of one alarm included"""
+        now = self._clock() if now is None else now
+        with self._cond:
+            if not self._running:
+                # Nobody fires this schedule: roll past entries forward instead
+                self._rearm_due(now)
+            heap = heapq.nsmallest(n, ((fire, alarm_id) for alarm_id, fire in self._fire_by_id.items()))
+            rules = {alarm_id: self._alarm_by_id[alarm_id] for _, alarm_id in heap}
+        # Each pick is replaced by its own next occurrence, so n pops suffice
+        firings = []
+        while heap and len(firings) < n:
+            fire, alarm_id = heapq.heappop(heap)
+            firings.append((fire, alarm_id))
+            alarm_time, rule = rules[alarm_id]
+            following = next_fire_time(alarm_time, fire, rule)
+            if following is not None:
+                heapq.heappush(heap, (following, alarm_id))
+        return firings
+
+    def _rearm_due(self, now):
+        """Pop the entries due at `now` and push each alarm's next occurrence.
+
+        Returns the popped (fire timestamp, alarm id) pairs in fire order.
+        Caller must hold the lock.
+        """
+        popped = []
+        while True:
+            self._pop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                return popped
+            fire, alarm_id = heapq.heappop(self._heap)
+            popped.append((fire, alarm_id))
+            alarm_time, rule = self._alarm_by_id[alarm_id]
+            rearm = next_fire_time(alarm_time, max(fire, now), rule)
+            if rearm is None:
+                # Last occurrence of a dated alarm
+                del self._alarm_by_id[alarm_id]
+                del self._fire_by_id[alarm_id]
+                continue
+            self._fire_by_id[alarm_id] = rearm
+            heapq.heappush(self._heap, (rearm, alarm_id))
+
+    def _take_due(self, now):
+        """Pop every entry due at `now`, re-arming each alarm for its next occurrence.
+
+        Returns (fire timestamp, [alarm ids]) groups in fire order. Caller must
+        hold the lock.
+        """
+        due = {}
+        for fire, alarm_id in self._rearm_due(now):
+            if now - fire > MISFIRE_GRACE:
+                self.stats["misfired"] += 1
+                print(f"Skipping alarm {alarm_id} due {now - fire:.0f}s ago (clock jump or suspend)")
+                continue
+            due.setdefault(fire, []).append(alarm_id)
+        return sorted(due.items())
+
+    def run(self, on_fire):
+        """Call on_fire(timestamp, alarm_ids) as alarms come due, until stop() is called.
+
+        Runs in the calling thread; on_fire is called without the lock held,
+        so it may mutate the schedule.
+        """
+        with self._cond:
+            self._running = True
+        while True:
+            with self._cond:
+                while self._running:
+                    now = self._clock()
+                    due = self._take_due(now)
+                    if due:
+                        break
+                    self._pop_stale()
+                    timeout = MAX_WAIT
+                    if self._heap:
+                        timeout = min(MAX_WAIT, self._heap[0][0] - now)
+                    self._cond.wait(timeout)
+                    self.stats["wakeups"] += 1
+                if not self._running:
+                    return
+            for fire, alarm_ids in due:
+                lateness = round((self._clock() - fire) * 1000, 1)
+                self.stats["fired"] += len(alarm_ids)
+                self.stats["last_lateness_ms"] = lateness
+                self.stats["max_lateness_ms"] = max(self.stats["max_lateness_ms"], lateness)
+                try:
+                    on_fire(fire, alarm_ids)
+                except Exception as e:
+                    print(f"Error in alarm fire callback: {e}")
+
+    def wake(self):
+        """Make the run loop re-check the clock now"""
+        with self._cond:
+            self._cond.notify_all()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
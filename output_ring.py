@@ -0,0 +1,84 @@
+# output_ring.py - Fixed-capacity ring buffer of output lines with sequence numbers
+#
+# Every appended line gets the next sequence number (starting at 1). Readers
+# keep their own cursor (the last sequence they saw) and ask for the lines
+# after it, so any number of consumers can read the same output without
+# taking lines away from each other. Memory is bounded by the capacity; a
+# reader that falls more than `capacity` lines behind is told how many it
+# missed.
+import threading
+
+DEFAULT_CAPACITY = 1000
+
+
+class OutputRing:
+    """Thread-safe ring of (sequence, line) entries with an optional ordered tag per line"""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self._lines = [None] * capacity
+        self._tags = [None] * capacity
+        self._last_seq = 0
+        self._lock = threading.Lock()
+
+    def _first_seq(self):
+        """Oldest sequence still held. Caller must hold the lock."""
+        return max(1, self._last_seq - self.capacity + 1)
+
+    def append(self, line, tag=None):
+        """Store a line and return its sequence number.
+
+        tag is an optional value that never decreases from one line to the
+        next (e.g. a change-feed version), see read_tagged_after().
+        """
+        with self._lock:
+            self._last_seq += 1
+            slot = self._last_seq % self.capacity
+            self._lines[slot] = line
+            self._tags[slot] = tag
+            return self._last_seq
+
+    def last_seq(self):
+        with self._lock:
+            return self._last_seq
+
+    def read_after(self, after=0, limit=None):
+        """Return (lines, last_seq, dropped) for the lines after sequence `after`.
+
+        last_seq is the cursor to pass next time. dropped counts lines that
+        were overwritten before this reader got to them. A cursor ahead of
+        the buffer (e.g. from before a server restart) restarts from the
+        oldest retained line.
+        """
+        with self._lock:
+            if after > self._last_seq or after < 0:
+                after = 0
+            first = self._first_seq()
+            start = after + 1
+            dropped = 0
+            if start < first and self._last_seq:
+                # A fresh reader (after=0) has not missed anything it asked for
+                dropped = first - start if after else 0
+                start = first
+            end = self._last_seq
+            if limit is not None and end - start + 1 > limit:
+                end = start + limit - 1
+            lines = [self._lines[seq % self.capacity] for seq in range(start, end + 1)]
+            return lines, max(end, after), dropped
+
+    def read_tagged_after(self, tag, until=None):
+        """Return the retained lines whose tag is greater than `tag` (and at most `until`)"""
+        with self._lock:
+            lo, hi = self._first_seq(), self._last_seq + 1
+            # Tags are ordered, so binary search for the first newer line
+            while lo < hi:
+                mid = (lo + hi) // 2
+                mid_tag = self._tags[mid % self.capacity]
+                if mid_tag is not None and mid_tag > tag:
+                    hi = mid
+                else:
+                    lo = mid + 1
+            end = self._last_seq
+            while until is not None and end >= lo and self._tags[end % self.capacity] > until:
+                end -= 1
+            return [self._lines[seq % self.capacity] for seq in range(lo, end + 1)]
@@ -4,7 +4,8 @@ import sys
 import os
 import json
 import random
-import threading
+
+import timer_wheel
 
 # Flag to track hardware availability
 HARDWARE_AVAILABLE = False
@@ -106,11 +107,7 @@ def control_component(component, action):
             
             # For buzzer, turn off after a short time
             if component == "buzzer":
-                def turn_off_buzzer():
-                    time.sleep(0.5)
-                    lgpio.gpio_write(h, pin_number, 0)
-                
-                threading.Thread(target=turn_off_buzzer).start()
+                timer_wheel.schedule(0.5, lgpio.gpio_write, h, pin_number, 0)
                 
         elif action == "off":
             lgpio.gpio_write(h, pin_number, 0)
@@ -0,0 +1,142 @@
+# recurrence.py - Repeat rules for alarms
+#
+# An alarm without a "repeat" field rings every day, as it always has. A
+# "repeat" rule narrows the days it rings on; every field is optional and
+# they combine (a day must satisfy all of them):
+#
+#   {"days": [0, 1, 2, 3, 4]}              these weekdays only (0 = Monday)
+#   {"dates": ["2026-12-24"]}              these dates only (one-off alarms)
+#   {"every": 2, "start": "2026-10-01"}    every N days counting from start
+#   {"skip": ["2026-12-25"]}               never on these dates (holidays)
+#
+# Rules are compiled once (weekday bitmask, date sets, day ordinals), so
+# testing a day is a few integer and set operations however long the lists.
+import datetime
+
+WEEKDAY_NAMES = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+MAX_RULE_DATES = 1000
+MAX_EVERY_DAYS = 3660
+
+
+def _parse_date(value):
+    try:
+        return datetime.date.fromisoformat(str(value))
+    except ValueError:
+        raise ValueError(f"invalid date (expected YYYY-MM-DD): {value}")
+
+
+def _parse_weekday(value):
+    if isinstance(value, str) and value[:3].lower() in WEEKDAY_NAMES:
+        return WEEKDAY_NAMES.index(value[:3].lower())
+    day = int(value)
+    if not 0 <= day < 7:
+        raise ValueError(f"invalid weekday: {value}")
+    return day
+
+
+def normalize_rule(rule):
+    """Validate a repeat rule and return its canonical form (None for "every day").
+
+    Raises ValueError on malformed rules. Weekdays may be given as 0-6 or
+    names ("mon", "Tuesday"); dates as YYYY-MM-DD.
+    """
+    if rule is None or rule == {}:
+        return None
+    if not isinstance(rule, dict):
+        raise ValueError("repeat must be an object")
+    unknown = set(rule) - {"days", "dates", "every", "start", "skip"}
+    if unknown:
+        raise ValueError(f"unknown repeat fields: {', '.join(sorted(unknown))}")
+
+    normalized = {}
+    if rule.get("days") is not None:
+        days = sorted({_parse_weekday(day) for day in rule["days"]})
+        if not days:
+            raise ValueError("repeat.days must not be empty")
+        if len(days) < 7:
+            normalized["days"] = days
+    for key in ("dates", "skip"):
+        if rule.get(key):
+            dates = sorted({_parse_date(value) for value in rule[key]})
+            if len(dates) > MAX_RULE_DATES:
+                raise ValueError(f"repeat.{key} holds more than {MAX_RULE_DATES} dates")
+            normalized[key] = [date.isoformat() for date in dates]
+    if rule.get("every") is not None:
+        every = int(rule["every"])
+        if not 1 <= every <= MAX_EVERY_DAYS:
+            raise ValueError(f"repeat.every must be between 1 and {MAX_EVERY_DAYS}")
+        if every > 1:
+            normalized["every"] = every
+            normalized["start"] = _parse_date(rule.get("start") or datetime.date.today()).isoformat()
+    elif rule.get("start") is not None:
+        raise ValueError("repeat.start needs repeat.every")
+    return normalized or None
+
+
+class CompiledRule:
+    """A normalized rule in a form that tests a date in constant time"""
+
+    __slots__ = ("mask", "dates", "sorted_dates", "every", "start", "skip")
+
+    def __init__(self, rule):
+        rule = rule or {}
+        self.mask = 0
+        for day in rule.get("days", range(7)):
+            self.mask |= 1 << day
+        self.sorted_dates = [_parse_date(value) for value in rule.get("dates", ())]
+        self.dates = frozenset(self.sorted_dates) if self.sorted_dates else None
+        self.every = rule.get("every", 1)
+        self.start = _parse_date(rule["start"]).toordinal() if "start" in rule else 0
+        self.skip = frozenset(_parse_date(value) for value in rule.get("skip", ()))
+
+    def occurs_on(self, date):
+        if not self.mask >> date.weekday() & 1:
+            return False
+        if self.dates is not None and date not in self.dates:
+            return False
+        if self.every > 1:
+            offset = date.toordinal() - self.start
+            if offset < 0 or offset % self.every:
+                return False
+        return date not in self.skip
+
+    def next_date(self, date):
+        """First date on or after `date` the rule occurs on, or None if it never will"""
+        if self.dates is not None:
+            # One-off and dated alarms: only the listed dates are candidates
+            for candidate in self.sorted_dates:
+                if candidate >= date and self.occurs_on(candidate):
+                    return candidate
+            return None
+        if self.every > 1 and date.toordinal() < self.start:
+            date = datetime.date.fromordinal(self.start)
+        # Weekdays of every-N days repeat within 7 steps; each skipped date costs one more cycle
+        for _ in range(7 * self.every * (len(self.skip) + 1) + 1):
+            if self.occurs_on(date):
+                return date
+            date += datetime.timedelta(days=1)
+        return None
+
+
+EVERY_DAY = CompiledRule(None)
+
+
+def compile_rule(rule):
+    """CompiledRule for a normalized rule (shared instance for "every day")"""
+    return CompiledRule(rule) if rule else EVERY_DAY
+
+
+def describe(rule):
+    """Short human-readable summary of a rule"""
+    if not rule:
+        return "every day"
+    parts = []
+    if "days" in rule:
+        parts.append(",".join(WEEKDAY_NAMES[day] for day in rule["days"]))
+    if "every" in rule:
+        parts.append(f"every {rule['every']} days from {rule['start']}")
+    if "dates" in rule:
+        parts.append("on " + ", ".join(rule["dates"]))
+    if "skip" in rule:
+        parts.append(f"except {len(rule['skip'])} dates")
+    return "; ".join(parts)
@@ -0,0 +1,166 @@
+# sampling_policy.py - Sensor sampling rates that follow the alarm schedule
+#
+# Nobody needs the sensors at full rate at 2 pm when the next alarm is at
+# 7 am. The policy puts the clock in one of three phases:
+#
+#   idle    no alarm within RAMP_SECONDS: slow or no sampling
+#   ramp    an alarm (or a snoozed one) rings within RAMP_SECONDS
+#   active  an alarm is ringing: full rate for the wake-up challenge
+#
+# and gives every sensor a period per phase (None: not sampled at all).
+# Idle periods are shorter than RAMP_SECONDS, so every sensor is back at
+# its ramp rate before the alarm rings.
+#
+# Every read is recorded with its CPU time. The policy also tracks how many
+# reads the previous fixed schedule would have made over the same time, and
+# from that the reads, I2C/GPIO transactions and CPU time saved. Set
+# ALARM_SAMPLING=fixed to sample at the fixed rates for comparison.
+import os
+import threading
+import time
+
+RAMP_SECONDS = float(os.environ.get('ALARM_SAMPLING_RAMP_SECONDS', '900'))
+ADAPTIVE = os.environ.get('ALARM_SAMPLING', 'adaptive').lower() != 'fixed'
+# How often a sensor switched off in the current phase looks again
+RECHECK_SECONDS = 30
+PHASE_CACHE_SECONDS = 1
+
+# Per sensor: bus transactions per read, the fixed period it used to be
+# sampled at, and the period per phase
+SENSORS = {
+    # DHT11, bit-banged on one GPIO line; the room temperature changes slowly
+    "weather": {"gpio": 1, "i2c": 0, "fixed": 60, "idle": 600, "ramp": 60, "active": 60},
+    # HC-SR04 trigger/echo, for the distance challenge and its display
+    "distance": {"gpio": 1, "i2c": 0, "fixed": 1, "idle": None, "ramp": 5, "active": 1},
+    # MPU6050 acceleration and rotation block reads
+    "movement": {"gpio": 0, "i2c": 2, "fixed": 1, "idle": None, "ramp": 5, "active": 1},
+    # Full snapshot for web clients (DHT11 + HC-SR04 + MPU6050)
+    "web": {"gpio": 2, "i2c": 2, "fixed": 2, "idle": 30, "ramp": 5, "active": 2},
+}
+
+
+class SamplingPolicy:
+    """Per-sensor periods from the alarm schedule, and what they saved"""
+
+    def __init__(self, next_alarm, alarm_state, clock=time.time):
+        self._next_alarm = next_alarm    # () -> timestamp of the next alarm, or None
+        self._alarm_state = alarm_state  # () -> the shared alarm state dict
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._phase = None
+        self._phase_at = 0.0
+        self._cache = {}  # sensor -> (taken at, value), see cached()
+        self._stats = {name: {"reads": 0, "fixed_reads": 0.0, "cpu_s": 0.0} for name in SENSORS}
+
+    def phase(self, now=None):
+        """"idle", "ramp" or "active" (re-evaluated at most once a second)"""
+        now = self._clock() if now is None else now
+        with self._lock:
+            if self._phase is not None and now - self._phase_at < PHASE_CACHE_SECONDS:
+                return self._phase
+        try:
+            state = self._alarm_state() or {}
+            if state.get("alarm_active"):
+                phase = "active"
+            else:
+                upcoming = [at for at in (self._next_alarm(), state.get("snoozed_until"))
+                            if at is not None and at >= now]
+                phase = "ramp" if upcoming and min(upcoming) - now <= RAMP_SECONDS else "idle"
+        except Exception as e:
+            print(f"Sampling policy: cannot evaluate the schedule ({e}), sampling at full rate")
+            phase = "active"
+        with self._lock:
+            self._phase, self._phase_at = phase, now
+        return phase
+
+    def period(self, sensor, now=None, phase=None):
+        """Seconds until the next read of a sensor (None: do not read it now)"""
+        if not ADAPTIVE:
+            return SENSORS[sensor]["fixed"]
+        return SENSORS[sensor][phase or self.phase(now)]
+
+    def record(self, sensor, cpu_seconds, period):
+        """Account for one read, followed by `period` seconds without one"""
+        fixed = SENSORS[sensor]["fixed"]
+        with self._lock:
+            stats = self._stats[sensor]
+            stats["reads"] += 1
+            stats["cpu_s"] += cpu_seconds
+            stats["fixed_reads"] += (period or RECHECK_SECONDS) / fixed
+
+    def skip(self, sensor, seconds=RECHECK_SECONDS):
+        """Account for `seconds` without a read where the fixed schedule would have read"""
+        with self._lock:
+            self._stats[sensor]["fixed_reads"] += seconds / SENSORS[sensor]["fixed"]
+
+    def sample(self, sensor, read, phase=None):
+        """Call read() for a sensor, recording it. Returns (value, seconds until the next read).
+
+        phase overrides the one from the schedule (e.g. "active" for the
+        challenge, which starts before the shared state says it rings).
+        """
+        cpu_started = time.thread_time()
+        value = read()
+        period = self.period(sensor, phase=phase)
+        self.record(sensor, time.thread_time() - cpu_started, period)
+        return value, period
+
+    def cached(self, sensor, read):
+        """read()'s last value while it is younger than the sensor's period, else a fresh one.
+
+        Lets any number of clients poll without multiplying the hardware reads.
+        Returns (value, period).
+        """
+        now = self._clock()
+        period = self.period(sensor, now) or RECHECK_SECONDS
+        with self._lock:
+            hit = self._cache.get(sensor)
+        if hit is not None and now - hit[0] < period:
+            return hit[1], period
+        value, period = self.sample(sensor, read)
+        with self._lock:
+            self._cache[sensor] = (now, value)
+        return value, period or RECHECK_SECONDS
+
+    def last(self, sensor):
+        """Last value cached() holds for a sensor, or None"""
+        with self._lock:
+            hit = self._cache.get(sensor)
+        return hit[1] if hit is not None else None
+
+    def snapshot(self):
+        """Phase, periods and per-sensor reads/transactions/CPU against the fixed schedule"""
+        phase = self.phase()
+        periods = {name: self.period(name) for name in SENSORS}
+        sensors = {}
+        totals = {"reads": 0, "saved_reads": 0, "i2c_transactions": 0, "saved_i2c_transactions": 0,
+                  "gpio_transactions": 0, "saved_gpio_transactions": 0, "cpu_ms": 0.0, "saved_cpu_ms": 0.0}
+        with self._lock:
+            for name, stats in self._stats.items():
+                spec = SENSORS[name]
+                reads = stats["reads"]
+                fixed_reads = int(stats["fixed_reads"])
+                saved = fixed_reads - reads
+                cpu_per_read = stats["cpu_s"] / reads if reads else 0.0
+                entry = {
+                    "period_s": periods[name],
+                    "fixed_period_s": spec["fixed"],
+                    "reads": reads,
+                    "fixed_schedule_reads": fixed_reads,
+                    "saved_reads": saved,
+                    "i2c_transactions": reads * spec["i2c"],
+                    "saved_i2c_transactions": saved * spec["i2c"],
+                    "gpio_transactions": reads * spec["gpio"],
+                    "saved_gpio_transactions": saved * spec["gpio"],
+                    "cpu_ms": round(stats["cpu_s"] * 1000, 1),
+                    "cpu_ms_per_read": round(cpu_per_read * 1000, 3),
+                    # Estimated at the measured cost of a read
+                    "saved_cpu_ms": round(saved * cpu_per_read * 1000, 1)
+                }
+                sensors[name] = entry
+                for key in totals:
+                    totals[key] += entry[key]
+        totals["cpu_ms"] = round(totals["cpu_ms"], 1)
+        totals["saved_cpu_ms"] = round(totals["saved_cpu_ms"], 1)
+        return {"adaptive": ADAPTIVE, "phase": phase, "ramp_seconds": RAMP_SECONDS,
+                "sensors": sensors, "totals": totals}
@@ -0,0 +1,179 @@
+# shared_state.py - The alarm state in a shared memory segment, guarded by a seqlock
+#
+# Every process maps the same SEGMENT_SIZE file (in /dev/shm, i.e. RAM,
+# when there is one):
+#
+#   magic, layout, seq, timestamp, active, message length, extra length,
+#   crc32 (of the timestamp, flag, lengths and body)
+#   message (UTF-8, at most MESSAGE_MAX bytes)
+#   extra fields (JSON: snooze details, trace, ...)
+#
+# A writer takes an exclusive flock, makes seq odd, writes the record and
+# makes seq even again. A reader takes no lock: it copies the record and
+# retries if seq was odd or moved while it copied (the crc32 also catches
+# a torn copy, whatever order the CPU made the stores visible in). When seq
+# has not moved since its last read, a reader returns the state it already
+# decoded, so the per-second polls are one 8-byte read.
+#
+# The segment does not survive a reboot. The storage backend's state
+# (alarm_state.json or the SQLite state row) is kept as a checkpoint to
+# recover from; see alarm_state.py.
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single process is assumed
+    fcntl = None
+
+DEFAULT_SEGMENT = ("/dev/shm/alarm_state.shm" if os.path.isdir("/dev/shm")
+                   else os.path.join(tempfile.gettempdir(), "alarm_state.shm"))
+SEGMENT_FILE = os.environ.get('ALARM_STATE_SEGMENT', DEFAULT_SEGMENT)
+SEGMENT_SIZE = 4096
+MAGIC = b"ALST"
+LAYOUT = 1
+HEADER = struct.Struct("<4sIQdB3xIII")
+SEQ = struct.Struct("<Q")
+CHECKED = struct.Struct("<dBII")  # header fields covered by the crc32, with the body
+SEQ_OFFSET = 8
+MESSAGE_MAX = 512
+EXTRA_MAX = SEGMENT_SIZE - HEADER.size - MESSAGE_MAX
+READ_RETRIES = 1000
+
+
+def _encode(state):
+    """(timestamp, active, message bytes, extra bytes) for a state dict"""
+    message = str(state.get("message") or "").encode("utf-8")
+    if len(message) > MESSAGE_MAX:
+        message = message[:MESSAGE_MAX].decode("utf-8", "ignore").encode("utf-8")
+    extra = {key: value for key, value in state.items()
+             if key not in ("alarm_active", "timestamp", "message")}
+    extra = json.dumps(extra, separators=(",", ":")).encode("utf-8") if extra else b""
+    if len(extra) > EXTRA_MAX:
+        raise ValueError(f"alarm state extra fields take {len(extra)} bytes (at most {EXTRA_MAX})")
+    return float(state.get("timestamp") or 0), bool(state.get("alarm_active")), message, extra
+
+
+class SharedState:
+    """One mapped state segment"""
+
+    def __init__(self, path=SEGMENT_FILE):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+        if os.fstat(self._fd).st_size < SEGMENT_SIZE:
+            os.ftruncate(self._fd, SEGMENT_SIZE)
+        self._map = mmap.mmap(self._fd, SEGMENT_SIZE)
+        self._write_lock = threading.Lock()
+        self._read_lock = threading.Lock()  # guards the decoded-state cache only
+        self._seq = None
+        self._state = None
+        self.stats = {"reads": 0, "unchanged_reads": 0, "read_retries": 0, "writes": 0}
+
+    def initialized(self):
+        return self._map[:4] == MAGIC
+
+    def initialize(self, state):
+        """Write the first state into a fresh segment (no-op if another process already did)"""
+        with self._exclusive():
+            if not self.initialized():
+                self._write(state)
+                return True
+        return False
+
+    def seq(self):
+        """Sequence number: changes on every write, odd while one is in progress"""
+        return SEQ.unpack_from(self._map, SEQ_OFFSET)[0]
+
+    def read(self):
+        """The current state as a dict (a copy; decoded again only after a write)"""
+        self.stats["reads"] += 1
+        for _ in range(READ_RETRIES):
+            seq = self.seq()
+            with self._read_lock:
+                if seq == self._seq:
+                    self.stats["unchanged_reads"] += 1
+                    return dict(self._state)
+            if seq & 1:
+                self.stats["read_retries"] += 1
+                time.sleep(0)
+                continue
+            header = self._map[:HEADER.size]
+            magic, layout, seen, timestamp, active, message_length, extra_length, crc = HEADER.unpack(header)
+            if magic != MAGIC or layout != LAYOUT:
+                if self.seq() == seq:
+                    raise ValueError(f"{self.path} is not an alarm state segment")
+                self.stats["read_retries"] += 1
+                continue
+            if message_length > MESSAGE_MAX or extra_length > EXTRA_MAX:
+                self.stats["read_retries"] += 1
+                continue
+            start = HEADER.size
+            body = self._map[start:start + message_length + extra_length]
+            checked = CHECKED.pack(timestamp, active, message_length, extra_length)
+            if seen != seq or self.seq() != seq or zlib.crc32(body, zlib.crc32(checked)) != crc:
+                self.stats["read_retries"] += 1
+                time.sleep(0)
+                continue
+            state = {"alarm_active": bool(active), "timestamp": timestamp,
+                     "message": body[:message_length].decode("utf-8")}
+            if extra_length:
+                state.update(json.loads(body[message_length:]))
+            with self._read_lock:
+                self._seq, self._state = seq, state
+            return dict(state)
+        raise TimeoutError(f"no consistent read of {self.path} after {READ_RETRIES} attempts")
+
+    def write(self, state):
+        """Publish a new state to every process mapping the segment"""
+        with self._exclusive():
+            self._write(state)
+
+    def _write(self, state):
+        """Caller must hold the exclusive lock"""
+        timestamp, active, message, extra = _encode(state)
+        body = message + extra
+        seq = self.seq()
+        # Odd while writing; a writer that died mid-write left it odd already
+        seq = seq + 1 if seq % 2 == 0 else seq
+        self._set_seq(seq)
+        self._map[HEADER.size:HEADER.size + len(body)] = body
+        crc = zlib.crc32(body, zlib.crc32(CHECKED.pack(timestamp, active, len(message), len(extra))))
+        header = HEADER.pack(MAGIC, LAYOUT, seq, timestamp, active, len(message), len(extra), crc)
+        # Copied around seq, not pack_into(): that zero-fills the header first
+        self._map[:SEQ_OFFSET] = header[:SEQ_OFFSET]
+        self._map[SEQ_OFFSET + SEQ.size:HEADER.size] = header[SEQ_OFFSET + SEQ.size:]
+        self._set_seq(seq + 1)
+        self.stats["writes"] += 1
+
+    def _set_seq(self, seq):
+        self._map[SEQ_OFFSET:SEQ_OFFSET + SEQ.size] = SEQ.pack(seq)
+
+    def _exclusive(self):
+        return _SegmentLock(self)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+class _SegmentLock:
+    """Writers' lock: the thread lock, plus an flock between processes"""
+
+    def __init__(self, segment):
+        self._segment = segment
+
+    def __enter__(self):
+        self._segment._write_lock.acquire()
+        if fcntl is not None:
+            fcntl.flock(self._segment._fd, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self._segment._fd, fcntl.LOCK_UN)
+        self._segment._write_lock.release()
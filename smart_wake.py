@@ -0,0 +1,238 @@
+# smart_wake.py - Ring early inside a wake window when sleep turns light
+#
+# An alarm may carry "wake_window": a number of minutes before its time
+# during which it may ring early. "07:00:00" with a 30 minute window means
+# "wake me between 06:30 and 07:00 at the lightest moment". The alarm time
+# stays the deadline: if no light sleep is seen, it rings then as usual.
+#
+# Light sleep is estimated the way actigraphy does it. The MPU6050 on the
+# bed frame is read SAMPLE_HZ times a second; a sample "moves" when the
+# change in acceleration or rotation since the previous one crosses a
+# threshold. Moving samples are counted per EPOCH_SECONDS epoch, and sleep
+# is considered light when enough of the last few epochs were active. Each
+# sample costs two 6-byte I2C reads and a handful of integer operations,
+# and nothing is buffered beyond the last few epoch counts, so the sampler
+# can run all night at a fraction of a percent of one core (see the
+# cpu_percent stat).
+#
+# The sampler only runs while at least one active alarm has a wake window.
+import collections
+import os
+import threading
+import time
+
+from next_fire import next_fire_time
+from recurrence import compile_rule
+
+SAMPLE_HZ = float(os.environ.get('ALARM_WAKE_SAMPLE_HZ', '10'))
+EPOCH_SECONDS = 30
+# Raw sensor units per sample: ~0.04 g at +/-2 g, ~3 deg/s at +/-250 deg/s
+ACCEL_DELTA_THRESHOLD = int(os.environ.get('ALARM_WAKE_ACCEL_THRESHOLD', '600'))
+GYRO_DELTA_THRESHOLD = int(os.environ.get('ALARM_WAKE_GYRO_THRESHOLD', '400'))
+# An epoch is active with this many moving samples; sleep is light when
+# LIGHT_SLEEP_EPOCHS of the last RECENT_EPOCHS epochs were active
+EPOCH_ACTIVE_SAMPLES = 3
+RECENT_EPOCHS = 4
+LIGHT_SLEEP_EPOCHS = 2
+WAKE_WINDOW_MAX_MINUTES = 120
+
+
+def normalize_wake_window(value):
+    """Wake window in whole minutes (None for no window). Raises ValueError when out of range."""
+    if value is None or value == "":
+        return None
+    minutes = int(value)
+    if not 0 <= minutes <= WAKE_WINDOW_MAX_MINUTES:
+        raise ValueError(f"wake_window must be between 0 and {WAKE_WINDOW_MAX_MINUTES} minutes")
+    return minutes or None
+
+
+class ActivityEstimator:
+    """Moving-sample counts per epoch over a stream of (accel, gyro) samples"""
+
+    def __init__(self, epoch_samples):
+        self.epoch_samples = epoch_samples
+        self.epochs = collections.deque(maxlen=RECENT_EPOCHS)  # counts of the last full epochs
+        self.reset()
+
+    def reset(self):
+        """Forget the stream (after a pause in sampling)"""
+        self._last_accel = None
+        self._last_gyro = None
+        self._samples = 0
+        self._moving = 0
+        self.epochs.clear()
+
+    def add(self, accel, gyro):
+        """Fold in one sample. Returns the epoch's count when it closes an epoch, else None."""
+        last_accel, last_gyro = self._last_accel, self._last_gyro
+        self._last_accel, self._last_gyro = accel, gyro
+        if last_accel is not None:
+            # Differences, not magnitudes: gravity and gyro bias cancel out
+            if (abs(accel[0] - last_accel[0]) + abs(accel[1] - last_accel[1])
+                    + abs(accel[2] - last_accel[2]) > ACCEL_DELTA_THRESHOLD
+                    or abs(gyro[0] - last_gyro[0]) + abs(gyro[1] - last_gyro[1])
+                    + abs(gyro[2] - last_gyro[2]) > GYRO_DELTA_THRESHOLD):
+                self._moving += 1
+        self._samples += 1
+        if self._samples < self.epoch_samples:
+            return None
+        count = self._moving
+        self.epochs.append(count)
+        self._samples = self._moving = 0
+        return count
+
+    def light_sleep(self):
+        """Whether enough recent epochs were active to call sleep light"""
+        active = sum(1 for count in self.epochs if count >= EPOCH_ACTIVE_SAMPLES)
+        return active >= LIGHT_SLEEP_EPOCHS
+
+
+class SmartWake:
+    """Wake windows of the active alarms, and the sampler that may ring them early"""
+
+    def __init__(self, read_sample=None, alarms=(), clock=time.time):
+        self._read_sample = read_sample  # () -> (accel, gyro); None without a sensor
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self._woken = {}  # id -> deadline it was rung early for
+        self.estimator = ActivityEstimator(max(1, round(SAMPLE_HZ * EPOCH_SECONDS)))
+        self.stats = {"samples": 0, "read_errors": 0, "late_samples": 0, "epochs": 0,
+                      "light_epochs": 0, "early_wakes": 0, "cpu_percent": 0.0, "last_epochs": []}
+        self.rebuild(alarms)
+
+    def rebuild(self, alarms):
+        """Reload the windows from a whole list (after a load or a full replace)"""
+        with self._cond:
+            self._windows = {}  # id -> (HH:MM:SS, minutes, compiled rule)
+            for alarm in alarms:
+                self._add(alarm)
+            self._cond.notify_all()
+
+    def _add(self, alarm):
+        """Caller must hold the lock"""
+        self._windows.pop(alarm["id"], None)
+        if not alarm["active"] or not alarm.get("wake_window"):
+            return
+        try:
+            self._windows[alarm["id"]] = (alarm["time"], int(alarm["wake_window"]),
+                                          compile_rule(alarm.get("repeat")))
+        except (ValueError, AttributeError, TypeError):
+            print(f"Warning: ignoring wake window of alarm {alarm['id']} ({alarm.get('wake_window')!r})")
+
+    def apply(self, changes):
+        """Apply ("insert"/"update"/"delete") change hints"""
+        with self._cond:
+            for change in changes:
+                if change[0] == "insert":
+                    self._add(change[1])
+                elif change[0] == "update":
+                    self._add(change[2])
+                elif change[0] == "delete":
+                    self._windows.pop(change[1], None)
+                    self._woken.pop(change[1], None)
+            self._cond.notify_all()
+
+    def open_windows(self, now=None):
+        """(alarm id, deadline timestamp) of every wake window open at `now`"""
+        now = self._clock() if now is None else now
+        with self._cond:
+            windows = list(self._windows.items())
+        opened = []
+        for alarm_id, (alarm_time, minutes, rule) in windows:
+            deadline = next_fire_time(alarm_time, now, rule)
+            if deadline is not None and deadline - minutes * 60 <= now:
+                opened.append((alarm_id, deadline))
+        return opened
+
+    def woke_early(self, alarm_id, deadline):
+        """Whether this occurrence of the alarm already rang inside its window"""
+        with self._cond:
+            return self._woken.get(alarm_id) == deadline
+
+    # -- sampler ---------------------------------------------------------
+
+    def start(self, on_wake, on_epoch=None):
+        """Sample in a daemon thread, calling on_wake(alarm id, deadline, epoch counts).
+
+        on_wake returns whether it rang; the deadline of an alarm it rang is
+        then skipped (see woke_early). on_epoch(stats) runs after every epoch.
+        Does nothing without a sensor: every alarm then rings at its deadline.
+        """
+        if self._read_sample is None or self._thread is not None:
+            return False
+        self._on_wake = on_wake
+        self._on_epoch = on_epoch
+        self._thread = threading.Thread(target=self._run, name="smart-wake", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    def _run(self):
+        period = 1.0 / SAMPLE_HZ
+        while not self._stop.is_set():
+            with self._cond:
+                if not self._windows:
+                    # Nothing to watch for: sleep until a window is added
+                    self.estimator.reset()
+                    self._cond.wait()
+                    continue
+            epoch_started = time.monotonic()
+            cpu_started = time.thread_time()
+            next_sample = epoch_started
+            count = None
+            while count is None and not self._stop.is_set():
+                try:
+                    accel, gyro = self._read_sample()
+                except Exception as e:
+                    self.stats["read_errors"] += 1
+                    if self.stats["read_errors"] % 100 == 1:
+                        print(f"Smart wake: sensor read failed: {e}")
+                else:
+                    self.stats["samples"] += 1
+                    count = self.estimator.add(accel, gyro)
+                next_sample += period
+                delay = next_sample - time.monotonic()
+                if delay < 0:
+                    # Fell behind (busy bus, suspended host): restart the cadence
+                    self.stats["late_samples"] += 1
+                    next_sample = time.monotonic()
+                elif count is None:
+                    self._stop.wait(delay)
+            if count is not None:
+                elapsed = time.monotonic() - epoch_started
+                if elapsed > 0:
+                    self.stats["cpu_percent"] = round(100 * (time.thread_time() - cpu_started) / elapsed, 3)
+                self._end_epoch()
+                self._stop.wait(max(0.0, next_sample - time.monotonic()))
+
+    def _end_epoch(self):
+        """Ring the alarms whose window is open if sleep has turned light"""
+        self.stats["epochs"] += 1
+        self.stats["last_epochs"] = list(self.estimator.epochs)
+        light = self.estimator.light_sleep()
+        if light:
+            self.stats["light_epochs"] += 1
+            for alarm_id, deadline in self.open_windows():
+                if self.woke_early(alarm_id, deadline):
+                    continue
+                try:
+                    rang = self._on_wake(alarm_id, deadline, list(self.estimator.epochs))
+                except Exception as e:
+                    print(f"Smart wake: error ringing alarm {alarm_id}: {e}")
+                    continue
+                if rang:
+                    with self._cond:
+                        self._woken[alarm_id] = deadline
+                    self.stats["early_wakes"] += 1
+        if self._on_epoch is not None:
+            try:
+                self._on_epoch(self.stats)
+            except Exception as e:
+                print(f"Smart wake: error publishing stats: {e}")
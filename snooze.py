@@ -0,0 +1,119 @@
+# snooze.py - Snooze, dismiss and auto-stop for a ringing alarm
+#
+# Snoozing silences the alarm and records in the shared alarm state when it
+# rings again ("snoozed_until") and how many times it has been snoozed
+# ("snooze_count"). The process that handled the snooze arms the re-fire on
+# its timer wheel; when the timer fires it only rings again if the state
+# still carries the same snoozed_until, so a dismiss or a newer snooze from
+# any process (web, GUI, MQTT) quietly supersedes it. Past the repeat limit
+# a snooze dismisses instead.
+#
+# The process driving the hardware arms an auto-stop when the alarm starts
+# ringing, which snoozes (or, past the limit, dismisses) an alarm nobody
+# answers.
+#
+# The id of the alarm that rang ("alarm_id") and when it first rang
+# ("fired_at") are carried through snoozes, so a dismissal is recorded in
+# the history (see alarm_history.py) with the time it took from the first ring.
+import os
+import threading
+import time
+
+import alarm_history
+import alarm_state
+import timer_wheel
+
+SNOOZE_MINUTES = float(os.environ.get('ALARM_SNOOZE_MINUTES', '9'))
+SNOOZE_MAX_MINUTES = 60
+SNOOZE_MAX_REPEATS = int(os.environ.get('ALARM_SNOOZE_MAX_REPEATS', '3'))
+AUTO_STOP_SECONDS = float(os.environ.get('ALARM_AUTO_STOP_SECONDS', '300'))
+
+_lock = threading.Lock()
+_refire_timer = None
+_auto_stop_timer = None
+
+
+def _cancel(timer):
+    if timer is not None:
+        timer.cancel()
+
+
+def _ringing(state):
+    """alarm_id/fired_at of the ringing (or snoozed) alarm, to carry into the next state"""
+    return {key: state[key] for key in ("alarm_id", "fired_at") if state.get(key) is not None}
+
+
+def snooze(minutes=None, reason="Alarm snoozed", automatic=False):
+    """Silence the ringing alarm and ring again in `minutes` (default SNOOZE_MINUTES).
+
+    Returns the new state, or None when no alarm is ringing (e.g. the same
+    request was already handled by another process). Raises ValueError for
+    a duration outside 0 < minutes <= SNOOZE_MAX_MINUTES.
+    """
+    global _refire_timer
+    minutes = SNOOZE_MINUTES if minutes is None else float(minutes)
+    if not 0 < minutes <= SNOOZE_MAX_MINUTES:
+        raise ValueError(f"snooze duration must be between 0 and {SNOOZE_MAX_MINUTES} minutes")
+
+    state = alarm_state.get_state()
+    if not state.get("alarm_active"):
+        return None
+    count = state.get("snooze_count", 0)
+    if count >= SNOOZE_MAX_REPEATS:
+        return dismiss(f"Dismissed after {count} snoozes", automatic=True)
+
+    until = round(time.time() + minutes * 60, 3)
+    ring_at = time.strftime('%H:%M:%S', time.localtime(until))
+    with _lock:
+        _cancel(_auto_stop_timer)
+        _cancel(_refire_timer)
+        alarm_state.set_state(False, f"{reason} until {ring_at}",
+                              snoozed_until=until, snooze_count=count + 1, **_ringing(state))
+        _refire_timer = timer_wheel.schedule(until - time.time(), _refire, until)
+    alarm_history.record(alarm_history.SNOOZE, state.get("alarm_id"), minutes,
+                         alarm_history.FLAG_AUTOMATIC if automatic else 0)
+    print(f"Alarm snoozed until {ring_at} ({count + 1}/{SNOOZE_MAX_REPEATS})")
+    return alarm_state.get_state()
+
+
+def dismiss(message="Alarm dismissed", automatic=False):
+    """Stop the alarm for good, cancelling any pending re-fire. Returns the new state."""
+    state = alarm_state.get_state()
+    with _lock:
+        _cancel(_auto_stop_timer)
+        _cancel(_refire_timer)
+        alarm_state.set_state(False, message)
+    # Only an alarm still ringing or snoozed is dismissed (the state forgets it here)
+    if state.get("fired_at") and (state.get("alarm_active") or state.get("snoozed_until")):
+        alarm_history.record(alarm_history.DISMISS, state.get("alarm_id"), time.time() - state["fired_at"],
+                             alarm_history.FLAG_AUTOMATIC if automatic else 0)
+    return alarm_state.get_state()
+
+
+def _refire(until):
+    """Ring again, unless the snooze was superseded since it was armed"""
+    state = alarm_state.get_state()
+    if state.get("alarm_active") or state.get("snoozed_until") != until:
+        return
+    alarm_state.set_state(True, "Snoozed alarm ringing again",
+                          snooze_count=state.get("snooze_count", 0), **_ringing(state))
+
+
+def arm_auto_stop(seconds=None):
+    """Snooze the alarm automatically if it is still ringing after `seconds`"""
+    global _auto_stop_timer
+    seconds = AUTO_STOP_SECONDS if seconds is None else seconds
+    with _lock:
+        _cancel(_auto_stop_timer)
+        _auto_stop_timer = timer_wheel.schedule(seconds, _auto_stop)
+
+
+def cancel_auto_stop():
+    with _lock:
+        _cancel(_auto_stop_timer)
+
+
+def _auto_stop():
+    if alarm_state.get_state().get("alarm_active"):
+        print("Alarm not answered, stopping it")
+        snooze(reason="Alarm stopped automatically", automatic=True)
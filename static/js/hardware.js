@@ -332,6 +332,12 @@ function initializeHardwareMQTT() {
                 
                 // Request initial sensor data
                 requestSensorDataMQTT();
+                
+                // MQTT came up after we settled for the event stream: switch over
+                if (sensorEventsAttached) {
+                    stopSensorEvents();
+                    startSensorUpdates();
+                }
             },
             onFailure: function(responseObject) {
                 console.error("Failed to connect to hardware MQTT broker:", responseObject.errorMessage);
@@ -359,12 +365,21 @@ function requestSensorDataMQTT() {
     }
 }
 
+let sensorEventsAttached = false;
+let sensorEventHandler = null;
+
 function startSensorUpdates() {
     // Clear any existing interval
     if (sensorUpdateInterval) {
         clearInterval(sensorUpdateInterval);
     }
     
+    // Without MQTT, let the server push snapshots over /events instead of polling
+    if (window.EventSource && !(mqttHardwareClient && mqttHardwareClient.isConnected())) {
+        startSensorEvents();
+        return;
+    }
+    
     // Initial update
     updateSensorData();
     
@@ -372,6 +387,48 @@ function startSensorUpdates() {
     sensorUpdateInterval = setInterval(updateSensorData, 2000);
 }
 
+function startSensorEvents() {
+    if (sensorEventsAttached) {
+        return;
+    }
+    sensorEventsAttached = true;
+    
+    // Shared with script.js so a page opens a single stream
+    if (!window.alarmEvents) {
+        window.alarmEvents = new EventSource('/events');
+    }
+    const events = window.alarmEvents;
+    
+    sensorEventHandler = function(e) {
+        try {
+            const data = JSON.parse(e.data);
+            updateSensorDisplay(data);
+            sensorData = data;
+        } catch (error) {
+            console.error("Error processing sensor event:", error);
+        }
+    };
+    events.addEventListener('sensor', sensorEventHandler);
+    
+    events.addEventListener('error', function() {
+        if (events.readyState === EventSource.CLOSED) {
+            // The stream is gone for good: go back to HTTP polling
+            console.error("Sensor event stream closed, falling back to HTTP polling");
+            sensorEventsAttached = false;
+            window.alarmEvents = null;
+            updateSensorData();
+            sensorUpdateInterval = setInterval(updateSensorData, 2000);
+        }
+    });
+}
+
+function stopSensorEvents() {
+    if (sensorEventsAttached && window.alarmEvents) {
+        window.alarmEvents.removeEventListener('sensor', sensorEventHandler);
+    }
+    sensorEventsAttached = false;
+}
+
 function updateSensorData() {
     // If we have MQTT connection, use that instead
     if (mqttHardwareClient && mqttHardwareClient.isConnected()) {
@@ -385,6 +442,9 @@ function updateSensorData() {
         .then(data => {
             updateSensorDisplay(data);
             sensorData = data;
+            if (typeof adaptSensorPolling === 'function') {
+                adaptSensorPolling(data.poll_interval);
+            }
         })
         .catch(error => {
             console.error("Error fetching sensor data:", error);
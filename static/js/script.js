@@ -3,6 +3,7 @@ let mqttClient = null;
 let alarmNotificationShown = false;
 let hardwareAvailable = false;
 let sensorUpdateInterval = null;
+let sensorPollSeconds = 2;
 
 document.addEventListener('DOMContentLoaded', function() {
     // Elements
@@ -173,28 +174,24 @@ function initializeMQTT() {
                     }
                     break;
                     
+                case "alarm/changes":
+                    // Deltas keyed by alarm id: no need to re-request the list
+                    if (payload && Array.isArray(payload.changes)) {
+                        applyAlarmDelta(currentAlarms, payload.changes);
+                        updateAlarmList(currentAlarms);
+                    }
+                    break;
+                    
                 case "alarm/added":
                     appendOutput(payload.message || "Alarm added");
-                    // Request updated list
-                    const listRequestMsg = new Paho.MQTT.Message("{}");
-                    listRequestMsg.destinationName = "alarm/request/list";
-                    mqttClient.send(listRequestMsg);
                     break;
                     
                 case "alarm/deleted":
                     appendOutput(payload.message || "Alarm deleted");
-                    // Request updated list
-                    const deleteListMsg = new Paho.MQTT.Message("{}");
-                    deleteListMsg.destinationName = "alarm/request/list";
-                    mqttClient.send(deleteListMsg);
                     break;
                     
                 case "alarm/toggled":
                     appendOutput(payload.message || "Alarm toggled");
-                    // Request updated list
-                    const toggleListMsg = new Paho.MQTT.Message("{}");
-                    toggleListMsg.destinationName = "alarm/request/list";
-                    mqttClient.send(toggleListMsg);
                     break;
                     
                 case "alarm/state":
@@ -230,6 +227,7 @@ function initializeMQTT() {
                 
                 // Subscribe to topics
                 mqttClient.subscribe("alarm/list");
+                mqttClient.subscribe("alarm/changes");
                 mqttClient.subscribe("alarm/added");
                 mqttClient.subscribe("alarm/deleted");
                 mqttClient.subscribe("alarm/toggled");
@@ -270,24 +268,145 @@ function initializeMQTT() {
 }
 
 function startHttpPolling() {
-    console.log("Starting HTTP polling as fallback");
-    appendOutput("Starting HTTP polling as fallback");
+    // Prefer the Server-Sent Events stream; long-polling is the last resort
+    if (window.EventSource) {
+        startEventStream();
+        return;
+    }
     
-    // Update alarm list every 5 seconds
-    setInterval(loadAlarms, 5000);
+    console.log("Starting HTTP long-polling as fallback");
+    appendOutput("Starting HTTP long-polling as fallback");
     
-    // Check alarm state every second
-    setInterval(checkAlarmState, 1000);
+    // A single request waits on the server until alarms, state or output change
+    pollChanges(null);
+}
+
+// Alarm list currently displayed, kept in sync from snapshots and deltas
+let currentAlarms = [];
+let streamAlarmsVersion = 0;
+
+// One /events connection shared with hardware.js
+function getEventStream() {
+    if (!window.alarmEvents) {
+        window.alarmEvents = new EventSource('/events');
+    }
+    return window.alarmEvents;
+}
+
+function startEventStream() {
+    console.log("Starting Server-Sent Events stream as fallback");
+    appendOutput("Starting Server-Sent Events stream as fallback");
     
-    // Get output every 500ms
-    setInterval(pollOutput, 500);
+    const events = getEventStream();
+    
+    // Sent on every (re)connect and whenever the server could not deliver a delta
+    events.addEventListener('alarms', function(e) {
+        const data = JSON.parse(e.data);
+        streamAlarmsVersion = data.version;
+        updateAlarmList(data.alarms);
+    });
+    
+    events.addEventListener('alarm_delta', function(e) {
+        const data = JSON.parse(e.data);
+        if (data.version <= streamAlarmsVersion) {
+            return; // Already part of the snapshot
+        }
+        streamAlarmsVersion = data.version;
+        applyAlarmDelta(currentAlarms, data.changes);
+        updateAlarmList(currentAlarms);
+    });
+    
+    events.addEventListener('state', function(e) {
+        handleAlarmState(JSON.parse(e.data));
+    });
+    
+    events.addEventListener('output', function(e) {
+        appendOutput(JSON.parse(e.data).line);
+    });
+    
+    events.onerror = function() {
+        // EventSource reconnects by itself unless the server refused the stream
+        if (events.readyState === EventSource.CLOSED) {
+            console.error("Event stream closed, falling back to long-polling");
+            window.alarmEvents = null;
+            pollChanges(null);
+        }
+    };
+}
+
+// Apply insert/update/delete operations from an alarm_delta event
+function applyAlarmDelta(alarms, changes) {
+    changes.forEach(change => {
+        if (change.op === 'insert') {
+            alarms.push(change.alarm);
+        } else if (change.op === 'update') {
+            const index = alarms.findIndex(alarm => alarm.id === change.id);
+            if (index !== -1) {
+                alarms[index] = change.alarm;
+            }
+        } else if (change.op === 'delete') {
+            const index = alarms.findIndex(alarm => alarm.id === change.id);
+            if (index !== -1) {
+                alarms.splice(index, 1);
+            }
+        }
+    });
+}
+
+// Long-poll /changes, resuming from the last version seen
+function pollChanges(since) {
+    const url = since === null ? '/changes' : `/changes?since=${since}`;
+    fetch(url, { cache: 'no-store' })
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`HTTP error! Status: ${response.status}`);
+            }
+            return response.json();
+        })
+        .then(data => {
+            if (data.alarms) {
+                updateAlarmList(data.alarms);
+            }
+            if (data.state) {
+                handleAlarmState(data.state);
+            }
+            if (data.output) {
+                data.output.forEach(line => {
+                    appendOutput(line);
+                });
+            }
+            pollChanges(data.version);
+        })
+        .catch(error => {
+            console.error("Error polling changes:", error);
+            // Back off before retrying so a stopped server is not hammered
+            setTimeout(() => pollChanges(since), 5000);
+        });
 }
 
-// Load alarms via HTTP
+// ETag of the alarm list currently displayed
+let alarmsETag = null;
+
+// Load alarms via HTTP (conditional: the server answers 304 when nothing changed)
 function loadAlarms() {
-    fetch('/alarms')
-        .then(response => response.json())
+    const headers = alarmsETag ? { 'If-None-Match': alarmsETag } : {};
+    fetch('/alarms', { headers: headers, cache: 'no-store' })
+        .then(response => {
+            if (response.status === 304) {
+                return null;
+            }
+            const etag = response.headers.get('ETag');
+            return response.json().then(data => {
+                if (data.status === 'success') {
+                    alarmsETag = etag;
+                }
+                return data;
+            });
+        })
         .then(data => {
+            if (data === null) {
+                return; // Unchanged since last load
+            }
             if (data.status === 'success') {
                 updateAlarmList(data.alarms);
             } else {
@@ -313,16 +432,23 @@ function checkAlarmState() {
         });
 }
 
-// Poll for script output via HTTP
+// Last output sequence number shown
+let outputSeq = 0;
+
+// Poll for script output via HTTP (only the lines after our cursor)
 function pollOutput() {
-    fetch('/output')
+    fetch(`/output?after=${outputSeq}`)
         .then(response => response.json())
         .then(data => {
+            if (data.dropped > 0) {
+                appendOutput(`... ${data.dropped} output lines skipped ...`);
+            }
             if (data.output && data.output.length > 0) {
                 data.output.forEach(line => {
                     appendOutput(line);
                 });
             }
+            outputSeq = data.seq;
         })
         .catch(error => {
             console.error("Error polling output:", error);
@@ -342,27 +468,27 @@ function handleAlarmState(state) {
     }
 }
 
-// Delete alarm
-function deleteAlarm(index) {
+// Delete alarm (addressed by its stable id)
+function deleteAlarm(id) {
     if (mqttClient && mqttClient.isConnected()) {
         // Use MQTT
         const payload = JSON.stringify({
-            index: index
+            id: id
         });
         const message = new Paho.MQTT.Message(payload);
         message.destinationName = 'alarm/request/delete';
         mqttClient.send(message);
         
-        appendOutput(`Requesting to delete alarm at index ${index}`);
+        appendOutput(`Requesting to delete alarm ${id}`);
     } else {
         // Use HTTP fallback
-        fetch(`/alarm/${index}`, {
+        fetch(`/alarm/${encodeURIComponent(id)}`, {
             method: 'DELETE'
         })
         .then(response => response.json())
         .then(data => {
             if (data.status === 'success') {
-                appendOutput(data.message || `Deleted alarm at index ${index}`);
+                appendOutput(data.message || `Deleted alarm ${id}`);
                 loadAlarms();
             } else {
                 appendOutput(`Error: ${data.message}`);
@@ -376,9 +502,9 @@ function deleteAlarm(index) {
 }
 
 // Toggle alarm
-function toggleAlarm(index) {
+function toggleAlarm(id) {
     // Visual feedback immediately
-    const row = document.querySelector(`#alarmList tr:nth-child(${index + 1})`);
+    const row = document.querySelector(`#alarmList tr[data-id="${id}"]`);
     if (row) {
         row.classList.add('refreshing');
     }
@@ -386,22 +512,22 @@ function toggleAlarm(index) {
     if (mqttClient && mqttClient.isConnected()) {
         // Use MQTT
         const payload = JSON.stringify({
-            index: index
+            id: id
         });
         const message = new Paho.MQTT.Message(payload);
         message.destinationName = 'alarm/request/toggle';
         mqttClient.send(message);
         
-        appendOutput(`Requesting to toggle alarm at index ${index}`);
+        appendOutput(`Requesting to toggle alarm ${id}`);
     } else {
         // Use HTTP fallback
-        fetch(`/alarm/${index}/toggle`, {
+        fetch(`/alarm/${encodeURIComponent(id)}/toggle`, {
             method: 'POST'
         })
         .then(response => response.json())
         .then(data => {
             if (data.status === 'success') {
-                appendOutput(data.message || `Toggled alarm at index ${index}`);
+                appendOutput(data.message || `Toggled alarm ${id}`);
                 loadAlarms();
             } else {
                 appendOutput(`Error: ${data.message}`);
@@ -457,7 +583,20 @@ function initTimeSelectors() {
 }
 
 // Update the alarm list in the UI
+// Short summary of a repeat rule (same wording as recurrence.describe)
+function describeRepeat(rule) {
+    const names = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun'];
+    const parts = [];
+    if (rule.days) parts.push(rule.days.map(day => names[day]).join(','));
+    if (rule.every) parts.push(`every ${rule.every} days from ${rule.start}`);
+    if (rule.dates) parts.push('on ' + rule.dates.join(', '));
+    if (rule.skip) parts.push(`except ${rule.skip.length} dates`);
+    return parts.join('; ');
+}
+
 function updateAlarmList(alarms) {
+    currentAlarms = alarms;
+    
     const alarmList = document.getElementById('alarmList');
     if (!alarmList) return;
     
@@ -465,12 +604,23 @@ function updateAlarmList(alarms) {
     alarmList.innerHTML = '';
     
     // Add each alarm
-    alarms.forEach((alarm, index) => {
+    alarms.forEach(alarm => {
         const row = document.createElement('tr');
+        row.dataset.id = alarm.id;
         
         // Time column
         const timeCell = document.createElement('td');
         timeCell.textContent = alarm.time;
+        if (alarm.repeat) {
+            const repeatEl = document.createElement('small');
+            repeatEl.textContent = ' ' + describeRepeat(alarm.repeat);
+            timeCell.appendChild(repeatEl);
+        }
+        if (alarm.wake_window) {
+            const windowEl = document.createElement('small');
+            windowEl.textContent = ` (smart wake ${alarm.wake_window} min before)`;
+            timeCell.appendChild(windowEl);
+        }
         row.appendChild(timeCell);
         
         // Status column
@@ -487,7 +637,7 @@ function updateAlarmList(alarms) {
         toggleBtn.textContent = alarm.active ? '🔕' : '🔔';
         toggleBtn.title = alarm.active ? 'Disable' : 'Enable';
         toggleBtn.className = 'btn btn-sm ' + (alarm.active ? 'btn-success' : 'btn-secondary');
-        toggleBtn.onclick = function() { toggleAlarm(index); };
+        toggleBtn.onclick = function() { toggleAlarm(alarm.id); };
         actionsCell.appendChild(toggleBtn);
         
         // Delete button
@@ -496,7 +646,7 @@ function updateAlarmList(alarms) {
         deleteBtn.title = 'Delete';
         deleteBtn.className = 'btn btn-danger btn-sm';
         deleteBtn.style.marginLeft = '5px';
-        deleteBtn.onclick = function() { deleteAlarm(index); };
+        deleteBtn.onclick = function() { deleteAlarm(alarm.id); };
         actionsCell.appendChild(deleteBtn);
         
         row.appendChild(actionsCell);
@@ -545,6 +695,15 @@ function showAlarmNotification(message) {
     snoozeBtn.onclick = snoozeAlarm;
     overlay.appendChild(snoozeBtn);
     
+    const dismissBtn = document.createElement('button');
+    dismissBtn.textContent = 'Dismiss';
+    dismissBtn.className = 'btn btn-danger';
+    dismissBtn.style.marginTop = '10px';
+    dismissBtn.style.padding = '10px 20px';
+    dismissBtn.style.fontSize = '1.2rem';
+    dismissBtn.onclick = dismissAlarm;
+    overlay.appendChild(dismissBtn);
+    
     document.body.appendChild(overlay);
 }
 
@@ -573,7 +732,7 @@ function snoozeAlarm() {
         .then(response => response.json())
         .then(data => {
             if (data.status === 'success') {
-                appendOutput('Alarm snoozed');
+                appendOutput(data.message || 'Alarm snoozed');
             } else {
                 appendOutput(`Error: ${data.message}`);
             }
@@ -588,6 +747,35 @@ function snoozeAlarm() {
     hideAlarmNotification();
 }
 
+// Stop the alarm, including any pending snooze
+function dismissAlarm() {
+    if (mqttClient && mqttClient.isConnected()) {
+        const message = new Paho.MQTT.Message('{}');
+        message.destinationName = 'alarm/request/dismiss';
+        mqttClient.send(message);
+        
+        appendOutput('Requesting to dismiss alarm via MQTT');
+    } else {
+        fetch('/dismiss', {
+            method: 'POST'
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (data.status === 'success') {
+                appendOutput('Alarm dismissed');
+            } else {
+                appendOutput(`Error: ${data.message}`);
+            }
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            appendOutput(`Error dismissing alarm: ${error.message}`);
+        });
+    }
+    
+    hideAlarmNotification();
+}
+
 // Add to output log
 function appendOutput(text) {
     const outputElement = document.getElementById('output');
@@ -611,9 +799,16 @@ function checkHardwareAvailability() {
                 console.log("Hardware interface available, enabling sensor display");
                 document.getElementById('sensorPanel').style.display = 'block';
                 document.getElementById('hardwareTestPanel').style.display = 'block';
-                // Start polling sensor data
-                updateSensorData();
-                sensorUpdateInterval = setInterval(updateSensorData, 2000);
+                if (window.EventSource) {
+                    // Sensor snapshots are pushed over the shared event stream
+                    getEventStream().addEventListener('sensor', function(e) {
+                        renderSensorData(JSON.parse(e.data));
+                    });
+                } else {
+                    // Start polling sensor data
+                    updateSensorData();
+                    sensorUpdateInterval = setInterval(updateSensorData, 2000);
+                }
             } else {
                 console.log("Hardware interface not available");
                 document.getElementById('sensorPanel').style.display = 'none';
@@ -626,63 +821,77 @@ function checkHardwareAvailability() {
 }
 
 // Poll sensor data from the backend
+// Follow the server's sampling rate (slower far from any alarm)
+function adaptSensorPolling(seconds) {
+    if (!seconds || !sensorUpdateInterval || seconds === sensorPollSeconds) return;
+    sensorPollSeconds = seconds;
+    clearInterval(sensorUpdateInterval);
+    sensorUpdateInterval = setInterval(updateSensorData, seconds * 1000);
+}
+
 function updateSensorData() {
     fetch('/sensor_data')
         .then(response => response.json())
         .then(data => {
-            if (data.hardware_available) {
-                // Update temperature and humidity
-                if ('temperature' in data) {
-                    document.getElementById('temperature').textContent = `${data.temperature.toFixed(1)}°C`;
-                }
-                if ('humidity' in data) {
-                    document.getElementById('humidity').textContent = `${data.humidity.toFixed(1)}%`;
-                }
-                
-                // Update distance if alarm is active
-                if (data.alarm_active && 'distance' in data) {
-                    const distanceElement = document.getElementById('distance');
-                    const distanceStatus = document.getElementById('distanceStatus');
-                    
-                    distanceElement.textContent = `${data.distance.toFixed(1)} cm`;
-                    
-                    if (data.distance_expected) {
-                        const diff = Math.abs(data.distance - data.distance_expected);
-                        if (diff <= 10) {
-                            distanceStatus.textContent = "Good distance!";
-                            distanceStatus.className = "status-good";
-                        } else if (data.distance < data.distance_expected) {
-                            distanceStatus.textContent = "Too close!";
-                            distanceStatus.className = "status-warning";
-                        } else {
-                            distanceStatus.textContent = "Too far!";
-                            distanceStatus.className = "status-warning";
-                        }
-                    }
-                    
-                    document.getElementById('distanceContainer').style.display = 'block';
-                } else {
-                    document.getElementById('distanceContainer').style.display = 'none';
-                }
-                
-                // Update movement status
-                if ('movement_detected' in data) {
-                    const movementElement = document.getElementById('movement');
-                    if (data.movement_detected) {
-                        movementElement.textContent = "Movement detected!";
-                        movementElement.className = "status-warning";
-                    } else {
-                        movementElement.textContent = "No movement";
-                        movementElement.className = "status-good";
-                    }
-                }
-            }
+            renderSensorData(data);
+            adaptSensorPolling(data.poll_interval);
         })
         .catch(error => {
             console.error("Error updating sensor data:", error);
         });
 }
 
+// Show a sensor snapshot (from /sensor_data or the event stream)
+function renderSensorData(data) {
+    if (data.hardware_available) {
+        // Update temperature and humidity
+        if ('temperature' in data) {
+            document.getElementById('temperature').textContent = `${data.temperature.toFixed(1)}°C`;
+        }
+        if ('humidity' in data) {
+            document.getElementById('humidity').textContent = `${data.humidity.toFixed(1)}%`;
+        }
+        
+        // Update distance if alarm is active
+        if (data.alarm_active && 'distance' in data) {
+            const distanceElement = document.getElementById('distance');
+            const distanceStatus = document.getElementById('distanceStatus');
+            
+            distanceElement.textContent = `${data.distance.toFixed(1)} cm`;
+            
+            if (data.distance_expected) {
+                const diff = Math.abs(data.distance - data.distance_expected);
+                if (diff <= 10) {
+                    distanceStatus.textContent = "Good distance!";
+                    distanceStatus.className = "status-good";
+                } else if (data.distance < data.distance_expected) {
+                    distanceStatus.textContent = "Too close!";
+                    distanceStatus.className = "status-warning";
+                } else {
+                    distanceStatus.textContent = "Too far!";
+                    distanceStatus.className = "status-warning";
+                }
+            }
+            
+            document.getElementById('distanceContainer').style.display = 'block';
+        } else {
+            document.getElementById('distanceContainer').style.display = 'none';
+        }
+        
+        // Update movement status
+        if ('movement_detected' in data) {
+            const movementElement = document.getElementById('movement');
+            if (data.movement_detected) {
+                movementElement.textContent = "Movement detected!";
+                movementElement.className = "status-warning";
+            } else {
+                movementElement.textContent = "No movement";
+                movementElement.className = "status-good";
+            }
+        }
+    }
+}
+
 // Function to test hardware components with proper error handling
 function testHardware(component, action) {
     const resultElement = document.getElementById('testResult');
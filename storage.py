@@ -0,0 +1,816 @@
+# storage.py - Pluggable persistence for alarms and alarm state
+#
+# Two backends share the same interface:
+#   JsonStorage   - the historical alarms.json / alarm_state.json files,
+#                   rewritten whole (tmp file + fsync + rename) on every change
+#   SqliteStorage - a single SQLite database in WAL mode, where toggles and
+#                   deletes are single-row writes and readers get snapshot
+#                   reads without os.sync()
+#
+# Every alarm carries a stable "id". Alarms written before ids existed get
+# one derived from their time, so every process assigns the same id to them.
+#
+# Select the backend with ALARM_STORAGE=json|sqlite (default: json).
+# Run `python storage.py migrate` to copy the JSON files into the database.
+#
+# ALARM_DURABILITY picks when writes reach the media (see DurableStorage):
+#   strict  every write is committed before it returns (the default)
+#   group   writes arriving within ALARM_GROUP_COMMIT_MS share one commit;
+#           each still returns only once it is committed
+#   relaxed writes return at once and are committed every
+#           ALARM_RELAXED_CHECKPOINT_SECONDS and at exit; up to that much
+#           is lost on a power cut (the live alarm state is in shared
+#           memory anyway, and alarm changes also travel over MQTT)
+#
+# Alarm writes from both processes are compare-and-swaps on a version kept
+# in a lock file next to the alarms (see alarm_lock.py): a write made
+# against an outdated list is rebased onto the stored one instead of
+# overwriting it.
+import atexit
+import hashlib
+import json
+import os
+import random
+import signal
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+from alarm_lock import AlarmLock, VersionConflict
+from latency import Histogram
+
+ALARMS_FILE = "alarms.json"
+STATE_FILE = "alarm_state.json"
+DB_FILE = os.environ.get('ALARM_DB_FILE', 'alarms.db')
+
+DEFAULT_STATE = {"alarm_active": False, "timestamp": 0, "message": ""}
+
+DURABILITY_MODES = ("strict", "group", "relaxed")
+GROUP_COMMIT_SECONDS = float(os.environ.get('ALARM_GROUP_COMMIT_MS', '50')) / 1000
+RELAXED_CHECKPOINT_SECONDS = float(os.environ.get('ALARM_RELAXED_CHECKPOINT_SECONDS', '10'))
+# Optimistic alarm writes: attempts before rebasing under the lock, and the first backoff
+CAS_RETRIES = 5
+CAS_BACKOFF_SECONDS = 0.002
+
+
+def new_alarm_id():
+    """Random id for a new alarm (the "a" prefix keeps it from looking like an index)"""
+    return "a" + uuid.uuid4().hex[:12]
+
+
+def legacy_alarm_id(alarm_time):
+    """Deterministic id for an alarm stored without one"""
+    return "a" + hashlib.sha1(alarm_time.encode('utf-8')).hexdigest()[:12]
+
+
+def ensure_ids(alarms):
+    """Give every alarm without an id its legacy id. Returns the number assigned."""
+    assigned = 0
+    for alarm in alarms:
+        if not alarm.get("id") and "time" in alarm:
+            alarm["id"] = legacy_alarm_id(alarm["time"])
+            assigned += 1
+    return assigned
+
+
+def changes_to_json(changes):
+    """Convert change hints (see SqliteStorage.write_alarms) into JSON-friendly delta operations"""
+    delta = []
+    for change in changes:
+        if change[0] == "insert":
+            delta.append({"op": "insert", "alarm": dict(change[1])})
+        elif change[0] == "update":
+            delta.append({"op": "update", "id": change[1], "alarm": dict(change[2])})
+        elif change[0] == "delete":
+            delta.append({"op": "delete", "id": change[1]})
+    return delta
+
+
+def changes_from_json(delta):
+    """Change hints back from changes_to_json() output"""
+    changes = []
+    for operation in delta:
+        if operation["op"] == "insert":
+            changes.append(("insert", dict(operation["alarm"])))
+        elif operation["op"] == "update":
+            changes.append(("update", operation["id"], dict(operation["alarm"])))
+        elif operation["op"] == "delete":
+            changes.append(("delete", operation["id"]))
+        else:
+            raise ValueError(f"Unknown storage change: {operation['op']}")
+    return changes
+
+
+def apply_changes(alarms, changes):
+    """A copy of `alarms` with change hints applied (a write rebased onto a newer list)"""
+    result = [dict(alarm) for alarm in alarms]
+    for change in changes:
+        kind = change[0]
+        if kind == "insert":
+            result = [alarm for alarm in result if alarm.get("id") != change[1].get("id")]
+            result.append(dict(change[1]))
+        elif kind == "update":
+            # An alarm deleted in the meantime stays deleted
+            result = [dict(change[2]) if alarm.get("id") == change[1] else alarm for alarm in result]
+        elif kind == "delete":
+            result = [alarm for alarm in result if alarm.get("id") != change[1]]
+        else:
+            raise ValueError(f"Unknown storage change: {kind}")
+    return result
+
+
+def _fsync_directory(path):
+    """Force sync the directory to ensure a rename is committed"""
+    dir_fd = os.open(os.path.dirname(path) or '.', os.O_DIRECTORY)
+    os.fsync(dir_fd)
+    os.close(dir_fd)
+
+
+class JsonStorage:
+    """Whole-file JSON backend (the original on-disk format)"""
+
+    name = "json"
+
+    def __init__(self, alarms_file=ALARMS_FILE, state_file=STATE_FILE):
+        self.alarms_file = alarms_file
+        self.state_file = state_file
+        self.stats = {"writes": 0, "fsyncs": 0, "write_seconds": 0.0}
+
+    def _atomic_write(self, path, data):
+        self._atomic_write_files([(path, data)])
+
+    def _atomic_write_files(self, files):
+        """Write (path, data) pairs, each atomically, with one directory fsync per directory"""
+        # Create temporary files and then rename them to ensure atomic writes
+        for path, data in files:
+            temp_file = path + ".tmp"
+            with open(temp_file, 'w') as f:
+                json.dump(data, f)
+                f.flush()  # Flush internal Python buffers
+                os.fsync(f.fileno())  # Flush OS buffers to disk
+            self.stats["fsyncs"] += 1
+
+        # Rename is atomic on POSIX systems
+        directories = []
+        for path, data in files:
+            os.rename(path + ".tmp", path)
+            directory = os.path.dirname(os.path.abspath(path))
+            if directory not in directories:
+                directories.append(directory)
+        for directory in directories:
+            _fsync_directory(os.path.join(directory, ""))
+            self.stats["fsyncs"] += 1
+
+    def signature(self):
+        """Cheap fingerprint that changes whenever the alarms are rewritten"""
+        try:
+            st = os.stat(self.alarms_file)
+            return (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            return None
+
+    def last_modified(self):
+        try:
+            return os.path.getmtime(self.alarms_file)
+        except OSError:
+            return 0
+
+    def watch_paths(self):
+        return [self.alarms_file]
+
+    def lock_path(self):
+        return self.alarms_file + ".lock"
+
+    def state_watch_paths(self):
+        return [self.state_file]
+
+    def load_alarms(self):
+        if not os.path.exists(self.alarms_file):
+            return []
+        with open(self.alarms_file, 'r') as f:
+            content = f.read()
+        alarms = json.loads(content) if content.strip() else []
+        ensure_ids(alarms)
+        return alarms
+
+    def write_alarms(self, alarms, changes=None):
+        """Persist the full list. `changes` is ignored: the file is always rewritten."""
+        start = time.perf_counter()
+        self._atomic_write(self.alarms_file, alarms)
+        self.stats["writes"] += 1
+        self.stats["write_seconds"] += time.perf_counter() - start
+
+    def load_state(self):
+        if not os.path.exists(self.state_file):
+            return dict(DEFAULT_STATE)
+        # The rename in save_state is atomic and the page cache is shared,
+        # so every process sees the latest version without os.sync()
+        with open(self.state_file, 'r') as f:
+            return json.load(f)
+
+    def save_state(self, state):
+        start = time.perf_counter()
+        self._atomic_write(self.state_file, state)
+        self.stats["writes"] += 1
+        self.stats["write_seconds"] += time.perf_counter() - start
+
+    def write_batch(self, alarms=None, changes=None, state=None):
+        """Persist alarms and/or state together (None: leave as is)"""
+        files = []
+        if alarms is not None:
+            files.append((self.alarms_file, alarms))
+        if state is not None:
+            files.append((self.state_file, state))
+        if not files:
+            return
+        start = time.perf_counter()
+        self._atomic_write_files(files)
+        self.stats["writes"] += 1
+        self.stats["write_seconds"] += time.perf_counter() - start
+
+
+class SqliteStorage:
+    """SQLite backend in WAL mode with single-row mutations"""
+
+    name = "sqlite"
+    # 1: alarms keyed by time; 2: alarms keyed by id
+    SCHEMA_VERSION = 2
+    # Auto-checkpointing is disabled so that the fsyncs we pay for are visible
+    # in the stats; one checkpoint (WAL + database fsync) every N commits.
+    CHECKPOINT_EVERY = 200
+
+    def __init__(self, db_file=DB_FILE, alarms_file=ALARMS_FILE, state_file=STATE_FILE):
+        self.db_file = db_file
+        self.stats = {"writes": 0, "fsyncs": 0, "write_seconds": 0.0, "checkpoints": 0}
+        self._lock = threading.RLock()
+        self._commits_since_checkpoint = 0
+        self._conn = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode NORMAL only syncs on checkpoint; commits stay durable
+        # against application crashes and atomic against power loss
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA wal_autocheckpoint=0")
+        self._create_schema(alarms_file, state_file)
+
+    def _create_schema(self, alarms_file, state_file):
+        with self._lock:
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= self.SCHEMA_VERSION:
+                return
+
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if version == 1:
+                    self._migrate_time_keys()
+                else:
+                    self._create_alarms_table("alarms")
+                    self._conn.execute("""
+                        CREATE TABLE IF NOT EXISTS state (
+                            id INTEGER PRIMARY KEY CHECK (id = 1),
+                            body TEXT NOT NULL
+                        )""")
+                    self._import_json(alarms_file, state_file)
+                self._conn.execute(f"PRAGMA user_version={self.SCHEMA_VERSION}")
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _create_alarms_table(self, name):
+        self._conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {name} (
+                id TEXT PRIMARY KEY,
+                time TEXT NOT NULL,
+                active INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                extra TEXT NOT NULL DEFAULT '{{}}'
+            )""")
+
+    def _migrate_time_keys(self):
+        """Schema 1 -> 2: re-key the alarms table by id, keeping order and data"""
+        self._create_alarms_table("alarms_v2")
+        rows = self._conn.execute(
+            "SELECT time, active, position, extra FROM alarms ORDER BY position").fetchall()
+        for time_, active, position, extra in rows:
+            self._conn.execute(
+                "INSERT INTO alarms_v2 (id, time, active, position, extra) VALUES (?, ?, ?, ?, ?)",
+                (legacy_alarm_id(time_), time_, active, position, extra))
+        self._conn.execute("DROP TABLE alarms")
+        self._conn.execute("ALTER TABLE alarms_v2 RENAME TO alarms")
+        print(f"Upgraded {len(rows)} alarms in {self.db_file} to id keys")
+
+    def _import_json(self, alarms_file, state_file):
+        """Seed a freshly created database from the legacy JSON files"""
+        legacy = JsonStorage(alarms_file, state_file)
+        try:
+            alarms = legacy.load_alarms()
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Could not import {alarms_file}: {e}")
+            alarms = []
+        self._replace_rows(alarms)
+
+        if os.path.exists(state_file):
+            try:
+                self._upsert_state(legacy.load_state())
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"Could not import {state_file}: {e}")
+
+        if alarms:
+            print(f"Migrated {len(alarms)} alarms from {alarms_file} into {self.db_file}")
+
+    @staticmethod
+    def _row(alarm, position):
+        extra = {k: v for k, v in alarm.items() if k not in ("id", "time", "active")}
+        alarm_id = alarm.get("id") or legacy_alarm_id(alarm["time"])
+        return (alarm_id, alarm["time"], 1 if alarm["active"] else 0, position, json.dumps(extra))
+
+    @staticmethod
+    def _alarm(row):
+        alarm = {"id": row[0], "time": row[1], "active": bool(row[2])}
+        alarm.update(json.loads(row[3]))
+        return alarm
+
+    def _replace_rows(self, alarms):
+        self._conn.execute("DELETE FROM alarms")
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO alarms (id, time, active, position, extra) VALUES (?, ?, ?, ?, ?)",
+            [self._row(alarm, position) for position, alarm in enumerate(alarms)])
+
+    def _upsert_state(self, state):
+        self._conn.execute(
+            "INSERT INTO state (id, body) VALUES (1, ?) "
+            "ON CONFLICT(id) DO UPDATE SET body = excluded.body",
+            (json.dumps(state),))
+
+    def _commit(self):
+        self._conn.execute("COMMIT")
+        self.stats["writes"] += 1
+        self._commits_since_checkpoint += 1
+        if self._commits_since_checkpoint >= self.CHECKPOINT_EVERY:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Fold the WAL back into the database file"""
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._commits_since_checkpoint = 0
+            self.stats["checkpoints"] += 1
+            self.stats["fsyncs"] += 2
+
+    def signature(self):
+        """Changes whenever another connection commits (no file I/O)"""
+        with self._lock:
+            return (self._conn.execute("PRAGMA data_version").fetchone()[0], self.stats["writes"])
+
+    def last_modified(self):
+        try:
+            return max(os.path.getmtime(path) for path in (self.db_file, self.db_file + "-wal")
+                       if os.path.exists(path))
+        except ValueError:
+            return 0
+
+    def watch_paths(self):
+        return [self.db_file, self.db_file + "-wal"]
+
+    def lock_path(self):
+        return self.db_file + ".lock"
+
+    def state_watch_paths(self):
+        return self.watch_paths()
+
+    def load_alarms(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, time, active, extra FROM alarms ORDER BY position").fetchall()
+        return [self._alarm(row) for row in rows]
+
+    def write_alarms(self, alarms, changes=None):
+        """Persist alarms, applying only `changes` when given.
+
+        changes is a list of ("insert", alarm), ("update", alarm_id, alarm)
+        or ("delete", alarm_id) tuples describing how `alarms` was derived
+        from the previously stored list.
+        """
+        start = time.perf_counter()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if changes is None:
+                    self._replace_rows(alarms)
+                else:
+                    for change in changes:
+                        self._apply_change(change)
+                self._commit()
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self.stats["write_seconds"] += time.perf_counter() - start
+
+    def _apply_change(self, change):
+        kind = change[0]
+        if kind == "insert":
+            position = self._conn.execute(
+                "SELECT COALESCE(MAX(position), -1) + 1 FROM alarms").fetchone()[0]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO alarms (id, time, active, position, extra) VALUES (?, ?, ?, ?, ?)",
+                self._row(change[1], position))
+        elif kind == "update":
+            alarm_id, alarm = change[1], change[2]
+            row = self._row(alarm, 0)
+            self._conn.execute(
+                "UPDATE alarms SET time = ?, active = ?, extra = ? WHERE id = ?",
+                (row[1], row[2], row[4], alarm_id))
+        elif kind == "delete":
+            self._conn.execute("DELETE FROM alarms WHERE id = ?", (change[1],))
+        else:
+            raise ValueError(f"Unknown storage change: {kind}")
+
+    def load_state(self):
+        with self._lock:
+            row = self._conn.execute("SELECT body FROM state WHERE id = 1").fetchone()
+        return json.loads(row[0]) if row else dict(DEFAULT_STATE)
+
+    def save_state(self, state):
+        start = time.perf_counter()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._upsert_state(state)
+                self._commit()
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self.stats["write_seconds"] += time.perf_counter() - start
+
+    def write_batch(self, alarms=None, changes=None, state=None):
+        """Persist alarms and/or state in one transaction (None: leave as is)"""
+        if alarms is None and state is None:
+            return
+        start = time.perf_counter()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if alarms is not None:
+                    if changes is None:
+                        self._replace_rows(alarms)
+                    else:
+                        for change in changes:
+                            self._apply_change(change)
+                if state is not None:
+                    self._upsert_state(state)
+                self._commit()
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self.stats["write_seconds"] += time.perf_counter() - start
+
+
+def _copy_changes(changes):
+    """Change hints with their alarm dicts copied (callers keep mutating theirs)"""
+    if changes is None:
+        return None
+    return [tuple(dict(part) if isinstance(part, dict) else part for part in change)
+            for change in changes]
+
+
+def _merge_changes(earlier, later):
+    """Hints taking the stored list through both batches (None: the whole list is rewritten)"""
+    if earlier is None or later is None:
+        return None
+    return earlier + later
+
+
+class DurableStorage:
+    """A backend behind one of the DURABILITY_MODES, with versioned alarm writes.
+
+    Every alarm write is a compare-and-swap against the version this
+    process last read (see alarm_lock.py). When another process wrote in
+    between, the change hints are re-applied to the newer list and the
+    write retried, so neither write is lost.
+
+    In group and relaxed mode, writes are queued and a flusher thread
+    commits them in batches: the latest alarm list (with the change hints
+    of every write in the batch, so SQLite still touches only those rows)
+    and the latest state, in one write_batch() call. Until then, loads
+    return the queued data. Everything else is the backend's.
+    """
+
+    def __init__(self, backend, mode="strict"):
+        if mode not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode '{mode}' (one of {', '.join(DURABILITY_MODES)})")
+        self.backend = backend
+        self.mode = mode
+        self.delay = GROUP_COMMIT_SECONDS if mode == "group" else RELAXED_CHECKPOINT_SECONDS
+        self.lock = AlarmLock(backend.lock_path())
+        self._version = None     # alarms version this process last read or wrote
+        self._cond = threading.Condition()
+        self._thread = None
+        self._queued = 0         # writes queued so far (their generation numbers)
+        self._committed = 0      # last generation committed
+        self._failed = (0, None)  # last generation whose commit failed, and why
+        self._first_queued_at = None
+        self._flush_now = False
+        self._alarms = None      # queued alarm list (None: nothing queued)
+        self._changes = None
+        self._queued_version = None  # version the queued alarm writes were made against
+        self._state = None
+        self._committing = (None, None)  # (alarms, state) being written right now
+        self._write_ms = Histogram()  # what the caller waited
+        self._commit_ms = Histogram()
+        self._counters = {"calls": 0, "commits": 0, "coalesced": 0, "commit_errors": 0,
+                          "cas_retries": 0, "rebased": 0, "overwritten": 0, "locked_rebases": 0}
+
+    def __getattr__(self, name):
+        # name, signature(), watch_paths(), ... come from the backend
+        return getattr(self.backend, name)
+
+    @property
+    def stats(self):
+        with self._cond:
+            pending = self._queued - max(self._committed, self._failed[0])
+            return dict(self.backend.stats, durability=self.mode, pending_writes=pending,
+                        write_latency=self._write_ms.snapshot(), commit_latency=self._commit_ms.snapshot(),
+                        lock=self.lock.snapshot(), **self._counters)
+
+    def reset_stats(self):
+        """Zero the counters and histograms of this wrapper and of its backend (benchmarks)"""
+        with self._cond:
+            for key in self.backend.stats:
+                self.backend.stats[key] = 0
+            for key in self._counters:
+                self._counters[key] = 0
+            self._write_ms = Histogram()
+            self._commit_ms = Histogram()
+
+    @property
+    def alarms_version(self):
+        """Version of the stored alarms the caller's list is based on (None: unknown)"""
+        return self._version
+
+    def adopt_version(self, version):
+        """The caller brought its list up to `version` without loading it (e.g. from an IPC delta)"""
+        self._version = version
+
+    def load_alarms(self):
+        with self._cond:
+            alarms = self._alarms if self._alarms is not None else self._committing[0]
+            if alarms is not None:
+                return [dict(alarm) for alarm in alarms]
+        self._version, alarms = self.lock.read(self.backend.load_alarms)
+        return alarms
+
+    def load_state(self):
+        with self._cond:
+            state = self._state if self._state is not None else self._committing[1]
+            if state is not None:
+                return dict(state)
+        return self.backend.load_state()
+
+    def write_alarms(self, alarms, changes=None):
+        """Persist alarms (see SqliteStorage.write_alarms).
+
+        In strict mode, returns the list actually written when another
+        process's changes had to be merged in (the caller should adopt it),
+        else None. Queued modes merge at commit time and return None.
+        """
+        if self.mode == "strict":
+            return self._timed(self._commit_alarms, alarms, changes, None, self._version)
+        start = time.perf_counter()
+        alarms = [dict(alarm) for alarm in alarms]
+        changes = _copy_changes(changes)
+        with self._cond:
+            if self._alarms is None:
+                self._changes = changes
+                self._queued_version = self._version
+            else:
+                self._changes = _merge_changes(self._changes, changes)
+            self._alarms = alarms
+            self._wait_for(self._enqueue(), start)
+
+    def save_state(self, state):
+        if self.mode == "strict":
+            self._timed(self._commit_state, state)
+            return
+        start = time.perf_counter()
+        with self._cond:
+            self._state = dict(state)
+            self._wait_for(self._enqueue(), start)
+
+    def _timed(self, write, *args):
+        start = time.perf_counter()
+        try:
+            return write(*args)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with self._cond:
+                self._counters["calls"] += 1
+                self._counters["commits"] += 1
+                self._write_ms.add(elapsed_ms)
+                self._commit_ms.add(elapsed_ms)
+
+    def _commit_state(self, state):
+        # Both processes write through the same .tmp file
+        with self.lock.exclusive():
+            self.backend.write_batch(state=state)
+
+    def _commit_alarms(self, alarms, changes, state, expected):
+        """Write alarms (and state) if the stored alarms are still at version `expected`.
+
+        On a conflict the change hints are re-applied to the newer list and
+        the write retried; a whole-list replace (changes None) overwrites.
+        Returns the list written when it is not `alarms`, else None.
+        """
+        merged = None
+        for attempt in range(CAS_RETRIES):
+            try:
+                version = self.lock.commit(lambda: self.backend.write_batch(alarms, changes, state), expected)
+                self._adopt(version, merged)
+                return merged
+            except VersionConflict:
+                if changes is None:
+                    # A replace (sync, reset) is meant to win
+                    self._counters["overwritten"] += 1
+                    expected = None
+                    continue
+            self._counters["cas_retries"] += 1
+            time.sleep(random.uniform(0, CAS_BACKOFF_SECONDS * 2 ** attempt))
+            expected, stored = self.lock.read(self.backend.load_alarms)
+            alarms = merged = apply_changes(stored, changes)
+            self._counters["rebased"] += 1
+
+        # Still losing the race: rebase under the lock, where nobody can move it
+        def rebase_and_write():
+            nonlocal merged
+            merged = apply_changes(self.backend.load_alarms(), changes)
+            self.backend.write_batch(merged, changes, state)
+        version = self.lock.commit(rebase_and_write)
+        self._adopt(version, merged)
+        self._counters["locked_rebases"] += 1
+        return merged
+
+    def _adopt(self, version, merged):
+        """Track the version the caller's list is now based on"""
+        # A strict caller takes the merged list; a queued one keeps its own
+        # until it reloads, so its next write has to be rebased again
+        if merged is None or self.mode == "strict":
+            self._version = version
+
+    def _enqueue(self):
+        """Count a queued write and wake the flusher. Caller must hold the lock."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="storage-flush", daemon=True)
+            self._thread.start()
+        if self._first_queued_at is None:
+            self._first_queued_at = time.monotonic()
+        else:
+            self._counters["coalesced"] += 1
+        self._queued += 1
+        self._counters["calls"] += 1
+        self._cond.notify_all()
+        return self._queued
+
+    def _wait_for(self, generation, start):
+        """Group mode: block until `generation` is committed. Caller must hold the lock."""
+        if self.mode == "group":
+            while self._committed < generation and self._failed[0] < generation:
+                self._cond.wait()
+        self._write_ms.add((time.perf_counter() - start) * 1000)
+        if self.mode == "group" and self._committed < generation:
+            raise self._failed[1]
+
+    def flush(self):
+        """Commit whatever is queued now, and wait for it"""
+        with self._cond:
+            generation = self._queued
+            if self._committed >= generation or self._thread is None:
+                return
+            self._flush_now = True
+            self._cond.notify_all()
+            while self._committed < generation and self._failed[0] < generation:
+                self._cond.wait()
+
+    def checkpoint(self):
+        self.flush()
+        if hasattr(self.backend, "checkpoint"):
+            self.backend.checkpoint()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._first_queued_at is None:
+                    self._cond.wait()
+                while not self._flush_now:
+                    remaining = self._first_queued_at + self.delay - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                alarms, changes, state = self._alarms, self._changes, self._state
+                expected = self._queued_version
+                generation = self._queued
+                self._alarms = self._changes = self._state = None
+                self._committing = (alarms, state)
+                self._first_queued_at = None
+                self._flush_now = False
+            self._commit(alarms, changes, state, expected, generation)
+
+    def _commit(self, alarms, changes, state, expected, generation):
+        start = time.perf_counter()
+        try:
+            if alarms is not None:
+                self._commit_alarms(alarms, changes, state, expected)
+            else:
+                self._commit_state(state)
+        except Exception as e:
+            print(f"Error committing queued storage writes: {e}")
+            with self._cond:
+                self._committing = (None, None)
+                self._counters["commit_errors"] += 1
+                if self.mode == "group":
+                    # The waiting callers get the error, as they would in strict mode
+                    self._failed = (generation, e)
+                else:
+                    # Nobody is waiting: keep the batch (under anything queued since) and retry
+                    if self._alarms is None:
+                        self._alarms, self._changes = alarms, changes
+                    elif alarms is not None:
+                        self._changes = _merge_changes(changes, self._changes)
+                    if alarms is not None:
+                        self._queued_version = expected
+                    if self._state is None:
+                        self._state = state
+                    if self._first_queued_at is None:
+                        self._first_queued_at = time.monotonic()
+                    if self._flush_now:
+                        # flush() callers wait for this generation: give up on it
+                        self._failed = (generation, e)
+                self._cond.notify_all()
+            return
+        with self._cond:
+            self._committing = (None, None)
+            self._committed = generation
+            self._counters["commits"] += 1
+            self._commit_ms.add((time.perf_counter() - start) * 1000)
+            self._cond.notify_all()
+
+
+BACKENDS = {
+    "json": JsonStorage,
+    "sqlite": SqliteStorage,
+}
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """Return the process-wide storage backend selected by ALARM_STORAGE"""
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            name = os.environ.get('ALARM_STORAGE', 'json').lower()
+            if name not in BACKENDS:
+                print(f"Unknown ALARM_STORAGE '{name}', falling back to json")
+                name = "json"
+            mode = os.environ.get('ALARM_DURABILITY', 'strict').lower()
+            if mode not in DURABILITY_MODES:
+                print(f"Unknown ALARM_DURABILITY '{mode}', falling back to strict")
+                mode = "strict"
+            _storage = DurableStorage(BACKENDS[name](), mode)
+            print(f"Using {name} storage backend ({mode} durability)")
+            if mode != "strict":
+                atexit.register(_storage.flush)
+                _exit_on_sigterm()
+        return _storage
+
+
+def _exit_on_sigterm():
+    """Turn SIGTERM into a normal exit, so atexit commits what is still queued"""
+    if threading.current_thread() is not threading.main_thread():
+        return
+    try:
+        if signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+    except (ValueError, AttributeError):
+        pass
+
+
+def migrate(db_file=DB_FILE, alarms_file=ALARMS_FILE, state_file=STATE_FILE):
+    """Copy the JSON files into the SQLite database, replacing its contents"""
+    legacy = JsonStorage(alarms_file, state_file)
+    database = SqliteStorage(db_file, alarms_file, state_file)
+    alarms = legacy.load_alarms()
+    database.write_alarms(alarms)
+    database.save_state(legacy.load_state())
+    database.checkpoint()
+    print(f"Migrated {len(alarms)} alarms and alarm state into {db_file}")
+    return len(alarms)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate":
+        migrate()
+    else:
+        print("Usage: python storage.py migrate")
+        print("Then start the application with ALARM_STORAGE=sqlite")
@@ -0,0 +1,50 @@
+# test_timer_wheel.py - Timers scheduled while the wheel thread is busy must still fire
+import threading
+import time
+
+from timer_wheel import TimerWheel
+
+
+def test_schedule_from_slow_callback():
+    wheel = TimerWheel(tick=0.01)
+    fired = []
+    done = threading.Event()
+
+    def record(name):
+        fired.append(name)
+        if len(fired) == 4:
+            done.set()
+
+    def slow(round):
+        # Hold the wheel thread past the expiry of the timer scheduled next to us
+        time.sleep(0.4)
+        record(f"slow{round}")
+        if round == 0:
+            wheel.schedule(0.05, slow, 1)
+            wheel.schedule(0.3, record, "beside1")
+
+    wheel.schedule(0.05, slow, 0)
+    wheel.schedule(0.3, record, "beside0")
+    assert done.wait(5), f"only {fired} fired"
+    assert sorted(fired) == ["beside0", "beside1", "slow0", "slow1"]
+    assert len(wheel) == 0
+
+
+def test_schedule_from_other_thread_while_busy():
+    wheel = TimerWheel(tick=0.01)
+    fired = []
+    busy = threading.Event()
+    wheel.schedule(0.01, lambda: (busy.set(), time.sleep(0.3)))
+    busy.wait(2)
+    for i in range(20):
+        wheel.schedule(0.01 * (i % 5), fired.append, i)
+    deadline = time.time() + 5
+    while len(fired) < 20 and time.time() < deadline:
+        time.sleep(0.01)
+    assert sorted(fired) == list(range(20))
+
+
+if __name__ == "__main__":
+    test_schedule_from_slow_callback()
+    test_schedule_from_other_thread_while_busy()
+    print("timer wheel tests passed")
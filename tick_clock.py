@@ -0,0 +1,105 @@
+# tick_clock.py - Second tick that never skips an alarm window
+#
+# A tick scheduled with a fixed 1000 ms delay drifts by whatever the tick
+# itself costs (sensor reads, servo sweeps), and a tick that lands late jumps
+# straight over a second. TickClock instead aims every tick just past the
+# next wall-clock second boundary, and on each tick returns every second
+# since the previous one, so a late tick evaluates the windows it skipped.
+#
+# time.monotonic() tells a late tick from a wall-clock step: when the wall
+# clock moved much more (or less) than the monotonic clock, it was set (NTP,
+# RTC-less boot, manual change). Small forward steps are caught up like late
+# ticks, seconds already evaluated are never evaluated again after a small
+# backward step, and large steps resynchronise without replaying hours of
+# alarms.
+import math
+import time
+
+# Aim this far past the boundary so the tick never lands just before it
+TICK_MARGIN = 0.005
+# Seconds of missed windows worth replaying; beyond this the gap is skipped
+CATCHUP_LIMIT = 300
+# Wall/monotonic disagreement (seconds) treated as a clock step
+JUMP_TOLERANCE = 1.5
+# A tick later than this past its boundary counts as late
+LATE_THRESHOLD = 0.25
+
+
+class TickClock:
+    """Turns irregular tick calls into the exact sequence of wall-clock seconds to check"""
+
+    def __init__(self, wall=time.time, monotonic=time.monotonic):
+        self._wall = wall
+        self._monotonic = monotonic
+        self._last_second = None
+        self._last_wall = None
+        self._last_mono = None
+        self.stats = {
+            "ticks": 0,
+            "late_ticks": 0,
+            "last_lateness_ms": 0.0,
+            "max_lateness_ms": 0.0,
+            "caught_up_windows": 0,
+            "missed_windows": 0,
+            "clock_jumps": 0,
+        }
+
+    def delay_ms(self):
+        """Milliseconds from now until just past the next second boundary"""
+        now = self._wall()
+        return max(1, int(math.ceil((math.floor(now) + 1 - now + TICK_MARGIN) * 1000)))
+
+    def tick(self):
+        """Return the wall-clock seconds (epoch ints) to evaluate, oldest first.
+
+        Usually exactly one; several after a late tick or a small forward
+        clock step; none when the clock has not reached a new second.
+        """
+        wall = self._wall()
+        mono = self._monotonic()
+        second = math.floor(wall)
+        stats = self.stats
+        stats["ticks"] += 1
+
+        lateness = (wall - second) * 1000
+        stats["last_lateness_ms"] = round(lateness, 1)
+        stats["max_lateness_ms"] = round(max(stats["max_lateness_ms"], lateness), 1)
+
+        if self._last_second is None:
+            seconds = [second]
+        else:
+            elapsed_wall = wall - self._last_wall
+            elapsed_mono = mono - self._last_mono
+            if abs(elapsed_wall - elapsed_mono) > JUMP_TOLERANCE:
+                stats["clock_jumps"] += 1
+                print(f"Clock stepped by {elapsed_wall - elapsed_mono:+.1f}s")
+            self._last_wall = wall
+            self._last_mono = mono
+            gap = second - self._last_second
+            if gap > CATCHUP_LIMIT:
+                # Too far to replay (hours of alarms at once): resync on the present
+                stats["missed_windows"] += gap - 1
+                seconds = [second]
+            elif gap >= 1:
+                seconds = list(range(self._last_second + 1, second + 1))
+                if gap > 1:
+                    stats["caught_up_windows"] += gap - 1
+                    stats["late_ticks"] += 1
+            elif gap < -CATCHUP_LIMIT:
+                # Clock set far back: start over from the new time
+                seconds = [second]
+            else:
+                # Same second again, or a small step back: those seconds were already checked
+                return []
+
+        if lateness > LATE_THRESHOLD * 1000 and len(seconds) == 1:
+            stats["late_ticks"] += 1
+        self._last_second = seconds[-1]
+        self._last_wall = wall
+        self._last_mono = mono
+        return seconds
+
+
+def format_epoch_second(second):
+    """Epoch second -> local HH:MM:SS, as compared against alarm times"""
+    return time.strftime('%H:%M:%S', time.localtime(second))
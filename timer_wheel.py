@@ -0,0 +1,230 @@
+# timer_wheel.py - Hierarchical timing wheel driving every timer on one thread
+#
+# Snooze re-fires, auto-stop timeouts and buzzer-off delays used to be a
+# threading.Timer (one thread each) or a sleeping thread. Here they are
+# entries in a three-level wheel ticking every TICK seconds:
+#
+#   level 0: 256 slots of 1 tick       (~25 s at 0.1 s)
+#   level 1:  64 slots of 256 ticks    (~27 min)
+#   level 2:  64 slots of 16384 ticks  (~29 h)
+#   beyond:  an overflow list, re-placed once per level 2 revolution
+#
+# Scheduling drops the timer into the slot matching its expiry and cancelling
+# removes it from that slot, both O(1); only the driving thread advances the
+# wheel and fires what expired. Each time a lower level wraps, the
+# next slot of the level above is cascaded down. The single driving thread
+# sleeps until the next occupied level 0 slot (or the next cascade), and not
+# at all while no timer is pending.
+import math
+import threading
+import time
+
+TICK = 0.1
+LEVEL0_BITS = 8
+LEVEL_BITS = 6
+
+_LEVEL0_SIZE = 1 << LEVEL0_BITS
+_LEVEL_SIZE = 1 << LEVEL_BITS
+_LEVEL0_MASK = _LEVEL0_SIZE - 1
+_LEVEL_MASK = _LEVEL_SIZE - 1
+_LEVEL1_SPAN = 1 << (LEVEL0_BITS + LEVEL_BITS)
+_LEVEL2_SPAN = 1 << (LEVEL0_BITS + 2 * LEVEL_BITS)
+
+
+class Timer:
+    """Handle for a scheduled callback; cancel() is safe to call at any time"""
+
+    __slots__ = ("expires", "callback", "args", "_wheel", "_slot", "_level0")
+
+    def __init__(self, wheel, expires, callback, args):
+        self.expires = expires
+        self.callback = callback
+        self.args = args
+        self._wheel = wheel
+        self._slot = None
+        self._level0 = False
+
+    def cancel(self):
+        """Remove the timer if it has not fired yet. Returns True if it was pending."""
+        return self._wheel.cancel(self)
+
+    @property
+    def pending(self):
+        return self._slot is not None
+
+
+class TimerWheel:
+    """Timers with TICK resolution, all run in order on one daemon thread"""
+
+    def __init__(self, tick=TICK, clock=time.monotonic):
+        self.tick = tick
+        self._clock = clock
+        self._start = clock()
+        self._current = 0
+        self._levels = [
+            [set() for _ in range(_LEVEL0_SIZE)],
+            [set() for _ in range(_LEVEL_SIZE)],
+            [set() for _ in range(_LEVEL_SIZE)],
+        ]
+        self._overflow = set()
+        self._level0_count = 0
+        self._pending = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self.stats = {"scheduled": 0, "cancelled": 0, "fired": 0, "cascaded": 0, "wakeups": 0}
+
+    def __len__(self):
+        with self._cond:
+            return self._pending
+
+    def _place(self, timer):
+        """Put a timer in the slot for its expiry. Caller must hold the lock."""
+        # A cascaded timer can be due this very tick: its level 0 slot is processed next
+        expires = max(timer.expires, self._current)
+        delta = expires - self._current
+        timer._level0 = delta < _LEVEL0_SIZE
+        if timer._level0:
+            slot = self._levels[0][expires & _LEVEL0_MASK]
+            self._level0_count += 1
+        elif delta < _LEVEL1_SPAN:
+            slot = self._levels[1][(expires >> LEVEL0_BITS) & _LEVEL_MASK]
+        elif delta < _LEVEL2_SPAN:
+            slot = self._levels[2][(expires >> (LEVEL0_BITS + LEVEL_BITS)) & _LEVEL_MASK]
+        else:
+            slot = self._overflow
+        slot.add(timer)
+        timer._slot = slot
+
+    def _unlink(self, timer):
+        """Caller must hold the lock"""
+        timer._slot.discard(timer)
+        timer._slot = None
+        if timer._level0:
+            self._level0_count -= 1
+        self._pending -= 1
+
+    def schedule(self, delay, callback, *args):
+        """Run callback(*args) on the wheel thread after `delay` seconds; returns a Timer"""
+        with self._cond:
+            # Only the wheel thread advances the wheel (and so collects expired
+            # timers): the expiry is counted from the clock, while _place files
+            # it relative to wherever the wheel has got to
+            target = self._target_tick()
+            if not self._pending:
+                # Nothing pending that could be skipped: catch up for free
+                self._current = max(self._current, target)
+            expires = target + max(1, math.ceil(delay / self.tick))
+            timer = Timer(self, expires, callback, args)
+            self._place(timer)
+            self._pending += 1
+            self.stats["scheduled"] += 1
+            self._ensure_thread()
+            self._cond.notify_all()
+        return timer
+
+    def cancel(self, timer):
+        with self._cond:
+            if timer._slot is None:
+                return False
+            self._unlink(timer)
+            self.stats["cancelled"] += 1
+            return True
+
+    def _target_tick(self):
+        return int((self._clock() - self._start) / self.tick)
+
+    def _cascade(self, level, index):
+        """Move one slot of a higher level down to where its timers now belong"""
+        slot = self._levels[level][index] if level < 3 else self._overflow
+        if not slot:
+            return
+        timers = list(slot)
+        slot.clear()
+        for timer in timers:
+            self._place(timer)
+        self.stats["cascaded"] += len(timers)
+
+    def _step(self, expired):
+        """Advance one tick, collecting the timers that expire. Caller must hold the lock."""
+        self._current += 1
+        current = self._current
+        if current & _LEVEL0_MASK == 0:
+            index1 = (current >> LEVEL0_BITS) & _LEVEL_MASK
+            if index1 == 0:
+                index2 = (current >> (LEVEL0_BITS + LEVEL_BITS)) & _LEVEL_MASK
+                if index2 == 0:
+                    self._cascade(3, None)
+                self._cascade(2, index2)
+            self._cascade(1, index1)
+        slot = self._levels[0][current & _LEVEL0_MASK]
+        if slot:
+            for timer in list(slot):
+                if timer.expires <= current:
+                    self._unlink(timer)
+                    expired.append(timer)
+
+    def _advance_clock(self, expired=None):
+        """Catch the wheel up with the clock. Caller must hold the lock."""
+        expired = [] if expired is None else expired
+        target = self._target_tick()
+        while self._current < target:
+            if not self._pending:
+                # Nothing to fire or cascade: jump straight to the present
+                self._current = target
+                break
+            self._step(expired)
+        return expired
+
+    def _sleep_ticks(self):
+        """Ticks the thread can sleep before something may need doing. Caller must hold the lock."""
+        if not self._pending:
+            return None
+        if self._level0_count:
+            return 1
+        # Only higher levels are occupied: nothing happens before the next cascade
+        return _LEVEL0_SIZE - (self._current & _LEVEL0_MASK)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                expired = self._advance_clock()
+                while not expired:
+                    ticks = self._sleep_ticks()
+                    if ticks is None:
+                        self._cond.wait()
+                    else:
+                        deadline = self._start + (self._current + ticks) * self.tick
+                        self._cond.wait(max(0.0, deadline - self._clock()))
+                    self.stats["wakeups"] += 1
+                    expired = self._advance_clock()
+            expired.sort(key=lambda timer: timer.expires)
+            for timer in expired:
+                self.stats["fired"] += 1
+                try:
+                    timer.callback(*timer.args)
+                except Exception as e:
+                    print(f"Error in timer callback {getattr(timer.callback, '__name__', timer.callback)}: {e}")
+
+    def _ensure_thread(self):
+        """Caller must hold the lock"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="timer-wheel", daemon=True)
+            self._thread.start()
+
+
+_wheel = None
+_wheel_lock = threading.Lock()
+
+
+def get_wheel():
+    """The process-wide wheel (its thread starts with the first timer)"""
+    global _wheel
+    with _wheel_lock:
+        if _wheel is None:
+            _wheel = TimerWheel()
+        return _wheel
+
+
+def schedule(delay, callback, *args):
+    """Run callback(*args) after `delay` seconds on the shared wheel; returns a Timer"""
+    return get_wheel().schedule(delay, callback, *args)